@@ -21,6 +21,13 @@ Blood Compatibility Rules:
 - O- can receive from: O-
 """
 
+import heapq
+import math
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
 # Valid blood groups
 VALID_BLOOD_GROUPS = ["A+", "A-", "B+", "B-", "AB+", "AB-", "O+", "O-"]
 
@@ -37,6 +44,106 @@ COMPATIBILITY_MATRIX = {
 }
 
 
+# ============================================================================
+# COMPILED LOOKUP TABLES
+# ============================================================================
+# The matrix above is the source of truth. At import it is compiled into
+# integer tables so the matching hot path never does list membership tests:
+# every blood group gets a small integer code, every recipient gets an 8-bit
+# mask of compatible donor codes, and every (donor, recipient) pair gets a
+# precomputed compatibility score.
+
+# Blood group -> integer code (its position in VALID_BLOOD_GROUPS)
+BLOOD_GROUP_CODES = {blood_group: code for code, blood_group in enumerate(VALID_BLOOD_GROUPS)}
+
+# Code used for missing/invalid blood groups. Shifting any 8-bit mask by this
+# code yields 0, and score rows carry a trailing 0 for it, so lookups never
+# need a separate validity branch.
+INVALID_CODE = len(VALID_BLOOD_GROUPS)
+
+
+def _score_rule(donor_blood_group, recipient_blood_group):
+    """Scoring rules used to build SCORE_TABLE (compatible pairs only)."""
+    # Exact match gets highest score
+    if donor_blood_group == recipient_blood_group:
+        return 100
+
+    # O- is universal donor, but less preferred if not exact match
+    if donor_blood_group == "O-":
+        return 70
+
+    # O+ is common donor
+    if donor_blood_group == "O+":
+        return 80
+
+    # Other compatible matches
+    return 85
+
+
+def _compile_donor_masks():
+    """Build the per-recipient 8-bit mask of compatible donor codes."""
+    masks = []
+    for recipient_blood_group in VALID_BLOOD_GROUPS:
+        mask = 0
+        for donor_blood_group in COMPATIBILITY_MATRIX[recipient_blood_group]:
+            mask |= 1 << BLOOD_GROUP_CODES[donor_blood_group]
+        masks.append(mask)
+    return tuple(masks)
+
+
+# Recipient code -> bitmask of donor codes that can donate to it
+DONOR_MASKS = _compile_donor_masks()
+
+
+def _compile_score_table():
+    """Build the 8x8 score table indexed as SCORE_TABLE[recipient][donor]."""
+    table = []
+    for recipient_code, recipient_blood_group in enumerate(VALID_BLOOD_GROUPS):
+        row = []
+        for donor_code, donor_blood_group in enumerate(VALID_BLOOD_GROUPS):
+            if DONOR_MASKS[recipient_code] >> donor_code & 1:
+                row.append(_score_rule(donor_blood_group, recipient_blood_group))
+            else:
+                row.append(0)
+        # Trailing slot for INVALID_CODE
+        row.append(0)
+        table.append(tuple(row))
+    return tuple(table)
+
+
+# Recipient code -> tuple of scores indexed by donor code (0 = incompatible)
+SCORE_TABLE = _compile_score_table()
+
+# Donor blood group -> recipient blood groups it can donate to
+CAN_DONATE_TO = {
+    donor_blood_group: tuple(
+        recipient_blood_group
+        for recipient_code, recipient_blood_group in enumerate(VALID_BLOOD_GROUPS)
+        if DONOR_MASKS[recipient_code] >> donor_code & 1
+    )
+    for donor_code, donor_blood_group in enumerate(VALID_BLOOD_GROUPS)
+}
+
+# Donor code -> bitmask of recipient codes it can donate to (0 for INVALID_CODE)
+RECIPIENT_MASKS = tuple(
+    sum(1 << recipient_code for recipient_code in range(INVALID_CODE) if DONOR_MASKS[recipient_code] >> donor_code & 1)
+    for donor_code in range(INVALID_CODE + 1)
+)
+
+
+def get_blood_group_code(blood_group):
+    """
+    Get the integer code of a blood group.
+    
+    Args:
+        blood_group (str): Blood group to encode
+    
+    Returns:
+        int: Code in range 0-7, or INVALID_CODE if the blood group is not valid
+    """
+    return BLOOD_GROUP_CODES.get(blood_group, INVALID_CODE)
+
+
 def get_all_valid_blood_groups():
     """
     Get list of all valid blood groups.
@@ -57,7 +164,7 @@ def is_valid_blood_group(blood_group):
     Returns:
         bool: True if valid, False otherwise
     """
-    return blood_group in VALID_BLOOD_GROUPS
+    return blood_group in BLOOD_GROUP_CODES
 
 
 def is_compatible(donor_blood_group, recipient_blood_group):
@@ -71,11 +178,11 @@ def is_compatible(donor_blood_group, recipient_blood_group):
     Returns:
         bool: True if compatible, False otherwise
     """
-    if not is_valid_blood_group(donor_blood_group) or not is_valid_blood_group(recipient_blood_group):
+    recipient_code = BLOOD_GROUP_CODES.get(recipient_blood_group)
+    if recipient_code is None:
         return False
     
-    compatible_donors = COMPATIBILITY_MATRIX.get(recipient_blood_group, [])
-    return donor_blood_group in compatible_donors
+    return bool(DONOR_MASKS[recipient_code] >> get_blood_group_code(donor_blood_group) & 1)
 
 
 def get_compatible_blood_groups(recipient_blood_group):
@@ -118,15 +225,7 @@ def get_can_donate_to(donor_blood_group):
     Returns:
         list: List of blood groups the donor can donate to
     """
-    if not is_valid_blood_group(donor_blood_group):
-        return []
-    
-    can_donate_to = []
-    for recipient_bg, compatible_donors in COMPATIBILITY_MATRIX.items():
-        if donor_blood_group in compatible_donors:
-            can_donate_to.append(recipient_bg)
-    
-    return can_donate_to
+    return list(CAN_DONATE_TO.get(donor_blood_group, ()))
 
 
 def filter_compatible_donors(recipient_blood_group, donors_list):
@@ -140,14 +239,16 @@ def filter_compatible_donors(recipient_blood_group, donors_list):
     Returns:
         list: List of compatible donors
     """
-    if not is_valid_blood_group(recipient_blood_group):
+    recipient_code = BLOOD_GROUP_CODES.get(recipient_blood_group)
+    if recipient_code is None:
         return []
     
-    compatible_blood_groups = COMPATIBILITY_MATRIX.get(recipient_blood_group, [])
+    mask = DONOR_MASKS[recipient_code]
+    codes = BLOOD_GROUP_CODES
     
     compatible_donors = [
         donor for donor in donors_list
-        if donor.get("bloodGroup") in compatible_blood_groups
+        if mask >> codes.get(donor.get("bloodGroup"), INVALID_CODE) & 1
     ]
     
     return compatible_donors
@@ -165,23 +266,11 @@ def get_compatibility_score(donor_blood_group, recipient_blood_group):
     Returns:
         int: Compatibility score (0-100)
     """
-    if not is_compatible(donor_blood_group, recipient_blood_group):
+    recipient_code = BLOOD_GROUP_CODES.get(recipient_blood_group)
+    if recipient_code is None:
         return 0
     
-    # Exact match gets highest score
-    if donor_blood_group == recipient_blood_group:
-        return 100
-    
-    # O- is universal donor, but less preferred if not exact match
-    if donor_blood_group == "O-":
-        return 70
-    
-    # O+ is common donor
-    if donor_blood_group == "O+":
-        return 80
-    
-    # Other compatible matches
-    return 85
+    return SCORE_TABLE[recipient_code][get_blood_group_code(donor_blood_group)]
 
 
 def get_donation_stats(donor_blood_group):
@@ -213,6 +302,248 @@ def get_donation_stats(donor_blood_group):
     }
 
 
+# ============================================================================
+# PRECOMPUTED PAYLOADS
+# ============================================================================
+# There are only 8 blood groups, so the compatibility and donation-stats
+# payloads attached to every donor and request are built once at import and
+# shared by reference. They are read-only so a shared payload can never be
+# changed through one row and leak into the others.
+
+
+class ReadOnlyDict(dict):
+    """A dict that rejects mutation; serializes to JSON like a plain dict."""
+    
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("shared compatibility payloads are read-only")
+    
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    
+    def __reduce__(self):
+        return (type(self), (dict(self),))
+    
+    def __copy__(self):
+        return self
+    
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _freeze(payload):
+    """Turn a payload dict into a ReadOnlyDict with tuple values instead of lists."""
+    return ReadOnlyDict({
+        key: tuple(value) if isinstance(value, list) else value
+        for key, value in payload.items()
+    })
+
+
+# Recipient blood group -> shared get_compatible_blood_groups() payload
+COMPATIBILITY_INFO = {
+    blood_group: _freeze(get_compatible_blood_groups(blood_group))
+    for blood_group in VALID_BLOOD_GROUPS
+}
+
+# Donor blood group -> shared get_donation_stats() payload
+DONATION_STATS = {
+    blood_group: _freeze(get_donation_stats(blood_group))
+    for blood_group in VALID_BLOOD_GROUPS
+}
+
+INVALID_DONATION_STATS = _freeze(get_donation_stats(None))
+
+
+def get_shared_compatibility_info(recipient_blood_group):
+    """
+    Get the shared, read-only compatibility payload for a recipient blood group.
+    
+    Args:
+        recipient_blood_group (str): Blood group of the recipient
+    
+    Returns:
+        dict: Same content as get_compatible_blood_groups(), without allocating
+    """
+    info = COMPATIBILITY_INFO.get(recipient_blood_group)
+    if info is None:
+        # Invalid payloads echo the requested value, so they cannot be shared
+        return get_compatible_blood_groups(recipient_blood_group)
+    return info
+
+
+def get_shared_donation_stats(donor_blood_group):
+    """
+    Get the shared, read-only donation stats payload for a donor blood group.
+    
+    Args:
+        donor_blood_group (str): Blood group of the donor
+    
+    Returns:
+        dict: Same content as get_donation_stats(), without allocating
+    """
+    return DONATION_STATS.get(donor_blood_group, INVALID_DONATION_STATS)
+
+
+# ============================================================================
+# DONOR UNAVAILABILITY
+# ============================================================================
+# Donors block out dates ({"date": "YYYY-MM-DD", "reason": ..., "id": ...},
+# optionally with an inclusive "endDate"). The entries are compiled once into
+# merged, sorted day intervals so checking a date is a binary search however
+# many dates a donor has blocked.
+
+
+def _to_day(value):
+    """Convert a date, datetime or ISO date/datetime string to a day ordinal."""
+    if isinstance(value, datetime):
+        return value.date().toordinal()
+    if isinstance(value, date):
+        return value.toordinal()
+    if isinstance(value, str):
+        return date.fromisoformat(value[:10]).toordinal()
+    raise ValueError(f"Invalid date: {value!r}")
+
+
+class UnavailableDates(list):
+    """
+    A donor's unavailable-date entries with a compiled interval index.
+    
+    Behaves (and serializes) as the read-only list of entries it was built
+    from; blocks() answers whether a day is covered in O(log n).
+    
+    Raises:
+        ValueError: If an entry has a missing or malformed date, or ends
+            before it starts
+    """
+    
+    __slots__ = ("_starts", "_ends")
+    
+    def __init__(self, entries=()):
+        super().__init__(entries)
+        intervals = []
+        for entry in self:
+            if isinstance(entry, dict):
+                start = _to_day(entry.get("date"))
+                end = _to_day(entry["endDate"]) if entry.get("endDate") else start
+            else:
+                start = end = _to_day(entry)
+            if end < start:
+                raise ValueError(f"Unavailable period ends before it starts: {entry!r}")
+            intervals.append((start, end))
+        intervals.sort()
+        
+        # Merge overlapping and adjacent intervals
+        starts = []
+        ends = []
+        for start, end in intervals:
+            if ends and start <= ends[-1] + 1:
+                ends[-1] = max(ends[-1], end)
+            else:
+                starts.append(start)
+                ends.append(end)
+        self._starts = starts
+        self._ends = ends
+    
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("unavailable dates are replaced as a whole, not modified")
+    
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+    
+    def __reduce__(self):
+        return (type(self), (list(self),))
+    
+    def intervals(self):
+        """
+        Get the merged unavailable periods.
+        
+        Returns:
+            list: (start, end) date pairs, inclusive and sorted
+        """
+        return [
+            (date.fromordinal(start), date.fromordinal(end))
+            for start, end in zip(self._starts, self._ends)
+        ]
+    
+    def blocks(self, day):
+        """
+        Check whether a day falls in an unavailable period.
+        
+        Args:
+            day (date or int): Date, or day ordinal as returned by date.toordinal()
+        
+        Returns:
+            bool: True if the donor is unavailable that day
+        """
+        if not isinstance(day, int):
+            day = _to_day(day)
+        position = bisect_right(self._starts, day) - 1
+        return position >= 0 and day <= self._ends[position]
+
+
+NO_UNAVAILABLE_DATES = UnavailableDates()
+
+
+def get_unavailable_dates(donor):
+    """
+    Get a donor's compiled unavailable dates.
+    
+    Records already hold an UnavailableDates; plain dicts are compiled on
+    the fly, and donors with no or malformed entries are never blocked.
+    
+    Args:
+        donor (dict): Donor with optional 'unavailableDates' key
+    
+    Returns:
+        UnavailableDates: Compiled entries
+    """
+    entries = donor.get("unavailableDates")
+    if isinstance(entries, UnavailableDates):
+        return entries
+    if not entries:
+        return NO_UNAVAILABLE_DATES
+    try:
+        return UnavailableDates(entries)
+    except (TypeError, ValueError):
+        return NO_UNAVAILABLE_DATES
+
+
+def get_request_day(blood_request):
+    """
+    Get the day a blood request needs donors, as a day ordinal.
+    
+    This is the request's 'requiredDate', else the day it was created, else today.
+    
+    Args:
+        blood_request (dict): Request with optional 'requiredDate' / 'createdAt' keys
+    
+    Returns:
+        int: Day ordinal (date.toordinal())
+    """
+    for key in ("requiredDate", "createdAt"):
+        value = blood_request.get(key)
+        if value:
+            try:
+                return _to_day(value)
+            except ValueError:
+                pass
+    return date.today().toordinal()
+
+
+def is_unavailable_on(donor, day):
+    """
+    Check whether a donor has blocked out a day.
+    
+    Args:
+        donor (dict): Donor with optional 'unavailableDates' key
+        day (date or int): Date, or day ordinal
+    
+    Returns:
+        bool: True if the donor is unavailable that day
+    """
+    entries = donor.get("unavailableDates")
+    return bool(entries) and get_unavailable_dates(donor).blocks(day)
+
+
 def match_donors_to_request(blood_request, available_donors):
     """
     Match and rank donors for a specific blood request.
@@ -222,29 +553,1256 @@ def match_donors_to_request(blood_request, available_donors):
         available_donors (list): List of available donors with 'bloodGroup' and 'available' keys
     
     Returns:
-        list: List of matched donors sorted by compatibility score
+        list: List of matched donors sorted by compatibility score; donors
+        unavailable on the request day (get_request_day()) are left out
     """
     recipient_blood_group = blood_request.get("bloodGroup")
+    recipient_code = BLOOD_GROUP_CODES.get(recipient_blood_group)
     
-    if not is_valid_blood_group(recipient_blood_group):
+    if recipient_code is None:
         return []
     
-    # Filter compatible and available donors
+    scores = SCORE_TABLE[recipient_code]
+    codes = BLOOD_GROUP_CODES
+    day = get_request_day(blood_request)
+    
+    # Filter compatible and available donors (score 0 means incompatible)
     matched_donors = []
     for donor in available_donors:
         if not donor.get("available", False):
             continue
         
         donor_blood_group = donor.get("bloodGroup")
-        if is_compatible(donor_blood_group, recipient_blood_group):
-            score = get_compatibility_score(donor_blood_group, recipient_blood_group)
-            matched_donors.append({
-                **donor,
-                "compatibility_score": score,
-                "exact_match": donor_blood_group == recipient_blood_group
-            })
+        score = scores[codes.get(donor_blood_group, INVALID_CODE)]
+        if score and not is_unavailable_on(donor, day):
+            matched_donors.append(_matched_donor(donor, score, donor_blood_group == recipient_blood_group))
     
     # Sort by compatibility score (descending)
     matched_donors.sort(key=lambda x: x["compatibility_score"], reverse=True)
     
     return matched_donors
+
+
+# Recipient code -> ((score, donor codes), ...) ordered from best to worst score
+SCORE_TIERS = tuple(
+    tuple(
+        (score, tuple(donor_code for donor_code in range(INVALID_CODE) if row[donor_code] == score))
+        for score in sorted({s for s in row if s}, reverse=True)
+    )
+    for row in SCORE_TABLE
+)
+
+
+def _matched_donor(donor, score, exact_match):
+    """Build the matched-donor entry returned by the matching functions."""
+    return {
+        **donor,
+        "compatibility_score": score,
+        "exact_match": exact_match
+    }
+
+
+def match_top_donors(blood_request, donors_list, limit):
+    """
+    Match only the best `limit` donors for a blood request.
+    
+    Equivalent to match_donors_to_request(blood_request, donors_list)[:limit],
+    but each score tier is capped at `limit` donors, the scan stops as soon as
+    the best tier is full, and only the returned donors are copied.
+    
+    Args:
+        blood_request (dict): Request with 'bloodGroup' key
+        donors_list (list): List of donors with 'bloodGroup' and 'available' keys
+        limit (int): Maximum number of matches to return
+    
+    Returns:
+        list: Up to `limit` matched donors sorted by compatibility score
+    """
+    recipient_code = BLOOD_GROUP_CODES.get(blood_request.get("bloodGroup"))
+    if recipient_code is None or limit <= 0:
+        return []
+    
+    scores = SCORE_TABLE[recipient_code]
+    codes = BLOOD_GROUP_CODES
+    score_tiers = SCORE_TIERS[recipient_code]
+    day = get_request_day(blood_request)
+    tiers = {score: [] for score, _ in score_tiers}
+    best_tier = tiers[score_tiers[0][0]]
+    for donor in donors_list:
+        if not donor.get("available", False):
+            continue
+        score = scores[codes.get(donor.get("bloodGroup"), INVALID_CODE)]
+        if score and not is_unavailable_on(donor, day):
+            tier = tiers[score]
+            if len(tier) < limit:
+                tier.append(donor)
+                if len(best_tier) == limit:
+                    # Nothing later in the list can outrank a full best tier
+                    break
+    
+    matched_donors = []
+    for score, donor_codes in score_tiers:
+        exact_match = recipient_code in donor_codes
+        for donor in tiers[score]:
+            if len(matched_donors) == limit:
+                return matched_donors
+            matched_donors.append(_matched_donor(donor, score, exact_match))
+    return matched_donors
+
+
+# SCORE_TABLE as an array for vectorized scoring: SCORE_ARRAY[recipient_code, donor_code]
+SCORE_ARRAY = np.array(SCORE_TABLE, dtype=np.int16)
+
+
+def match_many(blood_requests, donors_list, limit=None, radius_km=None):
+    """
+    Match and rank donors for many blood requests in one pass over the donors.
+    
+    Donor blood groups are encoded once into an integer array (unavailable
+    donors get INVALID_CODE), and every distinct recipient group in the batch
+    is scored against all donors at once by indexing SCORE_ARRAY. Requests for
+    the same blood group, day and location share the work.
+    
+    Requests with coordinates are ranked nearest first like
+    DonorIndex.match_nearby(), with the distances to all donors computed in
+    one vectorized haversine per location.
+    
+    Args:
+        blood_requests (list): Requests with 'bloodGroup' key and optional
+            'latitude'/'longitude' keys
+        donors_list (list): List of donors with 'bloodGroup' and 'available' keys
+        limit (int): Maximum number of matches per request, or None for all
+        radius_km (float): Maximum distance for located requests, or None
+            for no bound
+    
+    Returns:
+        list: One list of matched donors per request, in request order. For
+        requests without coordinates each equals
+        match_donors_to_request(blood_request, donors_list)[:limit]; located
+        requests also get 'distance_km'
+    """
+    request_keys = [
+        (BLOOD_GROUP_CODES.get(blood_request.get("bloodGroup")), get_request_day(blood_request), get_coordinates(blood_request))
+        for blood_request in blood_requests
+    ]
+    wanted = sorted({code for code, _, _ in request_keys if code is not None})
+    
+    matches_by_key = {}
+    if wanted and donors_list:
+        codes = BLOOD_GROUP_CODES
+        donor_codes = np.fromiter(
+            (
+                codes.get(donor.get("bloodGroup"), INVALID_CODE) if donor.get("available", False) else INVALID_CODE
+                for donor in donors_list
+            ),
+            dtype=np.intp,
+            count=len(donors_list)
+        )
+        # (groups in batch) x (donors) score matrix in a single gather
+        scores = dict(zip(wanted, SCORE_ARRAY[wanted][:, donor_codes]))
+        
+        # Only donors with blocked dates need a per-day check
+        scheduled = [
+            (position, get_unavailable_dates(donor))
+            for position, donor in enumerate(donors_list)
+            if donor_codes[position] != INVALID_CODE and donor.get("unavailableDates")
+        ]
+        
+        donor_points = None
+        if any(coordinates is not None for _, _, coordinates in request_keys):
+            # Donors without coordinates get NaN and never compare as near
+            donor_points = np.radians(np.array(
+                [get_coordinates(donor) or (np.nan, np.nan) for donor in donors_list],
+                dtype=np.float64
+            ))
+        
+        for key in set(request_keys):
+            recipient_code, day, coordinates = key
+            if recipient_code is None:
+                continue
+            row = scores[recipient_code]
+            blocked = [position for position, unavailable in scheduled if unavailable.blocks(day)]
+            if blocked:
+                row = row.copy()
+                row[blocked] = 0
+            
+            # Positions come out ascending per tier, so concatenating tiers in
+            # score order gives the stable ranking without sorting
+            ranked = np.concatenate([np.flatnonzero(row == score) for score, _ in SCORE_TIERS[recipient_code]])
+            if coordinates is None:
+                if limit is not None:
+                    ranked = ranked[:limit]
+                matches_by_key[key] = [
+                    _matched_donor(donors_list[position], int(row[position]), bool(donor_codes[position] == recipient_code))
+                    for position in ranked.tolist()
+                ]
+                continue
+            
+            distances = _haversine_array_km(*coordinates, donor_points[ranked, 0], donor_points[ranked, 1])
+            near = ~np.isnan(distances)
+            if radius_km is not None:
+                near &= distances <= radius_km
+            located = ranked[near]
+            # Nearest first, then by score and donor position like match_nearby()
+            order = np.lexsort((located, -row[located], distances[near]))
+            matched_donors = []
+            for position, distance in zip(located[order].tolist(), distances[near][order].tolist()):
+                matched = _matched_donor(donors_list[position], int(row[position]), bool(donor_codes[position] == recipient_code))
+                matched["distance_km"] = round(distance, 2)
+                matched_donors.append(matched)
+            if radius_km is None:
+                for position in ranked[np.isnan(distances)].tolist():
+                    matched = _matched_donor(donors_list[position], int(row[position]), bool(donor_codes[position] == recipient_code))
+                    matched["distance_km"] = None
+                    matched_donors.append(matched)
+            matches_by_key[key] = matched_donors if limit is None else matched_donors[:limit]
+    
+    return [list(matches_by_key.get(key, ())) for key in request_keys]
+
+
+# Mean Earth radius used for great-circle distances
+EARTH_RADIUS_KM = 6371.0
+
+# Side of a spatial grid cell in degrees (about 55 km of latitude)
+GRID_CELL_DEGREES = 0.5
+
+# First radius tried by nearest-K searches; doubled until enough items are found
+INITIAL_SEARCH_KM = 10.0
+
+
+def haversine_km(latitude1, longitude1, latitude2, longitude2):
+    """
+    Great-circle distance between two points.
+    
+    Args:
+        latitude1, longitude1 (float): First point in degrees
+        latitude2, longitude2 (float): Second point in degrees
+    
+    Returns:
+        float: Distance in kilometres
+    """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    half_dphi = (phi2 - phi1) / 2
+    half_dlambda = math.radians(longitude2 - longitude1) / 2
+    a = math.sin(half_dphi) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(half_dlambda) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _haversine_array_km(latitude, longitude, latitudes, longitudes):
+    """haversine_km() from one point (in degrees) to arrays of points in radians."""
+    phi1 = math.radians(latitude)
+    half_dphi = (latitudes - phi1) / 2
+    half_dlambda = (longitudes - math.radians(longitude)) / 2
+    a = np.sin(half_dphi) ** 2 + math.cos(phi1) * np.cos(latitudes) * np.sin(half_dlambda) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def get_coordinates(record):
+    """
+    Get the (latitude, longitude) of a donor, hospital or request.
+    
+    Args:
+        record (dict): Record with optional 'latitude' and 'longitude' keys
+    
+    Returns:
+        tuple: (latitude, longitude), or None if the record has no location
+    """
+    latitude = record.get("latitude")
+    longitude = record.get("longitude")
+    if latitude is None or longitude is None:
+        return None
+    return latitude, longitude
+
+
+class SpatialIndex:
+    """
+    Items bucketed into a latitude/longitude grid for radius and nearest-K queries.
+    
+    Queries only visit the grid cells overlapping the bounding box of the
+    search circle, so their cost depends on how many items are nearby rather
+    than on the total number of items. Items are tracked by object identity.
+    """
+    
+    ROWS = int(math.ceil(180 / GRID_CELL_DEGREES))
+    COLUMNS = int(math.ceil(360 / GRID_CELL_DEGREES))
+    
+    def __init__(self):
+        # (row, column) -> {id(item): (latitude, longitude, item)}
+        self._cells = {}
+        # id(item) -> (row, column)
+        self._locations = {}
+    
+    def __len__(self):
+        return len(self._locations)
+    
+    def __contains__(self, item):
+        return id(item) in self._locations
+    
+    @classmethod
+    def _row(cls, latitude):
+        return min(cls.ROWS - 1, max(0, int((latitude + 90) // GRID_CELL_DEGREES)))
+    
+    @classmethod
+    def _column(cls, longitude):
+        return int((longitude + 180) // GRID_CELL_DEGREES) % cls.COLUMNS
+    
+    def add(self, item, latitude, longitude):
+        """
+        Add an item at a location, or move it there if already present.
+        
+        Args:
+            item: Item to index
+            latitude (float): Latitude in degrees
+            longitude (float): Longitude in degrees
+        """
+        self.remove(item)
+        cell = (self._row(latitude), self._column(longitude))
+        self._cells.setdefault(cell, {})[id(item)] = (latitude, longitude, item)
+        self._locations[id(item)] = cell
+    
+    def remove(self, item):
+        """
+        Remove an item from the index (no-op if it is not indexed).
+        
+        Args:
+            item: Item previously passed to add()
+        """
+        cell = self._locations.pop(id(item), None)
+        if cell is not None:
+            entries = self._cells[cell]
+            del entries[id(item)]
+            if not entries:
+                del self._cells[cell]
+    
+    def _candidate_cells(self, latitude, longitude, radius_km):
+        """Occupied cells that may hold items within radius_km of the point."""
+        angle = radius_km / EARTH_RADIUS_KM
+        delta_latitude = math.degrees(angle)
+        low_row = self._row(latitude - delta_latitude)
+        high_row = self._row(latitude + delta_latitude)
+        
+        if angle >= math.pi / 2 or abs(latitude) + delta_latitude >= 90:
+            # The circle reaches a pole: every longitude is in range
+            columns = None
+        else:
+            delta_longitude = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+            low_column = int((longitude - delta_longitude + 180) // GRID_CELL_DEGREES)
+            high_column = int((longitude + delta_longitude + 180) // GRID_CELL_DEGREES)
+            if high_column - low_column + 1 >= self.COLUMNS:
+                columns = None
+            else:
+                columns = {column % self.COLUMNS for column in range(low_column, high_column + 1)}
+        
+        box_size = (high_row - low_row + 1) * (self.COLUMNS if columns is None else len(columns))
+        if box_size >= len(self._cells):
+            # Fewer occupied cells than cells in the box: filter the occupied ones
+            return [
+                entries for (row, column), entries in self._cells.items()
+                if low_row <= row <= high_row and (columns is None or column in columns)
+            ]
+        
+        cells = self._cells
+        return [
+            cells[(row, column)]
+            for row in range(low_row, high_row + 1)
+            for column in (range(self.COLUMNS) if columns is None else columns)
+            if (row, column) in cells
+        ]
+    
+    def within(self, latitude, longitude, radius_km, accept=None):
+        """
+        Get the items within a radius of a point, nearest first.
+        
+        Args:
+            latitude (float): Latitude of the centre in degrees
+            longitude (float): Longitude of the centre in degrees
+            radius_km (float): Search radius in kilometres
+            accept (callable): Optional predicate items must satisfy
+        
+        Returns:
+            list: (distance_km, item) pairs sorted by distance
+        """
+        found = []
+        for entries in self._candidate_cells(latitude, longitude, radius_km):
+            for item_latitude, item_longitude, item in entries.values():
+                distance = haversine_km(latitude, longitude, item_latitude, item_longitude)
+                if distance <= radius_km and (accept is None or accept(item)):
+                    found.append((distance, item))
+        found.sort(key=lambda pair: pair[0])
+        return found
+    
+    def nearest(self, latitude, longitude, limit=None, radius_km=None, accept=None):
+        """
+        Get the items nearest to a point.
+        
+        The search radius starts at INITIAL_SEARCH_KM and doubles until
+        `limit` items are found (or radius_km / the whole globe is covered),
+        so only the neighbourhood of the point is visited.
+        
+        Args:
+            latitude (float): Latitude of the point in degrees
+            longitude (float): Longitude of the point in degrees
+            limit (int): Maximum number of items, or None for all
+            radius_km (float): Maximum distance in kilometres, or None for no bound
+            accept (callable): Optional predicate items must satisfy
+        
+        Returns:
+            list: Up to `limit` (distance_km, item) pairs sorted by distance
+        """
+        max_radius = math.pi * EARTH_RADIUS_KM if radius_km is None else radius_km
+        if limit is None or limit >= len(self):
+            return self.within(latitude, longitude, max_radius, accept)[:limit]
+        
+        radius = min(INITIAL_SEARCH_KM, max_radius)
+        while True:
+            found = self.within(latitude, longitude, radius, accept)
+            if len(found) >= limit or radius >= max_radius:
+                return found[:limit]
+            radius = min(radius * 2, max_radius)
+
+
+class DonorIndex:
+    """
+    Donors bucketed by blood group code and availability.
+    
+    Matching only visits the buckets of available donors whose blood group is
+    compatible with the request, tier by tier in score order, so its cost is
+    proportional to the number of matched donors rather than to the total
+    number of registered donors.
+    
+    Donors are tracked by object identity, so callers must pass the same dict
+    to add(), update() and remove(). Ties within a score tier keep the order
+    in which donors were first added, matching match_donors_to_request().
+    
+    Callers should call update() after any change to an indexed donor, not
+    only blood group or availability changes, so that subscribers such as
+    MatchCache can refresh the copies they hold.
+    
+    Available donors with 'latitude'/'longitude' are also kept in a spatial
+    index per blood group for match_nearby().
+    
+    Deferred donors (see defer() and EligibilityScheduler) are bucketed as
+    unavailable until they are released, whatever their 'available' flag.
+    """
+    
+    def __init__(self, donors=None):
+        # buckets[code][available] -> {sequence: donor}
+        self._buckets = [({}, {}) for _ in range(INVALID_CODE + 1)]
+        # located[code] -> available donors of that group with coordinates
+        self._located = [SpatialIndex() for _ in range(INVALID_CODE + 1)]
+        # ids of donors deferred after a recent donation
+        self._deferred = set()
+        # id(donor) -> (code, available, sequence)
+        self._entries = {}
+        self._next_sequence = 0
+        self._listeners = []
+        for donor in donors or ():
+            self.add(donor)
+    
+    def subscribe(self, listener):
+        """
+        Register a callback invoked after every add(), update() and remove().
+        
+        The callback receives (donor, old_code, old_available, code, available);
+        old_code is None for added donors and code is None for removed donors.
+        
+        Args:
+            listener (callable): Callback to register
+        """
+        self._listeners.append(listener)
+    
+    def _notify(self, donor, old_code, old_available, code, available):
+        for listener in self._listeners:
+            listener(donor, old_code, old_available, code, available)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, donor):
+        return id(donor) in self._entries
+    
+    def _matchable(self, donor):
+        return bool(donor.get("available", False)) and id(donor) not in self._deferred
+    
+    def defer(self, donor):
+        """
+        Take a donor out of matching until release() is called.
+        
+        Args:
+            donor (dict): Donor to defer (added to the index if needed)
+        """
+        self._deferred.add(id(donor))
+        self.update(donor)
+    
+    def release(self, donor):
+        """
+        Make a deferred donor matchable again (subject to its 'available' flag).
+        
+        Args:
+            donor (dict): Donor previously passed to defer()
+        """
+        if id(donor) in self._deferred:
+            self._deferred.discard(id(donor))
+            self.update(donor)
+    
+    def is_deferred(self, donor):
+        """Check whether a donor is currently deferred."""
+        return id(donor) in self._deferred
+    
+    def add(self, donor):
+        """
+        Add a donor to the index, or refresh its bucket if already present.
+        
+        Args:
+            donor (dict): Donor with 'bloodGroup' and 'available' keys
+        """
+        entry = self._entries.get(id(donor))
+        if entry is not None:
+            self.update(donor)
+            return
+        
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        code = get_blood_group_code(donor.get("bloodGroup"))
+        available = self._matchable(donor)
+        self._buckets[code][available][sequence] = donor
+        self._entries[id(donor)] = (code, available, sequence)
+        self._locate(donor, code, available)
+        self._notify(donor, None, False, code, available)
+    
+    def update(self, donor):
+        """
+        Move a donor to the bucket matching its current blood group and availability.
+        
+        Args:
+            donor (dict): Donor previously passed to add()
+        
+        Returns:
+            bool: True if the donor changed bucket, False otherwise
+        """
+        entry = self._entries.get(id(donor))
+        if entry is None:
+            self.add(donor)
+            return True
+        
+        old_code, old_available, sequence = entry
+        code = get_blood_group_code(donor.get("bloodGroup"))
+        available = self._matchable(donor)
+        moved = code != old_code or available != old_available
+        if moved:
+            del self._buckets[old_code][old_available][sequence]
+            self._buckets[code][available][sequence] = donor
+            self._entries[id(donor)] = (code, available, sequence)
+        
+        # Coordinates may have changed even if the bucket did not
+        self._located[old_code].remove(donor)
+        self._locate(donor, code, available)
+        self._notify(donor, old_code, old_available, code, available)
+        return moved
+    
+    def remove(self, donor):
+        """
+        Remove a donor from the index.
+        
+        Args:
+            donor (dict): Donor previously passed to add()
+        """
+        entry = self._entries.pop(id(donor), None)
+        self._deferred.discard(id(donor))
+        if entry is not None:
+            code, available, sequence = entry
+            del self._buckets[code][available][sequence]
+            self._located[code].remove(donor)
+            self._notify(donor, code, available, None, False)
+    
+    def _locate(self, donor, code, available):
+        coordinates = get_coordinates(donor)
+        if available and coordinates is not None:
+            self._located[code].add(donor, *coordinates)
+    
+    def count(self, blood_group=None, available=None):
+        """
+        Count indexed donors, optionally restricted to a blood group and/or availability.
+        
+        Args:
+            blood_group (str): Blood group to count, or None for all groups
+            available (bool): Availability to count, or None for both
+        
+        Returns:
+            int: Number of matching donors
+        """
+        codes = range(INVALID_CODE + 1) if blood_group is None else (get_blood_group_code(blood_group),)
+        flags = (False, True) if available is None else (bool(available),)
+        return sum(len(self._buckets[code][flag]) for code in codes for flag in flags)
+    
+    def compatible_donors(self, *recipient_blood_groups):
+        """
+        Available donors who can give to any of the recipient blood groups.
+        
+        Only the compatible buckets are read. The donors come back in
+        registration order, so match_many() over them ranks like match().
+        
+        Args:
+            *recipient_blood_groups (str): Blood groups needed
+        
+        Returns:
+            list: Available compatible donors
+        """
+        donor_codes = {
+            donor_code
+            for recipient_blood_group in recipient_blood_groups
+            if recipient_blood_group in BLOOD_GROUP_CODES
+            for _, codes in SCORE_TIERS[BLOOD_GROUP_CODES[recipient_blood_group]]
+            for donor_code in codes
+        }
+        entries = [entry for donor_code in donor_codes for entry in self._buckets[donor_code][True].items()]
+        entries.sort()
+        return [donor for _, donor in entries]
+    
+    def iter_matches(self, recipient_blood_group, limit=None, day=None):
+        """
+        Lazily yield available compatible donors in ranked order, without copying them.
+        
+        Tiers are produced one at a time, best score first; donors within a
+        tier are in registration order. With a limit, only the best `limit`
+        donors of the last tier needed are selected (heap selection, no full sort).
+        
+        Args:
+            recipient_blood_group (str): Blood group needed
+            limit (int): Maximum number of donors to yield, or None for all
+            day (int): Day ordinal on which donors must not be unavailable,
+                or None to ignore unavailable dates
+        
+        Yields:
+            tuple: (donor, compatibility_score, exact_match)
+        """
+        recipient_code = BLOOD_GROUP_CODES.get(recipient_blood_group)
+        if recipient_code is None:
+            return
+        
+        remaining = limit
+        buckets = self._buckets
+        for score, donor_codes in SCORE_TIERS[recipient_code]:
+            if remaining is not None and remaining <= 0:
+                return
+            
+            tier = []
+            for donor_code in donor_codes:
+                tier.extend(buckets[donor_code][True].items())
+            if day is not None:
+                tier = [entry for entry in tier if not is_unavailable_on(entry[1], day)]
+            if not tier:
+                continue
+            
+            if remaining is not None and remaining < len(tier):
+                tier = heapq.nsmallest(remaining, tier)
+            else:
+                tier.sort()
+            if remaining is not None:
+                remaining -= len(tier)
+            
+            exact_match = recipient_code in donor_codes
+            for _, donor in tier:
+                yield donor, score, exact_match
+    
+    def match(self, blood_request, limit=None):
+        """
+        Match and rank indexed donors for a specific blood request.
+        
+        Args:
+            blood_request (dict): Request with 'bloodGroup' key
+            limit (int): Maximum number of matches to return, or None for all
+        
+        Returns:
+            list: Same result as match_donors_to_request() over the indexed
+            donors, truncated to `limit` entries
+        """
+        day = get_request_day(blood_request)
+        return [
+            _matched_donor(donor, score, exact_match)
+            for donor, score, exact_match in self.iter_matches(blood_request.get("bloodGroup"), limit, day)
+        ]
+    
+    def match_nearby(self, blood_request, latitude, longitude, radius_km=None, limit=None):
+        """
+        Match indexed donors for a blood request, nearest first.
+        
+        Only the spatial indexes of compatible blood groups are searched, each
+        for its `limit` nearest available donors. Donors at the same distance
+        are ranked by compatibility score, then registration order. Without
+        a radius, available compatible donors without coordinates follow the
+        located ones in match() order, so nobody is dropped.
+        
+        Args:
+            blood_request (dict): Request with 'bloodGroup' key
+            latitude (float): Latitude of the request in degrees
+            longitude (float): Longitude of the request in degrees
+            radius_km (float): Maximum distance in kilometres, or None for no bound
+            limit (int): Maximum number of matches to return, or None for all
+        
+        Returns:
+            list: Matched donors as returned by match(), plus a 'distance_km'
+            key (None for donors without coordinates)
+        """
+        recipient_code = BLOOD_GROUP_CODES.get(blood_request.get("bloodGroup"))
+        if recipient_code is None or (limit is not None and limit <= 0):
+            return []
+        
+        day = get_request_day(blood_request)
+        
+        def accept(donor):
+            return not is_unavailable_on(donor, day)
+        
+        entries = self._entries
+        candidates = []
+        for score, donor_codes in SCORE_TIERS[recipient_code]:
+            for donor_code in donor_codes:
+                exact_match = donor_code == recipient_code
+                located = self._located[donor_code]
+                for distance, donor in located.nearest(latitude, longitude, limit, radius_km, accept):
+                    candidates.append((distance, -score, entries[id(donor)][2], exact_match, donor))
+        
+        if limit is not None and limit < len(candidates):
+            candidates = heapq.nsmallest(limit, candidates, key=lambda candidate: candidate[:3])
+        else:
+            candidates.sort(key=lambda candidate: candidate[:3])
+        
+        matched_donors = []
+        for distance, negative_score, _, exact_match, donor in candidates:
+            matched = _matched_donor(donor, -negative_score, exact_match)
+            matched["distance_km"] = round(distance, 2)
+            matched_donors.append(matched)
+        
+        if radius_km is None:
+            for donor, score, exact_match in self.iter_matches(blood_request.get("bloodGroup"), day=day):
+                if limit is not None and len(matched_donors) >= limit:
+                    break
+                if get_coordinates(donor) is None:
+                    matched = _matched_donor(donor, score, exact_match)
+                    matched["distance_km"] = None
+                    matched_donors.append(matched)
+        
+        return matched_donors
+
+
+class MatchCache:
+    """
+    Cached matched-donor lists for open blood requests.
+    
+    Each tracked request keeps the result of DonorIndex.match() until a donor
+    that is (or was) available and compatible with it changes. Changes are
+    received from the donor index, and only the requests whose recipient blood
+    group the donor can donate to are invalidated; they are rematched from
+    the index on their next read. Requests that are no longer open should be
+    discarded.
+    """
+    
+    def __init__(self, donor_index):
+        self._donor_index = donor_index
+        # request id -> blood request
+        self._requests = {}
+        # request id -> (limit, cached matches); missing when stale
+        self._matches = {}
+        # recipient code -> ids of tracked requests for that blood group
+        self._by_recipient = [set() for _ in range(INVALID_CODE + 1)]
+        donor_index.subscribe(self._donor_changed)
+    
+    def __len__(self):
+        return len(self._requests)
+    
+    def __contains__(self, request_id):
+        return request_id in self._requests
+    
+    def track(self, request_id, blood_request, matches=None, limit=None):
+        """
+        Start caching matches for a blood request.
+        
+        Args:
+            request_id: Unique id of the request
+            blood_request (dict): Request with 'bloodGroup' key
+            matches (list): Its current DonorIndex.match() result, if already
+                computed (e.g. by match_many()), or None to match on first read
+            limit (int): The limit `matches` was computed with
+        """
+        self.discard(request_id)
+        self._requests[request_id] = blood_request
+        self._by_recipient[get_blood_group_code(blood_request.get("bloodGroup"))].add(request_id)
+        if matches is not None:
+            self._matches[request_id] = (limit, matches)
+    
+    def discard(self, request_id):
+        """
+        Stop caching matches for a request (e.g. once it is fulfilled or closed).
+        
+        Args:
+            request_id: Unique id of the request
+        """
+        blood_request = self._requests.pop(request_id, None)
+        if blood_request is not None:
+            self._matches.pop(request_id, None)
+            self._by_recipient[get_blood_group_code(blood_request.get("bloodGroup"))].discard(request_id)
+    
+    def get(self, request_id, limit=None):
+        """
+        Get the matched donors for a tracked request, rematching it if stale.
+        
+        A cached top-K result answers any later call with a limit up to K;
+        a smaller cached result is replaced by a rematch.
+        
+        Args:
+            request_id: Unique id of a tracked request
+            limit (int): Maximum number of matches to return, or None for all
+        
+        Returns:
+            list: Matched donors as returned by DonorIndex.match(). The list is
+            shared between calls and must not be modified.
+        """
+        cached = self._matches.get(request_id)
+        if cached is not None:
+            cached_limit, matches = cached
+            if cached_limit is None or len(matches) < cached_limit:
+                # Complete result
+                return matches if limit is None else matches[:limit]
+            if limit is not None and limit <= cached_limit:
+                return matches if limit == cached_limit else matches[:limit]
+        
+        matches = self._donor_index.match(self._requests[request_id], limit)
+        self._matches[request_id] = (limit, matches)
+        return matches
+    
+    def get_many(self, request_ids, limit=None):
+        """
+        Get the matched donors for several tracked requests at once.
+        
+        Stale requests are grouped by blood group and required day, and each
+        group is matched against the donor index only once.
+        
+        Args:
+            request_ids (list): Ids of tracked requests
+            limit (int): Maximum number of matches per request, or None for all
+        
+        Returns:
+            list: One list of matched donors per request id, in the same order
+        """
+        fresh = {}
+        for request_id in request_ids:
+            if request_id in self._matches:
+                continue
+            blood_request = self._requests[request_id]
+            key = (blood_request.get("bloodGroup"), get_request_day(blood_request))
+            if key not in fresh:
+                fresh[key] = self._donor_index.match(blood_request, limit)
+            self._matches[request_id] = (limit, fresh[key])
+        return [self.get(request_id, limit) for request_id in request_ids]
+    
+    def _donor_changed(self, donor, old_code, old_available, code, available):
+        affected = 0
+        if old_available and old_code is not None:
+            affected |= RECIPIENT_MASKS[old_code]
+        if available and code is not None:
+            affected |= RECIPIENT_MASKS[code]
+        
+        recipient_code = 0
+        while affected:
+            if affected & 1:
+                for request_id in self._by_recipient[recipient_code]:
+                    self._matches.pop(request_id, None)
+            affected >>= 1
+            recipient_code += 1
+
+
+# ============================================================================
+# DONATION ELIGIBILITY
+# ============================================================================
+
+# Donation type -> days a donor must wait before donating again
+DEFERRAL_DAYS = {
+    "whole_blood": 56,
+    "double_red_cells": 112,
+    "platelets": 7,
+    "plasma": 28
+}
+
+DEFAULT_DONATION_TYPE = "whole_blood"
+
+
+class EligibilityScheduler:
+    """
+    Keeps recently donated donors out of matching until they are eligible again.
+    
+    A donation defers the donor in the donor index and pushes its eligibility
+    time on a min-heap. release_due() pops the donors whose time has come and
+    releases them back into the index, so matching never has to look at
+    donation dates: it is a heap peek when nobody is due.
+    
+    Args:
+        donor_index (DonorIndex): Index whose donors are deferred and released
+        deferral_days (dict): Donation type -> deferral in days
+            (default: DEFERRAL_DAYS)
+        clock (callable): Returns the current (naive UTC) datetime
+    """
+    
+    def __init__(self, donor_index, deferral_days=None, clock=datetime.utcnow):
+        self._donor_index = donor_index
+        self.deferral_days = dict(DEFERRAL_DAYS if deferral_days is None else deferral_days)
+        self._clock = clock
+        # (eligible_at, sequence, donor); entries superseded by a later
+        # donation stay in the heap and are skipped when popped
+        self._heap = []
+        # id(donor) -> (eligible_at, sequence)
+        self._pending = {}
+        self._next_sequence = 0
+    
+    def __len__(self):
+        return len(self._pending)
+    
+    def eligible_at(self, donated_at, donation_type=DEFAULT_DONATION_TYPE):
+        """
+        Get when a donor may donate again.
+        
+        Args:
+            donated_at (datetime): Time of the donation
+            donation_type (str): Key of deferral_days
+        
+        Returns:
+            datetime: First eligible time
+        
+        Raises:
+            ValueError: If the donation type is unknown
+        """
+        if donation_type not in self.deferral_days:
+            raise ValueError(f"Unknown donation type: {donation_type!r}")
+        return donated_at + timedelta(days=self.deferral_days[donation_type])
+    
+    def schedule(self, donor, eligible_at):
+        """
+        Defer a donor until a given time (released immediately if it has passed).
+        
+        Args:
+            donor (dict): Donor in the donor index
+            eligible_at (datetime): Time the donor becomes eligible
+        """
+        if eligible_at is None or eligible_at <= self._clock():
+            self._pending.pop(id(donor), None)
+            self._donor_index.release(donor)
+            return
+        
+        sequence = self._next_sequence
+        self._next_sequence += 1
+        self._pending[id(donor)] = (eligible_at, sequence)
+        heapq.heappush(self._heap, (eligible_at, sequence, donor))
+        self._donor_index.defer(donor)
+    
+    def record_donation(self, donor, donated_at, donation_type=DEFAULT_DONATION_TYPE):
+        """
+        Defer a donor after a donation.
+        
+        Args:
+            donor (dict): Donor in the donor index
+            donated_at (datetime): Time of the donation
+            donation_type (str): Key of deferral_days
+        
+        Returns:
+            datetime: Time the donor becomes eligible again
+        
+        Raises:
+            ValueError: If the donation type is unknown
+        """
+        eligible_at = self.eligible_at(donated_at, donation_type)
+        self.schedule(donor, eligible_at)
+        return eligible_at
+    
+    def forget(self, donor):
+        """
+        Stop tracking a donor (e.g. when it is deleted).
+        
+        Args:
+            donor (dict): Donor previously scheduled
+        """
+        self._pending.pop(id(donor), None)
+    
+    def has_due(self, now=None):
+        """
+        Check whether release_due() has a donor to release.
+        
+        Only peeks at the earliest eligibility time, so it may be called
+        without the lock guarding the scheduler: a stale answer just delays
+        the release to the next check or makes release_due() a no-op.
+        
+        Args:
+            now (datetime): Current time (default: the scheduler clock)
+        
+        Returns:
+            bool: True if the earliest scheduled time has passed
+        """
+        try:
+            eligible_at = self._heap[0][0]
+        except IndexError:
+            return False
+        return eligible_at <= (self._clock() if now is None else now)
+    
+    def release_due(self, now=None):
+        """
+        Release every donor whose eligibility time has passed.
+        
+        Args:
+            now (datetime): Current time (default: the scheduler clock)
+        
+        Returns:
+            list: Donors released back into matching
+        """
+        heap = self._heap
+        if not heap:
+            return []
+        now = self._clock() if now is None else now
+        
+        released = []
+        while heap and heap[0][0] <= now:
+            eligible_at, sequence, donor = heapq.heappop(heap)
+            if self._pending.get(id(donor)) != (eligible_at, sequence):
+                continue  # superseded or forgotten
+            del self._pending[id(donor)]
+            self._donor_index.release(donor)
+            released.append(donor)
+        return released
+    
+    def upcoming(self, days, now=None):
+        """
+        List deferred donors becoming eligible within a number of days.
+        
+        Args:
+            days (int): Look-ahead window in days
+            now (datetime): Current time (default: the scheduler clock)
+        
+        Returns:
+            list: (eligible_at, donor) pairs, soonest first
+        """
+        now = self._clock() if now is None else now
+        horizon = now + timedelta(days=days)
+        pending = self._pending
+        due = [
+            entry for entry in self._heap
+            if entry[0] <= horizon and pending.get(id(entry[2])) == entry[:2]
+        ]
+        due.sort(key=lambda entry: entry[:2])
+        return [(eligible_at, donor) for eligible_at, _, donor in due]
+
+
+# ============================================================================
+# INVENTORY FULFILLMENT
+# ============================================================================
+
+# Request urgency -> processing priority (lower first); unknown urgencies rank as MEDIUM
+URGENCY_PRIORITY = {"CRITICAL": 0, "HIGH": 1, "MEDIUM": 2, "LOW": 3}
+
+# Recipient code -> compatible donor codes in the order stored units are used:
+# the exact group first, then the groups that can supply the fewest recipient
+# groups (keeping versatile O- for last), common before rare groups, best
+# score first
+SUPPLY_PREFERENCE = tuple(
+    tuple(sorted(
+        (donor_code for donor_code in range(INVALID_CODE) if DONOR_MASKS[recipient_code] >> donor_code & 1),
+        key=lambda donor_code: (
+            donor_code != recipient_code,
+            bin(RECIPIENT_MASKS[donor_code]).count("1"),
+            get_donation_stats(VALID_BLOOD_GROUPS[donor_code])["is_rare"],
+            -SCORE_TABLE[recipient_code][donor_code]
+        )
+    ))
+    for recipient_code in range(INVALID_CODE)
+)
+
+
+class _StockPool:
+    """Usable units per donor code, drawn first-expiring-first-out."""
+    
+    def __init__(self, batches, today):
+        self.batches = batches
+        self.remaining = []
+        # donor code -> heap of (expiry day, batch position) with units left
+        self.heaps = [[] for _ in range(INVALID_CODE)]
+        self.free = [0] * INVALID_CODE
+        self.expiry_days = []
+        for position, batch in enumerate(batches):
+            code = BLOOD_GROUP_CODES.get(batch.get("bloodGroup"))
+            units = int(batch.get("units") or 0)
+            expiry = batch.get("expiry")
+            expiry_day = _to_day(expiry) if expiry else date.max.toordinal()
+            usable = code is not None and units > 0 and expiry_day >= today
+            self.remaining.append(units if usable else 0)
+            self.expiry_days.append(expiry_day)
+            if usable:
+                self.heaps[code].append((expiry_day, position))
+                self.free[code] += units
+        for heap in self.heaps:
+            heapq.heapify(heap)
+    
+    def take(self, code, units, holding):
+        """Move up to `units` of a donor code into holding {position: units}."""
+        heap = self.heaps[code]
+        remaining = self.remaining
+        taken = 0
+        while taken < units and heap:
+            position = heap[0][1]
+            amount = min(remaining[position], units - taken)
+            remaining[position] -= amount
+            holding[position] = holding.get(position, 0) + amount
+            taken += amount
+            if not remaining[position]:
+                heapq.heappop(heap)
+        self.free[code] -= taken
+        return taken
+    
+    def give_back(self, code, units, holding):
+        """Return up to `units` from holding {position: units}, latest-expiring first."""
+        returned = 0
+        for position in sorted(holding, key=lambda position: self.expiry_days[position], reverse=True):
+            if returned == units:
+                break
+            amount = min(holding[position], units - returned)
+            if not self.remaining[position]:
+                heapq.heappush(self.heaps[code], (self.expiry_days[position], position))
+            self.remaining[position] += amount
+            holding[position] -= amount
+            if not holding[position]:
+                del holding[position]
+            returned += amount
+        self.free[code] += returned
+        return returned
+
+
+def plan_fulfillment(blood_requests, batches, today=None, allow_partial=True):
+    """
+    Allocate stored blood units to blood requests.
+    
+    Requests are served by urgency, and within an urgency the most
+    constrained recipient groups (fewest compatible donor groups) go first.
+    Each request draws its compatible groups in SUPPLY_PREFERENCE order, and
+    each group first-expiring-first-out. A repair pass then tops up short
+    requests by moving another request onto a spare group it can also use,
+    freeing the units the short request needs (a one-step augmenting path).
+    Without partial allocations the moves are kept only if they cover the
+    short request in full, and undone otherwise.
+    Everything works on 8 blood-group pools, so thousands of requests and
+    batches are planned in milliseconds.
+    
+    Args:
+        blood_requests (list): Requests with 'bloodGroup', 'units' and
+            optional 'urgency' keys
+        batches (list): Inventory batches with 'bloodGroup', 'units' and
+            'expiry' keys; expired batches are not used
+        today (date): Current day (default: date.today())
+        allow_partial (bool): If False, a request that cannot be fully
+            covered gets nothing and its units go to later requests
+    
+    Returns:
+        list: One allocation per request, in request order:
+        (allocated units, [(batch, units), ...] soonest-expiring first)
+    """
+    today = _to_day(today or date.today())
+    pool = _StockPool(batches, today)
+    
+    count = len(blood_requests)
+    codes = [BLOOD_GROUP_CODES.get(blood_request.get("bloodGroup")) for blood_request in blood_requests]
+    needs = [
+        max(0, int(blood_request.get("units") or 0)) if code is not None else 0
+        for blood_request, code in zip(blood_requests, codes)
+    ]
+    wanted = list(needs)
+    # request -> donor code -> {batch position: units}
+    held = [{} for _ in range(count)]
+    # donor code -> recipient code -> requests holding units of that donor code
+    holders = [[set() for _ in range(INVALID_CODE)] for _ in range(INVALID_CODE)]
+    
+    order = sorted(
+        (index for index in range(count) if needs[index]),
+        key=lambda index: (
+            URGENCY_PRIORITY.get(str(blood_requests[index].get("urgency", "")).upper(), URGENCY_PRIORITY["MEDIUM"]),
+            len(SUPPLY_PREFERENCE[codes[index]]),
+            index
+        )
+    )
+    
+    def take(index, donor_code, units):
+        holding = held[index].setdefault(donor_code, {})
+        taken = pool.take(donor_code, units, holding)
+        if taken:
+            needs[index] -= taken
+            holders[donor_code][codes[index]].add(index)
+        return taken
+    
+    def give_back(index, donor_code, units):
+        holding = held[index][donor_code]
+        returned = pool.give_back(donor_code, units, holding)
+        needs[index] += returned
+        if not holding:
+            holders[donor_code][codes[index]].discard(index)
+        return returned
+    
+    def fill(index):
+        for donor_code in SUPPLY_PREFERENCE[codes[index]]:
+            if not needs[index]:
+                return
+            if pool.free[donor_code]:
+                take(index, donor_code, needs[index])
+    
+    # Greedy pass
+    for index in order:
+        if allow_partial or sum(pool.free[code] for code in SUPPLY_PREFERENCE[codes[index]]) >= needs[index]:
+            fill(index)
+    
+    # Repair pass: short request i needs donor code g held by request j, and
+    # j can switch to a donor code h that still has free units
+    for index in order:
+        if not needs[index]:
+            continue
+        moves = []
+        if not allow_partial:
+            # The greedy pass skipped this request; start from the free units
+            fill(index)
+        for donor_code in SUPPLY_PREFERENCE[codes[index]]:
+            for holder_code in range(INVALID_CODE):
+                spare_codes = [
+                    code for code in SUPPLY_PREFERENCE[holder_code]
+                    if code != donor_code and pool.free[code]
+                ]
+                if not spare_codes:
+                    continue
+                for other in list(holders[donor_code][holder_code]):
+                    if not needs[index]:
+                        break
+                    if other == index:
+                        continue
+                    for spare_code in spare_codes:
+                        movable = min(needs[index], sum(held[other][donor_code].values()), pool.free[spare_code])
+                        if not movable:
+                            continue
+                        moved = take(other, spare_code, movable)
+                        give_back(other, donor_code, moved)
+                        take(index, donor_code, moved)
+                        moves.append((other, donor_code, spare_code, moved))
+            if not needs[index]:
+                break
+        if not allow_partial and needs[index]:
+            # Still short: release its units and put the moved requests back
+            for donor_code in list(held[index]):
+                give_back(index, donor_code, wanted[index])
+            for other, donor_code, spare_code, moved in reversed(moves):
+                give_back(other, spare_code, moved)
+                take(other, donor_code, moved)
+    
+    plans = []
+    for index in range(count):
+        allocations = [
+            (position, units)
+            for holding in held[index].values()
+            for position, units in holding.items()
+            if units
+        ]
+        allocations.sort(key=lambda allocation: (pool.expiry_days[allocation[0]], allocation[0]))
+        plans.append((
+            wanted[index] - needs[index],
+            [(batches[position], units) for position, units in allocations]
+        ))
+    return plans
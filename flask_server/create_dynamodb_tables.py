@@ -5,21 +5,62 @@ This script creates all required DynamoDB tables for the Blood Bank application.
 Run this script once before deploying the application to AWS.
 
 Usage:
-    python create_dynamodb_tables.py
+    python create_dynamodb_tables.py             # tables of server_aws.py
+    python create_dynamodb_tables.py --rebuild-stats
+                                                 # ... and recount the stats
+    python create_dynamodb_tables.py --storage   # tables of server.py's
+                                                 # STORAGE_BACKEND=dynamodb
 
 Prerequisites:
     - AWS CLI configured with appropriate credentials
     - boto3 library installed
+
+Set DYNAMODB_ENDPOINT_URL to create the tables in a local DynamoDB stand-in.
 """
 
+import os
+import sys
+
 import boto3
 from botocore.exceptions import ClientError
 
+from storage import DYNAMODB_HISTORY_TABLE, DYNAMODB_META_TABLE, DYNAMODB_TABLES
+
 # AWS Configuration
 AWS_REGION = 'us-east-1'
+DYNAMODB_ENDPOINT_URL = os.environ.get('DYNAMODB_ENDPOINT_URL') or None
 
 # Initialize DynamoDB client
-dynamodb = boto3.client('dynamodb', region_name=AWS_REGION)
+dynamodb = boto3.client('dynamodb', region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT_URL)
+
+# Sparse index used by server_aws.py for donor matching: only available
+# donors carry availableBloodGroup (a boolean cannot be an index key)
+DONOR_MATCH_INDEX = {
+    'IndexName': 'availableBloodGroup-index',
+    'KeySchema': [
+        {'AttributeName': 'availableBloodGroup', 'KeyType': 'HASH'},
+        {'AttributeName': 'id', 'KeyType': 'RANGE'}
+    ],
+    'Projection': {'ProjectionType': 'ALL'},
+    'ProvisionedThroughput': {
+        'ReadCapacityUnits': 5,
+        'WriteCapacityUnits': 5
+    }
+}
+
+# Index used by server_aws.py for the ?status= requests listing
+REQUEST_STATUS_INDEX = {
+    'IndexName': 'status-index',
+    'KeySchema': [
+        {'AttributeName': 'status', 'KeyType': 'HASH'},
+        {'AttributeName': 'id', 'KeyType': 'RANGE'}
+    ],
+    'Projection': {'ProjectionType': 'ALL'},
+    'ProvisionedThroughput': {
+        'ReadCapacityUnits': 5,
+        'WriteCapacityUnits': 5
+    }
+}
 
 # Table definitions
 TABLES = [
@@ -57,7 +98,8 @@ TABLES = [
         ],
         'AttributeDefinitions': [
             {'AttributeName': 'id', 'AttributeType': 'N'},
-            {'AttributeName': 'email', 'AttributeType': 'S'}
+            {'AttributeName': 'email', 'AttributeType': 'S'},
+            {'AttributeName': 'availableBloodGroup', 'AttributeType': 'S'}
         ],
         'GlobalSecondaryIndexes': [
             {
@@ -70,7 +112,8 @@ TABLES = [
                     'ReadCapacityUnits': 5,
                     'WriteCapacityUnits': 5
                 }
-            }
+            },
+            DONOR_MATCH_INDEX
         ],
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 5,
@@ -109,7 +152,24 @@ TABLES = [
             {'AttributeName': 'id', 'KeyType': 'HASH'}  # Partition key
         ],
         'AttributeDefinitions': [
-            {'AttributeName': 'id', 'AttributeType': 'N'}
+            {'AttributeName': 'id', 'AttributeType': 'N'},
+            {'AttributeName': 'status', 'AttributeType': 'S'}
+        ],
+        'GlobalSecondaryIndexes': [
+            REQUEST_STATUS_INDEX
+        ],
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    },
+    {
+        'TableName': 'BloodBank_Stats',
+        'KeySchema': [
+            {'AttributeName': 'id', 'KeyType': 'HASH'}  # Partition key
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': 'id', 'AttributeType': 'S'}
         ],
         'ProvisionedThroughput': {
             'ReadCapacityUnits': 5,
@@ -146,6 +206,33 @@ TABLES = [
 ]
 
 
+
+
+def _store_table(table_name, key, key_type):
+    return {
+        'TableName': table_name,
+        'KeySchema': [
+            {'AttributeName': key, 'KeyType': 'HASH'}  # Partition key
+        ],
+        'AttributeDefinitions': [
+            {'AttributeName': key, 'AttributeType': key_type}
+        ],
+        'ProvisionedThroughput': {
+            'ReadCapacityUnits': 5,
+            'WriteCapacityUnits': 5
+        }
+    }
+
+
+# Tables of server.py's dynamodb storage backend (see storage.py): one per
+# store keyed by the numeric id, separate from the tables above
+STORAGE_TABLES = [
+    *(_store_table(table_name, 'id', 'N') for table_name in DYNAMODB_TABLES.values()),
+    _store_table(DYNAMODB_HISTORY_TABLE, 'key', 'S'),
+    _store_table(DYNAMODB_META_TABLE, 'id', 'S')
+]
+
+
 def create_table(table_config):
     """Create a single DynamoDB table."""
     try:
@@ -168,6 +255,102 @@ def create_table(table_config):
             return False
 
 
+def add_missing_index(table_name, index):
+    """
+    Add a (string hash key, id) index to a table created before it existed.
+    """
+    description = dynamodb.describe_table(TableName=table_name)['Table']
+    index_names = [existing['IndexName'] for existing in description.get('GlobalSecondaryIndexes', [])]
+    if index['IndexName'] in index_names:
+        return
+    id_type = next(
+        attribute['AttributeType'] for attribute in description['AttributeDefinitions']
+        if attribute['AttributeName'] == 'id'
+    )
+    dynamodb.update_table(
+        TableName=table_name,
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': id_type},
+            {'AttributeName': index['KeySchema'][0]['AttributeName'], 'AttributeType': 'S'}
+        ],
+        GlobalSecondaryIndexUpdates=[{'Create': index}]
+    )
+    print(f"✓ Adding index {index['IndexName']} to {table_name}")
+
+
+def ensure_request_status_index():
+    """
+    Add the status index to a requests table created before it existed.
+    Every request already has a status, so nothing needs backfilling.
+    """
+    try:
+        add_missing_index('BloodBank_Requests', REQUEST_STATUS_INDEX)
+        return True
+    except ClientError as e:
+        print(f"✗ Error preparing request status index: {e}")
+        return False
+
+
+def ensure_donor_match_index():
+    """
+    Add the donor match index to a donors table created before it existed,
+    and set availableBloodGroup on the donors already available.
+    """
+    table_name = 'BloodBank_Donors'
+    try:
+        add_missing_index(table_name, DONOR_MATCH_INDEX)
+
+        # Backfill the sparse key of available donors; only a non-empty
+        # string blood group can be an index key
+        kwargs = {
+            'TableName': table_name,
+            'FilterExpression': (
+                'available = :yes AND attribute_type(bloodGroup, :string) AND size(bloodGroup) > :zero'
+                ' AND attribute_not_exists(availableBloodGroup)'
+            ),
+            'ExpressionAttributeValues': {':yes': {'BOOL': True}, ':string': {'S': 'S'}, ':zero': {'N': '0'}},
+            'ProjectionExpression': 'id'
+        }
+        updated = 0
+        while True:
+            response = dynamodb.scan(**kwargs)
+            for item in response.get('Items', []):
+                dynamodb.update_item(
+                    TableName=table_name,
+                    Key={'id': item['id']},
+                    UpdateExpression='SET availableBloodGroup = bloodGroup'
+                )
+                updated += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+        print(f"✓ Indexed {updated} available donors for matching")
+        return True
+
+    except ClientError as e:
+        print(f"✗ Error preparing donor match index: {e}")
+        return False
+
+
+def seed_stats_counters(force=False):
+    """
+    Count the existing donors and open requests into the stats counters item
+    of server_aws.py, which only ever ADDs to it afterwards. Skipped once the
+    counters were built, unless forced.
+    """
+    # Imported here: it connects to the tables created above
+    import server_aws
+    try:
+        if server_aws.ensure_counters(force):
+            print("✓ Counted existing donors and requests into the stats counters")
+        else:
+            print("⚠ Stats counters already built. Skipping... (--rebuild-stats recounts them)")
+        return True
+    except (ClientError, RuntimeError) as e:
+        print(f"✗ Error building stats counters: {e}")
+        return False
+
+
 def delete_table(table_name):
     """Delete a DynamoDB table (use with caution!)."""
     try:
@@ -206,6 +389,9 @@ def list_tables():
 
 def main():
     """Main function to create all tables."""
+    storage = '--storage' in sys.argv[1:]
+    tables = STORAGE_TABLES if storage else TABLES
+
     print(f"\n{'=' * 70}")
     print(f"  Blood Bank Application - DynamoDB Table Creation")
     print(f"  AWS Region: {AWS_REGION}")
@@ -215,23 +401,34 @@ def main():
     existing_tables = list_tables()
     
     # Create tables
-    print(f"Creating {len(TABLES)} DynamoDB tables...\n")
+    print(f"Creating {len(tables)} DynamoDB tables...\n")
     
     success_count = 0
-    for table_config in TABLES:
+    for table_config in tables:
         if create_table(table_config):
             success_count += 1
         print()  # Empty line for readability
     
+    if not storage:
+        # Tables created by older versions of this script lack the indexes
+        ensure_donor_match_index()
+        ensure_request_status_index()
+        print()
+        seed_stats_counters(force='--rebuild-stats' in sys.argv[1:])
+        print()
+
     # Summary
     print(f"{'=' * 70}")
-    print(f"  Summary: {success_count}/{len(TABLES)} tables created successfully")
+    print(f"  Summary: {success_count}/{len(tables)} tables created successfully")
     print(f"{'=' * 70}\n")
     
     # List tables again to confirm
     list_tables()
     
     print("✓ DynamoDB table setup complete!")
+    if storage:
+        print("\nNext step: start server.py with STORAGE_BACKEND=dynamodb\n")
+        return
     print("\nNext steps:")
     print("  1. Create SNS topic: aws sns create-topic --name BloodBank_Notifications")
     print("  2. Subscribe to SNS topic with your email")
@@ -0,0 +1,359 @@
+"""
+Blood inventory bookkeeping for the Blood Bank Application.
+
+The inventory store in server.py holds one InventoryItem per batch. Next to
+it:
+
+- InventoryAggregates keeps running unit totals per (hospital, blood group)
+  and per (city, blood group), updated in O(1) on every batch insert, update
+  and delete, so the shortage dashboard reads the totals instead of scanning
+  and summing every batch.
+- ExpiryIndex keeps the batches of each blood group sorted by expiry, for
+  first-expiring-first-out (FEFO) allocation and for retiring expired stock
+  from the front of each group without a full scan.
+- ExpirySweeper runs the retirement periodically on a background thread.
+"""
+
+import logging
+import threading
+from bisect import bisect_left, insort
+from datetime import date
+
+from ai_engine import VALID_BLOOD_GROUPS, INVALID_CODE
+
+# Sort key of batches without an expiry date: after every real date
+NO_EXPIRY = date.max.toordinal()
+
+
+def _empty_units():
+    # One slot per blood group code, plus INVALID_CODE
+    return [0] * (INVALID_CODE + 1)
+
+
+def _units_by_group(units):
+    return {blood_group: units[code] for code, blood_group in enumerate(VALID_BLOOD_GROUPS)}
+
+
+class InventoryAggregates:
+    """
+    Unit totals per hospital and per city, by blood group.
+
+    Each batch is counted under the (hospital, blood group, units) it had
+    when last added or updated, so update() and remove() subtract exactly
+    what was added even after the batch has been edited. Cities come from
+    set_hospital_city(); batches of a hospital with no known city are
+    counted under the empty city "". Hospitals and cities whose batches are
+    all gone stay listed with zero units, which is what a shortage view wants.
+    """
+
+    def __init__(self):
+        # hospital id -> [units per blood group code]
+        self._by_hospital = {}
+        # hospital id -> number of batches counted
+        self._batches = {}
+        # city -> [units per blood group code]
+        self._by_city = {}
+        # hospital id -> city its totals are counted under
+        self._hospital_city = {}
+        # batch id -> (hospital id, blood group code, units)
+        self._counted = {}
+        self._totals = _empty_units()
+
+    def __len__(self):
+        return len(self._counted)
+
+    def _apply(self, hospital_id, code, units, batches):
+        by_hospital = self._by_hospital.get(hospital_id)
+        if by_hospital is None:
+            by_hospital = self._by_hospital[hospital_id] = _empty_units()
+        by_hospital[code] += units
+        self._batches[hospital_id] = self._batches.get(hospital_id, 0) + batches
+
+        city = self._hospital_city.get(hospital_id, "")
+        by_city = self._by_city.get(city)
+        if by_city is None:
+            by_city = self._by_city[city] = _empty_units()
+        by_city[code] += units
+        self._totals[code] += units
+
+    def add(self, item):
+        """
+        Count a new inventory batch.
+
+        Args:
+            item (InventoryItem): Stored batch
+        """
+        if item.id in self._counted:
+            self.update(item)
+            return
+        counted = (item.hospital_id, item.blood_group_code, item.units)
+        self._counted[item.id] = counted
+        self._apply(*counted, 1)
+
+    def update(self, item):
+        """
+        Recount a batch after its hospital, blood group or units changed.
+
+        Args:
+            item (InventoryItem): Stored batch
+        """
+        old = self._counted.pop(item.id, None)
+        if old is None:
+            self.add(item)
+            return
+        hospital_id, code, units = old
+        counted = (item.hospital_id, item.blood_group_code, item.units)
+        self._counted[item.id] = counted
+        if counted != old:
+            self._apply(*counted, 1)
+            self._apply(hospital_id, code, -units, -1)
+
+    def remove(self, item):
+        """
+        Stop counting a deleted batch.
+
+        Args:
+            item (InventoryItem): Batch previously passed to add()
+        """
+        old = self._counted.pop(item.id, None)
+        if old is not None:
+            hospital_id, code, units = old
+            self._apply(hospital_id, code, -units, -1)
+
+    def set_hospital_city(self, hospital_id, city):
+        """
+        Record a hospital's city, moving its totals if the city changed.
+
+        Args:
+            hospital_id: Hospital id
+            city (str): City the hospital is in
+        """
+        old_city = self._hospital_city.get(hospital_id, "")
+        self._hospital_city[hospital_id] = city
+        units = self._by_hospital.get(hospital_id)
+        if units is None or old_city == city:
+            return
+
+        old_totals = self._by_city[old_city]
+        new_totals = self._by_city.setdefault(city, _empty_units())
+        for code, count in enumerate(units):
+            old_totals[code] -= count
+            new_totals[code] += count
+
+    def units(self, blood_group_code, hospital_id=None, city=None):
+        """
+        Get the units held of one blood group.
+
+        Args:
+            blood_group_code (int): Blood group code
+            hospital_id: Restrict to one hospital
+            city (str): Restrict to one city (ignored if hospital_id is given)
+
+        Returns:
+            int: Number of units
+        """
+        if hospital_id is not None:
+            return self._by_hospital.get(hospital_id, _empty_units())[blood_group_code]
+        if city is not None:
+            return self._by_city.get(city, _empty_units())[blood_group_code]
+        return self._totals[blood_group_code]
+
+    def summary(self, hospital_id=None, city=None):
+        """
+        Get the unit totals, optionally restricted to a hospital or a city.
+
+        Args:
+            hospital_id: Restrict to one hospital
+            city (str): Restrict to the hospitals of one city
+
+        Returns:
+            dict: {"byHospital": [...], "byCity": [...], "totals": {...},
+            "totalUnits": n}; byCity holds the full totals of the cities of
+            the selected hospitals, and every units map lists all 8 blood groups
+        """
+        hospital_ids = [
+            hid for hid in self._by_hospital
+            if (hospital_id is None or hid == hospital_id)
+            and (city is None or self._hospital_city.get(hid, "") == city)
+        ]
+        by_hospital = []
+        totals = _empty_units()
+        for hid in hospital_ids:
+            units = self._by_hospital[hid]
+            for code, count in enumerate(units):
+                totals[code] += count
+            by_hospital.append({
+                "hospitalId": hid,
+                "city": self._hospital_city.get(hid, ""),
+                "batches": self._batches[hid],
+                "units": _units_by_group(units),
+                "totalUnits": sum(units[:INVALID_CODE])
+            })
+
+        cities = {self._hospital_city.get(hid, "") for hid in hospital_ids}
+        by_city = [
+            {
+                "city": name,
+                "units": _units_by_group(self._by_city[name]),
+                "totalUnits": sum(self._by_city[name][:INVALID_CODE])
+            }
+            for name in sorted(cities)
+        ]
+
+        if hospital_id is None and city is None:
+            totals = self._totals
+        return {
+            "byHospital": by_hospital,
+            "byCity": by_city,
+            "totals": _units_by_group(totals),
+            "totalUnits": sum(totals[:INVALID_CODE])
+        }
+
+
+class ExpiryIndex:
+    """
+    Inventory batches of each blood group ordered by expiry date.
+
+    A batch expiring on a day is usable through that day. Batches are
+    tracked by id; callers must call update() after changing a batch's
+    blood group or expiry and remove() after deleting it.
+    """
+
+    def __init__(self):
+        # blood group code -> sorted [(expiry ordinal, batch id)]
+        self._by_group = [[] for _ in range(INVALID_CODE + 1)]
+        # batch id -> (blood group code, sort key, batch)
+        self._entries = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, item):
+        """
+        Index a batch (or re-index it if already present).
+
+        Args:
+            item (InventoryItem): Stored batch
+        """
+        self.remove(item)
+        code = item.blood_group_code
+        key = (item.expiry.toordinal() if item.expiry is not None else NO_EXPIRY, item.id)
+        insort(self._by_group[code], key)
+        self._entries[item.id] = (code, key, item)
+
+    update = add
+
+    def remove(self, item):
+        """
+        Stop indexing a batch.
+
+        Args:
+            item (InventoryItem): Batch previously passed to add()
+        """
+        entry = self._entries.pop(item.id, None)
+        if entry is not None:
+            code, key, _ = entry
+            batches = self._by_group[code]
+            del batches[bisect_left(batches, key)]
+
+    def expired(self, today=None):
+        """
+        Get the batches whose expiry date is before today.
+
+        Only the expired prefix of each blood group is visited.
+
+        Args:
+            today (date): Current day (default: date.today())
+
+        Returns:
+            list: Expired batches, soonest-expired first within each group
+        """
+        today = (today or date.today()).toordinal()
+        entries = self._entries
+        expired = []
+        for batches in self._by_group:
+            for expiry, batch_id in batches:
+                if expiry >= today:
+                    break
+                expired.append(entries[batch_id][2])
+        return expired
+
+    def allocate(self, blood_group_code, units, hospital_id=None, today=None):
+        """
+        Plan a first-expiring-first-out allocation without changing any batch.
+
+        Args:
+            blood_group_code (int): Blood group code to allocate
+            units (int): Units needed
+            hospital_id: Only take batches of this hospital (default: any)
+            today (date): Current day; expired batches are skipped
+
+        Returns:
+            tuple: (plan, available) where plan is a list of (batch, units
+            taken) pairs covering `units`, or None when only `available`
+            usable units exist
+        """
+        today = (today or date.today()).toordinal()
+        entries = self._entries
+        plan = []
+        remaining = units
+        for expiry, batch_id in self._by_group[blood_group_code]:
+            if expiry < today:
+                continue
+            item = entries[batch_id][2]
+            if item.units <= 0 or (hospital_id is not None and item.hospital_id != hospital_id):
+                continue
+            take = min(item.units, remaining)
+            plan.append((item, take))
+            remaining -= take
+            if not remaining:
+                return plan, units
+        return None, units - remaining
+
+
+class ExpirySweeper:
+    """
+    Background thread calling a sweep function at a fixed interval.
+
+    The thread is created by start() (idempotent), so importing the server
+    spawns nothing; it is a daemon and stops with the process or stop().
+
+    Args:
+        sweep (callable): Function retiring expired stock
+        interval (float): Seconds between sweeps
+    """
+
+    def __init__(self, sweep, interval):
+        self._sweep = sweep
+        self.interval = interval
+        self._thread = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start the sweeper thread if it is not running yet."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name="inventory-expiry-sweeper", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        # Sweep once right away, then every interval
+        while True:
+            try:
+                self._sweep()
+            except Exception:
+                logging.getLogger(__name__).exception("Inventory expiry sweep failed")
+            if self._stopped.wait(self.interval):
+                return
+
+    def stop(self):
+        """Stop the sweeper thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            thread.join()
@@ -0,0 +1,96 @@
+"""
+DynamoDB attribute value marshalling for the Blood Bank Application (AWS version).
+
+The boto3 resource API converts every item it reads into Python objects
+with Decimal numbers (through a Decimal context per number), which
+server_aws.py then had to walk again to turn the Decimals into ints and
+floats. The functions here work on the low-level client's typed attribute
+values ({"S": "O+"}, {"N": "3"}, ...) instead:
+
+- from_attribute_values() converts an item to plain Python values in one
+  pass, with numbers parsed straight from their strings, ready for
+  jsonify().
+- to_attribute_values() converts Python values for writes, without going
+  through Decimal.
+"""
+
+from decimal import Decimal
+
+
+def parse_number(text):
+    """Convert a DynamoDB number string to an int, or a float if it has a fraction."""
+    try:
+        return int(text)
+    except ValueError:
+        number = Decimal(text)
+        return int(number) if number == number.to_integral_value() else float(number)
+
+
+def from_attribute_value(value):
+    """Convert one typed attribute value to a Python value."""
+    (kind, data), = value.items()
+    if kind == "S":
+        return data
+    if kind == "N":
+        return parse_number(data)
+    if kind == "BOOL":
+        return data
+    if kind == "NULL":
+        return None
+    if kind == "M":
+        return {name: from_attribute_value(item) for name, item in data.items()}
+    if kind == "L":
+        return [from_attribute_value(item) for item in data]
+    if kind == "NS":
+        return [parse_number(item) for item in data]
+    # SS, B and BS are returned as they are
+    return data
+
+
+def from_attribute_values(item):
+    """
+    Convert a low-level item to a dict of plain Python values.
+
+    Args:
+        item (dict): Attribute name -> typed attribute value
+
+    Returns:
+        dict: Attribute name -> str, int, float, bool, None, dict or list
+    """
+    # Strings are most attributes; check for them before dispatching
+    return {
+        name: value["S"] if "S" in value else from_attribute_value(value)
+        for name, value in item.items()
+    }
+
+
+def to_attribute_value(value):
+    """Convert one Python value to a typed attribute value."""
+    if isinstance(value, str):
+        return {"S": value}
+    if isinstance(value, bool):
+        return {"BOOL": value}
+    if isinstance(value, (int, float, Decimal)):
+        return {"N": str(value) if not isinstance(value, float) else repr(value)}
+    if value is None:
+        return {"NULL": True}
+    if isinstance(value, dict):
+        return {"M": to_attribute_values(value)}
+    if isinstance(value, (list, tuple)):
+        return {"L": [to_attribute_value(item) for item in value]}
+    if isinstance(value, bytes):
+        return {"B": value}
+    raise TypeError(f"Cannot store {type(value).__name__} in DynamoDB")
+
+
+def to_attribute_values(item):
+    """
+    Convert a dict of Python values to a low-level item.
+
+    Args:
+        item (dict): Attribute name -> Python value
+
+    Returns:
+        dict: Attribute name -> typed attribute value
+    """
+    return {name: to_attribute_value(value) for name, value in item.items()}
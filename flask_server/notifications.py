@@ -0,0 +1,229 @@
+"""
+SNS notification dispatch for the Blood Bank Application (AWS version).
+
+Publishing used to start one thread per message, so a burst of logins meant
+a burst of threads and no limit on pending publishes. NotificationDispatcher
+queues messages instead, in a bounded queue served by a fixed pool of
+worker threads:
+
+- Workers take up to 10 queued messages at a time, most urgent first, and
+  send them with one SNS PublishBatch call.
+- Failed entries are retried with jittered exponential backoff; entries SNS
+  rejects as malformed (sender faults) are not. A message waits out its
+  backoff in a delay queue, not in a worker, so throttled retries never
+  hold up newer (e.g. urgent) messages.
+- Under pressure the least important messages go first: LOW messages (e.g.
+  logins) are dropped once the queue is half full, and a full queue makes
+  room for a more urgent message by dropping the oldest less urgent one.
+  URGENT messages (blood requests) are therefore only dropped when the queue
+  is full of other urgent messages.
+"""
+
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+from collections import deque
+
+URGENT = 0
+NORMAL = 1
+LOW = 2
+PRIORITY_NAMES = ("urgent", "normal", "low")
+
+# PublishBatch accepts at most 10 entries
+MAX_BATCH_SIZE = 10
+
+
+class NotificationDispatcher:
+    """
+    Bounded, batching SNS publisher with a fixed worker pool.
+
+    Args:
+        sns: boto3 SNS client
+        topic_arn (str): Topic to publish to
+        workers (int): Number of publishing threads
+        max_queue (int): Maximum messages queued at once
+        max_retries (int): Retries of a failed message before it is dropped
+        base_delay (float): First retry delay in seconds; each retry waits a
+            random time up to base_delay * 2 ** attempt
+    """
+
+    def __init__(self, sns, topic_arn, workers=2, max_queue=1000, max_retries=3, base_delay=0.2):
+        self.sns = sns
+        self.topic_arn = topic_arn
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        # One FIFO per priority of (subject, message, enqueued at, priority,
+        # attempt) entries
+        self._queues = tuple(deque() for _ in PRIORITY_NAMES)
+        # Entries waiting to be retried, as a heap of (due at, tiebreak, entry)
+        self._delayed = []
+        self._tiebreak = itertools.count()
+        self._ready = threading.Condition(threading.Lock())
+        self._threads = []
+        self._stopped = False
+        self._published = 0
+        self._failed = 0
+        self._retried = 0
+        self._batches = 0
+        self._dropped = [0] * len(PRIORITY_NAMES)
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def _depth(self):
+        return sum(len(messages) for messages in self._queues) + len(self._delayed)
+
+    def notify(self, subject, message, priority=NORMAL):
+        """
+        Queue a message for publishing; never blocks.
+
+        Args:
+            subject (str): SNS subject
+            message (str): SNS message body
+            priority (int): URGENT, NORMAL or LOW
+
+        Returns:
+            bool: False if the message was dropped because the queue is full
+        """
+        with self._ready:
+            self._start()
+            depth = self._depth()
+            if priority == LOW and depth >= self.max_queue // 2:
+                self._dropped[LOW] += 1
+                return False
+            if depth >= self.max_queue and not self._evict(priority):
+                self._dropped[priority] += 1
+                return False
+            self._queues[priority].append((subject, message, time.monotonic(), priority, 0))
+            self._ready.notify()
+            return True
+
+    def _evict(self, priority):
+        # Caller holds _ready; drops the oldest message less urgent than priority
+        for lower in range(len(self._queues) - 1, priority, -1):
+            if self._queues[lower]:
+                self._queues[lower].popleft()
+                self._dropped[lower] += 1
+                return True
+        return False
+
+    def _start(self):
+        # Caller holds _ready; threads start on first use so importing the
+        # server spawns nothing
+        if self._threads or self._stopped:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"sns-dispatch-{number}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _take(self):
+        # Most urgent first; a batch may mix priorities. Once stopped, workers
+        # still wait for the delayed retries before returning an empty batch.
+        with self._ready:
+            while True:
+                now = time.monotonic()
+                while self._delayed and self._delayed[0][0] <= now:
+                    entry = heapq.heappop(self._delayed)[2]
+                    self._queues[entry[3]].append(entry)
+                if any(self._queues) or (self._stopped and not self._delayed):
+                    break
+                self._ready.wait(self._delayed[0][0] - now if self._delayed else None)
+            batch = []
+            for messages in self._queues:
+                while messages and len(batch) < MAX_BATCH_SIZE:
+                    batch.append(messages.popleft())
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take()
+            if not batch:
+                return
+            try:
+                self._publish(batch)
+            except Exception:
+                logging.getLogger(__name__).exception("Notification dispatch failed")
+
+    def _publish(self, batch):
+        failed = self._send(batch)
+        with self._ready:
+            self._batches += 1
+            now = time.monotonic()
+            for position, (subject, message, enqueued, priority, attempt) in enumerate(batch):
+                if position not in failed:
+                    latency = now - enqueued
+                    self._published += 1
+                    self._latency_total += latency
+                    self._latency_max = max(self._latency_max, latency)
+                elif not failed[position] or attempt >= self.max_retries:
+                    self._failed += 1
+                else:
+                    # Full jitter keeps retried messages from hitting SNS in step
+                    attempt += 1
+                    due = now + random.uniform(0, self.base_delay * 2 ** attempt)
+                    entry = (subject, message, enqueued, priority, attempt)
+                    heapq.heappush(self._delayed, (due, next(self._tiebreak), entry))
+                    self._retried += 1
+            # Waiting workers recompute when the next retry is due
+            self._ready.notify_all()
+
+    def _send(self, batch):
+        """Publish a batch; returns {position: retryable} for the failed entries."""
+        try:
+            response = self.sns.publish_batch(
+                TopicArn=self.topic_arn,
+                PublishBatchRequestEntries=[
+                    {"Id": str(position), "Subject": subject, "Message": message}
+                    for position, (subject, message, *_) in enumerate(batch)
+                ]
+            )
+        except Exception as e:
+            logging.getLogger(__name__).warning("SNS publish failed: %s", e)
+            return {position: True for position in range(len(batch))}
+        failed = {}
+        for entry in response.get("Failed", ()):
+            if not entry.get("SenderFault"):
+                failed[int(entry["Id"])] = True
+            else:
+                logging.getLogger(__name__).warning("SNS rejected notification: %s", entry.get("Message"))
+                failed[int(entry["Id"])] = False
+        return failed
+
+    def stats(self):
+        """
+        Get dispatch metrics.
+
+        Returns:
+            dict: Queue depth per priority, retries waiting out their
+            backoff, published, failed, retried and dropped message counts,
+            batches sent, and the average and maximum time from queueing to
+            publishing
+        """
+        with self._ready:
+            return {
+                "workers": self.workers,
+                "maxQueue": self.max_queue,
+                "queueDepth": {name: len(messages) for name, messages in zip(PRIORITY_NAMES, self._queues)},
+                "delayedRetries": len(self._delayed),
+                "published": self._published,
+                "failed": self._failed,
+                "retried": self._retried,
+                "dropped": dict(zip(PRIORITY_NAMES, self._dropped)),
+                "batches": self._batches,
+                "avgLatencyMs": round(self._latency_total / self._published * 1000, 2) if self._published else 0.0,
+                "maxLatencyMs": round(self._latency_max * 1000, 2)
+            }
+
+    def shutdown(self):
+        """Publish the queued messages (retries included) and stop the workers."""
+        with self._ready:
+            self._stopped = True
+            threads, self._threads = self._threads, []
+            self._ready.notify_all()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,125 @@
+"""
+Password hashing off the request thread for the Blood Bank Application.
+
+Werkzeug's password hashes are deliberately slow key derivations. Running
+them inline blocks the worker thread (and holds the GIL) for the whole
+computation, so a burst of logins starves every other route. PasswordHasher
+runs hashing and verification on a bounded process pool instead: the
+request thread only waits on a future, and once too many hashes are
+pending new ones are rejected rather than queued without limit.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusyError(RuntimeError):
+    """Raised when the hashing queue is full; callers should answer 503."""
+
+
+class PasswordHasher:
+    """
+    Bounded process pool for password hashing and verification.
+
+    Args:
+        method (str): Werkzeug hash method including its cost, e.g.
+            "scrypt:32768:8:1" or "pbkdf2:sha256:600000"
+        max_workers (int): Number of hashing processes (default: CPU count)
+        max_pending (int): Maximum hashes queued or running at once
+            (default: 8 per worker)
+    """
+
+    def __init__(self, method="scrypt", max_workers=None, max_pending=None):
+        self.method = method
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 8
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._total_seconds = 0.0
+
+    def _submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._rejected += 1
+                raise HasherBusyError("Too many password hashes pending")
+            if self._executor is None:
+                # Created on first use so importing the server spawns nothing
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._pending += 1
+            executor = self._executor
+
+        started = time.perf_counter()
+        try:
+            return executor.submit(fn, *args, **kwargs).result()
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._pending -= 1
+                self._completed += 1
+                self._total_seconds += elapsed
+
+    def hash(self, password):
+        """
+        Hash a password with the configured method.
+
+        Args:
+            password (str): Plain text password
+
+        Returns:
+            str: Werkzeug password hash
+
+        Raises:
+            HasherBusyError: If the hashing queue is full
+        """
+        return self._submit(generate_password_hash, password, method=self.method)
+
+    def verify(self, password_hash, password):
+        """
+        Check a password against a stored hash.
+
+        Args:
+            password_hash (str): Stored Werkzeug password hash
+            password (str): Plain text password to check
+
+        Returns:
+            bool: True if the password matches
+
+        Raises:
+            HasherBusyError: If the hashing queue is full
+        """
+        if not password_hash or password is None:
+            return False
+        return self._submit(check_password_hash, password_hash, password)
+
+    def stats(self):
+        """
+        Get queue metrics.
+
+        Returns:
+            dict: Pending (queue depth), completed and rejected counts, and
+            the average time callers waited for a result
+        """
+        with self._lock:
+            return {
+                "method": self.method,
+                "workers": self.max_workers,
+                "maxPending": self.max_pending,
+                "queueDepth": self._pending,
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "avgWaitMs": round(self._total_seconds / self._completed * 1000, 2) if self._completed else 0.0
+            }
+
+    def shutdown(self):
+        """Stop the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
@@ -0,0 +1,413 @@
+"""
+Durable write-ahead log and snapshots for the Blood Bank Application.
+
+server.py keeps all of its state in memory. With the "wal" storage backend
+(see storage.py), every change to a stored record is also appended to a
+write-ahead log in DATA_DIR:
+
+- Appending only encodes one JSON line into a buffer. A background thread
+  writes and fsyncs whatever has accumulated every commit interval (group
+  commit), so a burst of writes costs one fsync. server.py answers a write
+  request once the commit holding its entries is done (wait()), unless
+  WRITE_DURABILITY=async, where a crash can lose the last commit interval.
+- After every `snapshot_every` log entries the whole state is written to a
+  compact snapshot and the log segments it covers are deleted, so the log
+  (and replay time) stays bounded.
+- Startup loads the snapshot and replays only the log written after it.
+
+Log entries carry whole records rather than field changes, so replaying an
+entry on top of a snapshot that already includes it yields the same state.
+That lets snapshots be taken while requests keep writing.
+"""
+
+import json
+import logging
+import os
+import threading
+
+from storage import Storage
+
+SNAPSHOT_FILE = "snapshot.json"
+SEGMENT_PREFIX = "wal-"
+SEGMENT_SUFFIX = ".log"
+
+
+def _fsync_directory(directory):
+    # Makes file creations, renames and deletions in the directory durable
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class WriteAheadLog:
+    """
+    Append-only log of JSON entries split into segments, with group commit.
+
+    Each line is "<sequence number> <json>". A segment is named after the
+    first sequence number it may hold; a new segment is started on every
+    open() and rotate(), so a torn line left by a crash is only ever at the
+    end of a segment that is no longer written to.
+
+    Args:
+        directory (str): Directory holding the segments
+        commit_interval (float): Seconds between group commits
+    """
+
+    def __init__(self, directory, commit_interval=0.005):
+        self.directory = directory
+        self.commit_interval = commit_interval
+        os.makedirs(directory, exist_ok=True)
+        # Guards the sequence and the buffer
+        self._lock = threading.Lock()
+        # Guards the file (writes, fsyncs and rotation)
+        self._io_lock = threading.Lock()
+        self._committed = threading.Condition(threading.Lock())
+        self._pending = threading.Event()
+        self._stopped = threading.Event()
+        self._buffer = []
+        self._sequence = 0
+        self._durable_sequence = 0
+        self._file = None
+        self._thread = None
+        self.commits = 0
+
+    @property
+    def sequence(self):
+        """Sequence number of the last appended entry."""
+        return self._sequence
+
+    def segments(self):
+        """
+        List the log segments, oldest first.
+
+        Returns:
+            list: (first sequence number, path) pairs
+        """
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX):
+                first = name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+                if first.isdigit():
+                    segments.append((int(first), os.path.join(self.directory, name)))
+        segments.sort()
+        return segments
+
+    def replay(self, after=0):
+        """
+        Read the logged entries, stopping at the first torn or corrupt line.
+
+        Args:
+            after (int): Only yield entries with a greater sequence number
+
+        Yields:
+            tuple: (sequence number, entry dict) in log order
+        """
+        for _, path in self.segments():
+            with open(path, "rb") as f:
+                for line in f:
+                    try:
+                        sequence, _, payload = line.partition(b" ")
+                        sequence = int(sequence)
+                        entry = json.loads(payload) if line.endswith(b"\n") else None
+                    except ValueError:
+                        entry = None
+                    if entry is None:
+                        logging.getLogger(__name__).warning("Ignoring torn log entry in %s", path)
+                        break
+                    self._sequence = max(self._sequence, sequence)
+                    if sequence > after:
+                        yield sequence, entry
+
+    def open(self, after=0):
+        """
+        Start appending (in a new segment) and start the commit thread.
+
+        Args:
+            after (int): Sequence number to continue after, if greater than
+                the last one replayed (e.g. the snapshot's)
+        """
+        with self._io_lock:
+            self._sequence = max(self._sequence, after)
+            self._durable_sequence = self._sequence
+            self._open_segment(self._sequence + 1)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="wal-commit", daemon=True)
+        self._thread.start()
+
+    def _open_segment(self, first):
+        path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{first:020d}{SEGMENT_SUFFIX}")
+        self._file = open(path, "ab")
+        _fsync_directory(self.directory)
+
+    def append(self, entry):
+        """
+        Append an entry; it becomes durable at the next group commit.
+
+        Args:
+            entry (dict): JSON-serializable entry
+
+        Returns:
+            int: Sequence number of the entry (see wait())
+        """
+        payload = json.dumps(entry, separators=(",", ":"))
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+            self._buffer.append(f"{sequence} {payload}\n")
+        self._pending.set()
+        return sequence
+
+    def _commit(self):
+        # Caller holds _io_lock
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+            sequence = self._sequence
+        if lines:
+            self._file.write("".join(lines).encode())
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.commits += 1
+        with self._committed:
+            self._durable_sequence = sequence
+            self._committed.notify_all()
+        return sequence
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._pending.wait()
+            self._pending.clear()
+            try:
+                with self._io_lock:
+                    if self._file is not None:
+                        self._commit()
+            except Exception:
+                logging.getLogger(__name__).exception("Write-ahead log commit failed")
+            # Let the next batch of appends accumulate
+            self._stopped.wait(self.commit_interval)
+
+    def wait(self, sequence, timeout=None):
+        """
+        Block until an appended entry is on disk.
+
+        Args:
+            sequence (int): Sequence number returned by append()
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: True if the entry is durable
+        """
+        with self._committed:
+            return self._committed.wait_for(lambda: self._durable_sequence >= sequence, timeout)
+
+    def rotate(self):
+        """
+        Commit the buffered entries and start a new segment.
+
+        Returns:
+            int: Last sequence number in the old segments
+        """
+        with self._io_lock:
+            sequence = self._commit()
+            self._file.close()
+            self._open_segment(sequence + 1)
+        return sequence
+
+    def truncate(self, through):
+        """
+        Delete the segments holding only entries up to a sequence number.
+
+        Args:
+            through (int): Last sequence number covered by a snapshot
+        """
+        segments = self.segments()
+        for (first, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first - 1 <= through:
+                os.remove(path)
+        _fsync_directory(self.directory)
+
+    def close(self):
+        """Commit the buffered entries and stop the commit thread."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopped.set()
+            self._pending.set()
+            thread.join()
+        with self._io_lock:
+            if self._file is not None:
+                self._commit()
+                self._file.close()
+                self._file = None
+
+
+class Persistence(Storage):
+    """
+    Journals RecordStores and the donation history to a WriteAheadLog
+    (the "wal" storage backend).
+
+    Args:
+        directory (str): Data directory (created if missing)
+        stores (dict): Name -> (RecordStore, record class, or None for
+            plain dict records)
+        history (dict): Donation history, key -> list of entries
+        commit_interval (float): Seconds between group commits
+        snapshot_every (int): Log entries between snapshots
+    """
+
+    def __init__(self, directory, stores, history, commit_interval=0.005, snapshot_every=10000):
+        super().__init__(stores, history)
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        self.log = WriteAheadLog(directory, commit_interval)
+        # Log sequence number that triggers the next snapshot; only changed
+        # by the thread holding _snapshot_lock
+        self._next_snapshot = snapshot_every
+        self._snapshot_lock = threading.Lock()
+        self.snapshots = 0
+        self.last_snapshot_sequence = 0
+
+    def put(self, name, key, data):
+        return self._append({"op": "put", "store": name, "record": data})
+
+    def delete(self, name, key):
+        return self._append({"op": "delete", "store": name, "key": key})
+
+    def _append(self, entry):
+        sequence = self._track(self.log.append(entry))
+        # Sequence numbers are handed out under the log's lock, so concurrent
+        # appends cannot miss the trigger the way a shared counter could
+        if sequence >= self._next_snapshot and self._snapshot_lock.acquire(blocking=False):
+            self._next_snapshot = sequence + self.snapshot_every
+            # Taken off the request thread; the lock is released when done
+            threading.Thread(target=self._snapshot_locked, name="wal-snapshot", daemon=True).start()
+        return sequence
+
+    def log_history(self, key):
+        """
+        Journal a changed donation history list.
+
+        The whole list is logged, like whole records, so replay is idempotent.
+
+        Args:
+            key (str): History key (donor email)
+
+        Returns:
+            int: Sequence number of the entry (see wait())
+        """
+        return self._append({"op": "history", "key": key, "entries": list(self.history.get(key, ()))})
+
+    def wait(self, ticket, timeout=None):
+        return self.log.wait(ticket, timeout)
+
+    def recover(self):
+        """
+        Load the snapshot, replay the log after it and start journaling.
+
+        Stores are only replaced when a snapshot exists; otherwise the log is
+        replayed on top of their current (seed) contents and a first snapshot
+        is taken.
+
+        Returns:
+            dict: Store name -> largest primary id ever written, so id
+            counters can resume after deleted records too
+        """
+        largest = self._largest
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        sequence = 0
+        snapshot = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                snapshot = json.load(f)
+            sequence = snapshot["sequence"]
+            for name in self.stores:
+                self.load(name, snapshot["stores"].get(name, ()))
+                largest[name] = max(largest[name], snapshot.get("largestIds", {}).get(name, 0))
+            self.history.clear()
+            self.history.update(snapshot.get("history", {}))
+        else:
+            for name, (store, _) in self.stores.items():
+                for record in store:
+                    largest[name] = max(largest[name], record[store.primary_key])
+
+        for _, entry in self.log.replay(after=sequence):
+            op = entry["op"]
+            if op == "history":
+                self.history[entry["key"]] = entry["entries"]
+                continue
+            store, record_class = self.stores[entry["store"]]
+            if op == "put":
+                record = self.decode(entry["record"], record_class)
+                key = record[store.primary_key]
+                store.delete(key)
+                store.insert(record)
+                largest[entry["store"]] = max(largest[entry["store"]], key)
+            elif op == "delete":
+                store.delete(entry["key"])
+
+        self.log.open(after=sequence)
+        self.last_snapshot_sequence = sequence
+        self._next_snapshot = self.log.sequence + self.snapshot_every
+        self.install_journals()
+        if snapshot is None:
+            self.snapshot()
+        return dict(largest)
+
+    def snapshot(self):
+        """Write a snapshot of the current state and drop the log it covers."""
+        with self._snapshot_lock:
+            self._snapshot_locked(release=False)
+
+    def _snapshot_locked(self, release=True):
+        try:
+            sequence = self.log.rotate()
+            stores = {name: [self.encode(record) for record in list(store)] for name, (store, _) in self.stores.items()}
+            state = {
+                "sequence": sequence,
+                "largestIds": dict(self._largest),
+                "stores": stores,
+                "history": {key: list(entries) for key, entries in list(self.history.items())}
+            }
+
+            path = os.path.join(self.directory, SNAPSHOT_FILE)
+            temporary = path + ".tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(state, f, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, path)
+            _fsync_directory(self.directory)
+            self.log.truncate(sequence)
+            self.snapshots += 1
+            self.last_snapshot_sequence = sequence
+        except Exception:
+            logging.getLogger(__name__).exception("Snapshot failed")
+        finally:
+            if release:
+                self._snapshot_lock.release()
+
+    def stats(self):
+        """
+        Get log metrics.
+
+        Returns:
+            dict: Entries logged, group commits, snapshots taken and the
+            sequence number of the last snapshot
+        """
+        return {
+            "backend": "wal",
+            "entries": self.log.sequence,
+            "commits": self.log.commits,
+            "snapshots": self.snapshots,
+            "lastSnapshotSequence": self.last_snapshot_sequence
+        }
+
+    def close(self):
+        """Wait for a running snapshot, commit pending entries and stop the log."""
+        with self._snapshot_lock:
+            self.log.close()
@@ -12,7 +12,8 @@ Version: 2.0.0
 
 from flask import Flask, jsonify, request
 from flask_cors import CORS
-from datetime import datetime
+from datetime import date, datetime
+from flask.json.provider import DefaultJSONProvider
 from flask_jwt_extended import (
     JWTManager,
     create_access_token,
@@ -20,9 +21,17 @@ from flask_jwt_extended import (
     get_jwt,
     get_jwt_identity
 )
-from werkzeug.security import generate_password_hash, check_password_hash
+import atexit
+import os
+import threading
 import uuid
 
+from inventory import InventoryAggregates, ExpiryIndex, ExpirySweeper
+from passwords import PasswordHasher, HasherBusyError
+from storage import open_storage
+from records import Donor, BloodRequest, InventoryItem, Record
+from store import RecordStore, DuplicateKeyError
+
 # Import AI engine for blood compatibility
 from ai_engine import (
     get_compatible_blood_groups,
@@ -30,14 +39,84 @@ from ai_engine import (
     is_compatible,
     get_all_valid_blood_groups,
     match_donors_to_request,
-    get_donation_stats
+    match_many,
+    get_donation_stats,
+    get_shared_compatibility_info,
+    get_shared_donation_stats,
+    get_coordinates,
+    get_blood_group_code,
+    DonorIndex,
+    MatchCache,
+    EligibilityScheduler,
+    DEFERRAL_DAYS,
+    DEFAULT_DONATION_TYPE,
+    plan_fulfillment
 )
 
 
+class RecordJSONProvider(DefaultJSONProvider):
+    """JSON provider that converts slotted records to dicts at the API edge."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Record):
+            return o.to_dict()
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = RecordJSONProvider(app)
 app.config["JWT_SECRET_KEY"] = "BLOOD_BANK_SECRET_KEY_2026_SECURE"
 jwt = JWTManager(app)
 
+# Password hashing runs on a bounded process pool (see passwords.py).
+# The method string carries the cost, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000".
+app.config["PASSWORD_HASH_METHOD"] = os.environ.get("PASSWORD_HASH_METHOD", "scrypt")
+app.config["PASSWORD_HASH_WORKERS"] = int(os.environ.get("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+app.config["PASSWORD_HASH_MAX_PENDING"] = int(os.environ.get("PASSWORD_HASH_MAX_PENDING", 0)) or None
+password_hasher = PasswordHasher(
+    method=app.config["PASSWORD_HASH_METHOD"],
+    max_workers=app.config["PASSWORD_HASH_WORKERS"],
+    max_pending=app.config["PASSWORD_HASH_MAX_PENDING"]
+)
+
+
+def parse_deferral_days(value):
+    """Parse "type=days,..." overrides of the default donation deferral periods."""
+    deferral_days = dict(DEFERRAL_DAYS)
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        donation_type, _, days = item.partition("=")
+        deferral_days[donation_type.strip()] = int(days)
+    return deferral_days
+
+
+# Days a donor is kept out of matching after each type of donation,
+# e.g. DONATION_DEFERRAL_DAYS="whole_blood=56,platelets=7"
+app.config["DONATION_DEFERRAL_DAYS"] = parse_deferral_days(os.environ.get("DONATION_DEFERRAL_DAYS", ""))
+
+# Seconds between background sweeps retiring expired inventory (0 disables the sweeper)
+app.config["INVENTORY_SWEEP_SECONDS"] = float(os.environ.get("INVENTORY_SWEEP_SECONDS", 300))
+
+# Where the stores are kept durably (see storage.py): "memory" (nothing is
+# kept), "wal" (write-ahead log and snapshots in DATA_DIR), "sqlite" (a
+# database in DATA_DIR) or "dynamodb". Setting only DATA_DIR selects "wal".
+# The log is fsynced in groups every WAL_COMMIT_SECONDS and snapshotted every
+# WAL_SNAPSHOT_EVERY entries.
+app.config["DATA_DIR"] = os.environ.get("DATA_DIR", "")
+app.config["STORAGE_BACKEND"] = os.environ.get("STORAGE_BACKEND", "wal" if app.config["DATA_DIR"] else "memory")
+if not app.config["DATA_DIR"] and app.config["STORAGE_BACKEND"] in ("wal", "sqlite"):
+    app.config["DATA_DIR"] = "data"
+app.config["AWS_REGION"] = os.environ.get("AWS_REGION", "us-east-1")
+app.config["WAL_COMMIT_SECONDS"] = float(os.environ.get("WAL_COMMIT_SECONDS", 0.005))
+app.config["WAL_SNAPSHOT_EVERY"] = int(os.environ.get("WAL_SNAPSHOT_EVERY", 10000))
+# "sync" answers a write only once the backend has stored it; "async" answers
+# right away and may lose the last moments of writes in a crash. A write not
+# stored within WRITE_TIMEOUT_SECONDS is answered with 503.
+app.config["WRITE_DURABILITY"] = os.environ.get("WRITE_DURABILITY", "sync")
+if app.config["WRITE_DURABILITY"] not in ("sync", "async"):
+    raise ValueError(f"Unknown WRITE_DURABILITY: {app.config['WRITE_DURABILITY']!r} (sync or async)")
+app.config["WRITE_TIMEOUT_SECONDS"] = float(os.environ.get("WRITE_TIMEOUT_SECONDS", 10))
+
 # Enable CORS for React frontend
 CORS(app)
 
@@ -46,12 +125,12 @@ CORS(app)
 # ============================================================================
 
 # Users storage: list of user dictionaries
-users = [
+users = RecordStore([
     {
         "id": 1,
         "name": "Apollo Hospital",
         "email": "hospital@gmail.com",
-        "password": generate_password_hash("123456"),
+        "password": None,
         "role": "hospital",
         "phone": "9876543210",
         "city": "Bangalore"
@@ -60,13 +139,39 @@ users = [
         "id": 2,
         "name": "Rahul",
         "email": "donor@gmail.com",
-        "password": generate_password_hash("123456"),
+        "password": None,
         "role": "donor",
         "bloodGroup": "O+",
         "phone": "9123456789",
         "city": "Delhi"
     }
-]
+], unique=("email",))
+
+# Plain text passwords of the seed accounts, hashed on first login instead
+# of at import so startup does not pay for key derivation
+seed_passwords = {
+    "hospital@gmail.com": "123456",
+    "donor@gmail.com": "123456"
+}
+
+
+# Held while a seed password is hashed, so a concurrent first login waits
+# for the hash instead of finding neither a hash nor a seed password
+seed_password_lock = threading.Lock()
+
+
+def get_password_hash(user):
+    """Return a user's password hash, deriving it on first use for seed accounts."""
+    if user["password"] is None and user["email"] in seed_passwords:
+        with seed_password_lock:
+            # Another login may have hashed it while this one waited
+            if user["password"] is None and user["email"] in seed_passwords:
+                user["password"] = password_hasher.hash(seed_passwords[user["email"]])
+                # Dropped only once hashed, so a busy hasher leaves it for a retry
+                del seed_passwords[user["email"]]
+                users.reindex(user["id"])
+    return user["password"]
+
 
 # Donation history: donor_id -> list of donations
 donation_history = {}
@@ -77,6 +182,114 @@ def generate_unique_id(prefix):
     return f"{prefix}{str(uuid.uuid4())[:8]}"
 
 
+def get_limit_arg(name="limit"):
+    """
+    Parse an optional positive integer query parameter (?limit= by default).
+
+    Returns a (limit, error_response) pair; limit is None when the parameter
+    is absent, and error_response is set when it is not a positive integer.
+    """
+    raw_limit = request.args.get(name)
+    if raw_limit is None or raw_limit == "":
+        return None, None
+    try:
+        limit = int(raw_limit)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return None, (jsonify({"error": f"{name} must be a positive integer"}), 400)
+    return limit, None
+
+
+def get_radius_arg():
+    """
+    Parse the optional ?radius= query parameter (kilometres).
+
+    Returns a (radius_km, error_response) pair like get_limit_arg().
+    """
+    raw_radius = request.args.get("radius")
+    if raw_radius is None or raw_radius == "":
+        return None, None
+    try:
+        radius_km = float(raw_radius)
+    except ValueError:
+        radius_km = 0
+    if not radius_km > 0:
+        return None, (jsonify({"error": "radius must be a positive number of kilometres"}), 400)
+    return radius_km, None
+
+
+def parse_coordinates(data):
+    """
+    Read optional latitude/longitude fields from a request payload.
+
+    Returns a (coordinates, error_response) pair; coordinates is a
+    (latitude, longitude) tuple, or None when neither field is given.
+    """
+    latitude = data.get("latitude")
+    longitude = data.get("longitude")
+    if latitude is None and longitude is None:
+        return None, None
+    try:
+        latitude = float(latitude)
+        longitude = float(longitude)
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "latitude and longitude must both be numbers"}), 400)
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return None, (jsonify({"error": "latitude must be within ±90 and longitude within ±180"}), 400)
+    return (latitude, longitude), None
+
+
+def parse_bool(value):
+    """Parse a boolean query parameter value."""
+    lowered = value.lower()
+    if lowered in ("true", "1", "yes"):
+        return True
+    if lowered in ("false", "0", "no"):
+        return False
+    raise ValueError(value)
+
+
+def list_page(store, filter_args, transform=None):
+    """
+    Serve a list endpoint from a RecordStore with filters and cursor pagination.
+
+    filter_args maps query parameter names (which are also the store's
+    filter-indexed fields) to converters for their values. Without ?limit=
+    or ?after= the matching records are returned as a plain JSON array, as
+    before; otherwise the response is {"items": [...], "nextCursor": id}
+    where nextCursor is passed as ?after= to get the next page.
+    """
+    limit, error = get_limit_arg()
+    if error:
+        return error
+
+    raw_after = request.args.get("after")
+    after = None
+    if raw_after:
+        try:
+            after = int(raw_after)
+        except ValueError:
+            return jsonify({"error": "after must be an id returned as nextCursor"}), 400
+
+    filters = {}
+    for name, convert in filter_args.items():
+        raw_value = request.args.get(name)
+        if raw_value is None or raw_value == "":
+            continue
+        try:
+            filters[name] = convert(raw_value)
+        except ValueError:
+            return jsonify({"error": f"Invalid {name} filter"}), 400
+
+    records, next_cursor = store.query(filters, after, limit)
+    items = [transform(record) for record in records] if transform else records
+
+    if limit is None and after is None:
+        return jsonify(items)
+    return jsonify({"items": items, "nextCursor": next_cursor})
+
+
 # ============================================================================
 # AUTHENTICATION ROUTES
 # ============================================================================
@@ -88,9 +301,14 @@ def login():
     email = data.get("email")
     password = data.get("password")
 
-    user = next((u for u in users if u["email"] == email), None)
+    user = users.find("email", email)
+
+    try:
+        valid = user is not None and password_hasher.verify(get_password_hash(user), password)
+    except HasherBusyError:
+        return jsonify({"error": "Server busy, please retry"}), 503
 
-    if not user or not check_password_hash(user["password"], password):
+    if not valid:
         return jsonify({"error": "Invalid credentials"}), 401
 
     token = create_access_token(
@@ -110,7 +328,6 @@ def login():
 
 @app.route("/api/auth/signup", methods=["POST"])
 def signup():
-    global donor_id
     data = request.json
 
     name = data.get("name")
@@ -132,44 +349,68 @@ def signup():
                 "error": f"Invalid blood group! Valid groups: {', '.join(valid_blood_groups)}"
             }), 400
 
-    # check if user exists
-    if any(u["email"] == email for u in users):
+    coordinates, error = parse_coordinates(data)
+    if error:
+        return error
+    latitude, longitude = coordinates or (None, None)
+
+    # check if user exists (a donor profile also claims the email)
+    if users.find("email", email) or (role.lower() == "donor" and donors.find("email", email)):
+        return jsonify({"error": "User already exists"}), 409
+
+    try:
+        password_hash = password_hasher.hash(password)
+    except HasherBusyError:
+        return jsonify({"error": "Server busy, please retry"}), 503
+
+    # re-check: another signup may have claimed the email while hashing
+    if users.find("email", email):
         return jsonify({"error": "User already exists"}), 409
 
     new_user = {
-        "id": len(users) + 1,
+        "id": users.allocate_id(),
         "name": name,
         "email": email,
-        "password": generate_password_hash(password),
+        "password": password_hash,
         "role": role,
         "phone": phone,
         "bloodGroup": bloodGroup,
         "city": city
     }
 
-    users.append(new_user)
+    try:
+        users.insert(new_user)
+    except DuplicateKeyError:
+        # lost a race with a concurrent signup for the same email
+        return jsonify({"error": "User already exists"}), 409
 
     # If donor, automatically create donor profile
     if role.lower() == "donor":
-        donor_profile = {
-            "id": donor_id,
+        donor_profile = Donor.from_dict({
+            "id": donors.allocate_id(),
             "userId": new_user["id"],
             "name": name,
             "gender": data.get("gender", ""),
             "bloodGroup": bloodGroup,
             "phone": phone,
             "city": city,
+            "latitude": latitude,
+            "longitude": longitude,
             "email": email,
             "available": False,
             "verified": False,
             "unavailableDates": [],
             "donationCount": 0,
             "lastDonationDate": None,
-            "createdAt": datetime.utcnow().isoformat(),
-            "compatibilityInfo": get_donation_stats(bloodGroup) if bloodGroup else None
-        }
-        donors.append(donor_profile)
-        donor_id += 1
+            "createdAt": datetime.utcnow()
+        })
+        try:
+            donors.insert(donor_profile)
+        except DuplicateKeyError:
+            users.delete(new_user["id"])
+            return jsonify({"error": "User already exists"}), 409
+        with matching_lock:
+            donor_index.add(donor_profile)
 
     token = create_access_token(
     identity=str(new_user["id"]), # ✅ STRING
@@ -192,8 +433,35 @@ def signup():
 # -------- DONORS --------
 
 
-donors = []
-donor_id = 2
+# Unique by email and by owning user; donors without an email are not indexed
+donors = RecordStore(
+    unique=("email", "userId"),
+    indexed=("bloodGroup", "city", "available"),
+    counted=(("bloodGroup", "available"), ("city", "available")),
+    first_id=2
+)
+
+# Donors bucketed by blood group and availability for request matching
+donor_index = DonorIndex()
+
+# Matched donors of open requests, invalidated by donor_index updates
+match_cache = MatchCache(donor_index)
+
+# Donors who recently donated are deferred in donor_index until eligible again
+eligibility = EligibilityScheduler(donor_index, app.config["DONATION_DEFERRAL_DAYS"])
+
+# Held while using or updating donor_index, match_cache and eligibility,
+# which share donor buckets. Taken after inventory_lock when both are needed.
+matching_lock = threading.RLock()
+
+
+@app.before_request
+def release_eligible_donors():
+    # A lock-free heap peek; matching_lock is only taken once some deferred
+    # donor has become eligible
+    if eligibility.has_due():
+        with matching_lock:
+            eligibility.release_due()
 
 @app.route("/api/donors/register", methods=["POST"])
 @jwt_required()
@@ -205,7 +473,7 @@ def register_donor():
         return jsonify({"error": "Only donors can register"}), 403
 
     # prevent duplicate registration
-    if any(d.get("userId") == user_id for d in donors):
+    if donors.find("userId", user_id):
         return jsonify({"error": "Donor already registered"}), 409
 
     data = request.get_json()
@@ -229,25 +497,41 @@ def register_donor():
             "error": f"Invalid blood group! Valid groups: {', '.join(valid_blood_groups)}"
         }), 400
 
-    donor = {
-        "id": len(donors) + 1,
+    coordinates, error = parse_coordinates(data)
+    if error:
+        return error
+    latitude, longitude = coordinates or (None, None)
+
+    email = data.get("email", "")
+    if email and donors.find("email", email):
+        return jsonify({"error": "Donor email already registered"}), 409
+
+    donor = Donor.from_dict({
+        "id": donors.allocate_id(),
         "userId": user_id,
         "name": data["name"],
         "gender": data["gender"],
         "bloodGroup": blood_group,
         "phone": data["phone"],
         "city": data["city"],
-        "email": data.get("email", ""),
+        "latitude": latitude,
+        "longitude": longitude,
+        "email": email,
         "available": False,
         "verified": False,
         "unavailableDates": [],
         "donationCount": 0,
         "lastDonationDate": None,
-        "createdAt": datetime.utcnow().isoformat(),
-        "compatibilityInfo": get_donation_stats(blood_group)
-    }
+        "createdAt": datetime.utcnow()
+    })
 
-    donors.append(donor)
+    try:
+        donors.insert(donor)
+    except DuplicateKeyError:
+        # lost a race with a concurrent registration
+        return jsonify({"error": "Donor already registered"}), 409
+    with matching_lock:
+        donor_index.add(donor)
     return jsonify(donor), 201
 
 
@@ -255,29 +539,26 @@ def register_donor():
 
 @app.route("/api/donors", methods=["GET"])
 def get_donors():
-    """Get all donors with compatibility info."""
-    # Add compatibility info to each donor
-    donors_with_info = []
-    for donor in donors:
-        donor_copy = donor.copy()
-        if donor_copy.get("bloodGroup"):
-            donor_copy["compatibilityInfo"] = get_donation_stats(donor_copy["bloodGroup"])
-        donors_with_info.append(donor_copy)
-    return jsonify(donors_with_info)
+    """Get donors with compatibility info.
+
+    Filters: bloodGroup, city, available. Pagination: ?limit=&after=.
+    """
+    # Donors are converted to JSON at the edge; compatibilityInfo is the
+    # shared payload for each donor's blood group.
+    return list_page(donors, {"bloodGroup": str, "city": str, "available": parse_bool})
 
 
 @app.route("/api/donors/profile/<email>", methods=["GET"])
 @jwt_required()
 def get_donor_profile(email):
     """Get donor profile with donation history."""
-    donor = next((d for d in donors if d.get("email") == email), None)
+    donor = donors.find("email", email)
     if not donor:
         return jsonify({"error": "Donor profile not found"}), 404
     
     # Add donation history
-    profile = donor.copy()
+    profile = donor.to_dict()
     profile["donationHistory"] = donation_history.get(email, [])
-    profile["compatibilityInfo"] = get_donation_stats(donor["bloodGroup"]) if donor.get("bloodGroup") else None
     
     return jsonify(profile)
 
@@ -288,43 +569,76 @@ def record_donation_route(id):
     """Record a donation for a donor."""
     data = request.get_json()
     
-    for donor in donors:
-        if donor["id"] == id:
-            # Update donor stats
-            donor["donationCount"] = donor.get("donationCount", 0) + 1
-            donor["lastDonationDate"] = datetime.utcnow().isoformat()
-            
-            # Record in donation history
-            donor_email = donor.get("email", f"donor_{id}")
-            if donor_email not in donation_history:
-                donation_history[donor_email] = []
-            
-            donation_record = {
-                "requestId": data.get("requestId", ""),
-                "bloodGroup": donor["bloodGroup"],
-                "requestorEmail": data.get("requestorEmail", ""),
-                "requestorName": data.get("requestorName", ""),
-                "dateTime": datetime.utcnow().isoformat(),
-                "units": data.get("units", 1)
-            }
-            donation_history[donor_email].append(donation_record)
-            
-            return jsonify({
-                "donor": donor,
-                "donation": donation_record
-            })
+    donor = donors.get(id)
+    if not donor:
+        return jsonify({"error": "Donor not found"}), 404
+
+    donation_type = data.get("donationType", DEFAULT_DONATION_TYPE)
+    if donation_type not in eligibility.deferral_days:
+        return jsonify({
+            "error": f"Invalid donation type! Valid types: {', '.join(eligibility.deferral_days)}"
+        }), 400
     
-    return jsonify({"error": "Donor not found"}), 404
+    with matching_lock:
+        # Update donor stats
+        donor.donation_count += 1
+        donor.last_donation_date = datetime.utcnow()
+        donor.last_donation_type = donation_type
+
+        # Deferred out of matching until the deferral period has passed
+        donor.next_eligible_date = eligibility.record_donation(donor, donor.last_donation_date, donation_type)
+
+        # Record in donation history
+        donor_email = donor.get("email", f"donor_{id}")
+        if donor_email not in donation_history:
+            donation_history[donor_email] = []
+
+        donation_record = {
+            "requestId": data.get("requestId", ""),
+            "bloodGroup": donor["bloodGroup"],
+            "requestorEmail": data.get("requestorEmail", ""),
+            "requestorName": data.get("requestorName", ""),
+            "donationType": donation_type,
+            "dateTime": datetime.utcnow().isoformat(),
+            "units": data.get("units", 1)
+        }
+        donation_history[donor_email].append(donation_record)
+        if storage is not None:
+            storage.log_history(donor_email)
+        donors.reindex(id)
+        donor_index.update(donor)
+    
+    return jsonify({
+        "donor": donor,
+        "donation": donation_record
+    })
+
+
+@app.route("/api/donors/eligible-soon", methods=["GET"])
+def get_donors_eligible_soon():
+    """List deferred donors becoming eligible to donate in the next ?days= days (default 7)."""
+    days, error = get_limit_arg("days")
+    if error:
+        return error
+
+    # Soonest first; each donor's nextEligibleDate says when
+    with matching_lock:
+        upcoming = eligibility.upcoming(days or 7)
+    return jsonify([donor for _, donor in upcoming])
 
 
 @app.route("/api/donors/<int:id>/toggle", methods=["PATCH"])
 def toggle_donor(id):
     """Toggle donor availability."""
-    for donor in donors:
-        if donor["id"] == id:
-            donor["available"] = not donor["available"]
-            return jsonify(donor)
-    return jsonify({"error": "Donor not found"}), 404
+    donor = donors.get(id)
+    if not donor:
+        return jsonify({"error": "Donor not found"}), 404
+
+    with matching_lock:
+        donor.available = not donor.available
+        donors.reindex(id)
+        donor_index.update(donor)
+    return jsonify(donor)
 
 
 @app.route("/api/donors/<int:id>/unavailable-dates", methods=["PATCH"])
@@ -334,39 +648,72 @@ def update_unavailable_dates(id):
     if not data or "unavailableDates" not in data:
         return jsonify({"error": "Missing unavailableDates field"}), 422
     
-    for donor in donors:
-        if donor["id"] == id:
+    donor = donors.get(id)
+    if not donor:
+        return jsonify({"error": "Donor not found"}), 404
+
+    # Compiled into merged intervals; matching skips donors blocked on the request day
+    with matching_lock:
+        try:
             donor["unavailableDates"] = data["unavailableDates"]
-            return jsonify(donor)
-    return jsonify({"error": "Donor not found"}), 404
+        except (TypeError, ValueError):
+            return jsonify({"error": "unavailableDates entries need a YYYY-MM-DD date (and optional endDate)"}), 400
+        donors.reindex(id)
+        donor_index.update(donor)
+    return jsonify(donor)
+
+
+@app.route("/api/donors/<int:id>/location", methods=["PATCH"])
+def update_donor_location(id):
+    """Set (or clear, with nulls) a donor's coordinates used for proximity matching."""
+    data = request.get_json()
+    if not data or "latitude" not in data or "longitude" not in data:
+        return jsonify({"error": "Missing latitude/longitude fields"}), 422
+
+    coordinates, error = parse_coordinates(data)
+    if error:
+        return error
+
+    donor = donors.get(id)
+    if not donor:
+        return jsonify({"error": "Donor not found"}), 404
+
+    with matching_lock:
+        donor.latitude, donor.longitude = coordinates or (None, None)
+        donors.reindex(id)
+        donor_index.update(donor)
+    return jsonify(donor)
 
 
 # -------- HOSPITALS --------
-hospitals = {
-    1: {
+hospitals = RecordStore([
+    {
         "id": 1,
         "name": "Apollo Hospital",
         "email": "apollo@gmail.com",
         "phone": "9876543210",
         "city": "Bangalore",
         "license": "LIC-AP-001",
+        "latitude": 12.9716,
+        "longitude": 77.5946,
         "verified": True
     },
-    2: {
+    {
         "id": 2,
         "name": "Fortis Care",
         "email": "fortis@gmail.com",
         "phone": "9123456789",
         "city": "Delhi",
         "license": "LIC-FT-002",
+        "latitude": 28.6139,
+        "longitude": 77.2090,
         "verified": False
     }
-}
-hospital_id = 3
+], indexed=("city", "verified"))
 
 
 # -------- INVENTORY --------
-inventory = [
+inventory = RecordStore(map(InventoryItem.from_dict, [
     {
         "id": 1,
         "hospitalId": 1,
@@ -385,12 +732,45 @@ inventory = [
         "expiry": "2025-04-02",
         "updatedAt": "2025-01-23T20:15:00"
     }
-]
-inventory_id = 3
+]), indexed=("bloodGroup", "hospitalId"))
+
+# Units per hospital and per city by blood group, kept in step with inventory
+inventory_totals = InventoryAggregates()
+
+# Batches per blood group ordered by expiry, for FEFO reservation and expiry sweeps
+expiry_index = ExpiryIndex()
+
+# Held by inventory writes and the background expiry sweeper
+inventory_lock = threading.RLock()
+expiry_stats = {"retiredBatches": 0, "retiredUnits": 0, "lastSweep": None}
+
+
+def retire_expired_inventory(today=None):
+    """Delete the batches past their expiry date; only expired batches are visited."""
+    with inventory_lock:
+        expired = expiry_index.expired(today)
+        for item in expired:
+            inventory.delete(item.id)
+            inventory_totals.remove(item)
+            expiry_index.remove(item)
+            expiry_stats["retiredBatches"] += 1
+            expiry_stats["retiredUnits"] += item.units
+        expiry_stats["lastSweep"] = datetime.utcnow().isoformat()
+        return expired
+
+
+expiry_sweeper = ExpirySweeper(retire_expired_inventory, app.config["INVENTORY_SWEEP_SECONDS"])
+
+
+@app.before_request
+def start_expiry_sweeper():
+    # Started on first request so importing the server spawns no thread
+    if app.config["INVENTORY_SWEEP_SECONDS"] > 0:
+        expiry_sweeper.start()
 
 
 # -------- REQUESTS --------
-blood_requests = [
+blood_requests = RecordStore(map(BloodRequest.from_dict, [
     {
         "id": 1,
         "hospital": "Metro Blood Bank",
@@ -402,203 +782,639 @@ blood_requests = [
         "status": "OPEN",
         "createdAt": "2025-01-24T12:33:00"
     }
-]
-request_id = 2
+]), indexed=("status", "urgency", "bloodGroup", "hospitalId", "city"),
+    counted=(("status", "bloodGroup"), ("status", "city")))
+
+
+# -------- STORAGE --------
+# With a durable backend the stores are loaded from it here, and every
+# later store write is passed on to it
+storage = open_storage(app.config, {
+    "users": (users, None),
+    "donors": (donors, Donor),
+    "hospitals": (hospitals, None),
+    "inventory": (inventory, InventoryItem),
+    "blood_requests": (blood_requests, BloodRequest)
+}, donation_history)
+if storage is not None:
+    largest_ids = storage.recover()
+    # Flushes the last writes on a clean exit
+    atexit.register(storage.close)
+    # Ids of records deleted before the restart are not handed out again
+    for name, (store, _) in storage.stores.items():
+        store.reserve_ids(largest_ids[name])
+
+
+@app.after_request
+def wait_for_durable_writes(response):
+    # The request's writes were only queued; with sync durability the
+    # response waits for them to be stored
+    if storage is None or app.config["WRITE_DURABILITY"] != "sync":
+        return response
+    if not storage.wait_for_writes(app.config["WRITE_TIMEOUT_SECONDS"]):
+        return jsonify({"error": "The change was not stored in time"}), 503
+    return response
+
+# Derived indexes are rebuilt from the (seed or recovered) stores
+for donor in donors:
+    donor_index.add(donor)
+    if donor.next_eligible_date is not None:
+        eligibility.schedule(donor, donor.next_eligible_date)
+for hospital in hospitals:
+    inventory_totals.set_hospital_city(hospital["id"], hospital["city"])
+for item in inventory:
+    inventory_totals.add(item)
+    expiry_index.add(item)
+for req in blood_requests:
+    if req["status"] == "OPEN":
+        match_cache.track(req["id"], req)
 
 
 # -------- HOSPITALS --------
 @app.route("/api/hospitals", methods=["GET"])
 def get_hospitals():
-    return jsonify(list(hospitals.values()))
+    """List hospitals. Filters: city, verified. Pagination: ?limit=&after=."""
+    return list_page(hospitals, {"city": str, "verified": parse_bool})
 
 
 @app.route("/api/hospitals", methods=["POST"])
 def add_hospital():
-    global hospital_id
     data = request.json
 
+    coordinates, error = parse_coordinates(data)
+    if error:
+        return error
+    latitude, longitude = coordinates or (None, None)
+
     hospital = {
-        "id": hospital_id,
+        "id": hospitals.allocate_id(),
         "name": data["name"],
         "email": data["email"],
         "phone": data["phone"],
         "city": data["city"],
         "license": data["license"],
+        "latitude": latitude,
+        "longitude": longitude,
         "verified": False
     }
 
-    hospitals[hospital_id] = hospital
-    hospital_id += 1
+    hospitals.insert(hospital)
+    with inventory_lock:
+        inventory_totals.set_hospital_city(hospital["id"], hospital["city"])
     return jsonify(hospital), 201
 
 
 @app.route("/api/hospitals/<int:id>", methods=["PATCH"])
 def update_hospital(id):
-    if id not in hospitals:
-        return jsonify({"error": "Hospital not found"}), 404
-
     data = request.json
-    hospital = hospitals[id]
 
-    hospital["name"] = data.get("name", hospital["name"])
-    hospital["email"] = data.get("email", hospital["email"])
-    hospital["phone"] = data.get("phone", hospital["phone"])
-    hospital["city"] = data.get("city", hospital["city"])
-    hospital["license"] = data.get("license", hospital["license"])
+    located = "latitude" in data or "longitude" in data
+    if located:
+        coordinates, error = parse_coordinates(data)
+        if error:
+            return error
+
+    def change(hospital):
+        if located:
+            hospital["latitude"], hospital["longitude"] = coordinates or (None, None)
+        hospital["name"] = data.get("name", hospital["name"])
+        hospital["email"] = data.get("email", hospital["email"])
+        hospital["phone"] = data.get("phone", hospital["phone"])
+        hospital["city"] = data.get("city", hospital["city"])
+        hospital["license"] = data.get("license", hospital["license"])
+
+    # The city mapping is updated with the record, so concurrent updates
+    # leave both on the same city
+    with inventory_lock:
+        hospital = hospitals.update(id, change)
+        if not hospital:
+            return jsonify({"error": "Hospital not found"}), 404
+        inventory_totals.set_hospital_city(id, hospital["city"])
 
     return jsonify(hospital)
 
 
 @app.route("/api/hospitals/<int:id>/toggle", methods=["PATCH"])
 def toggle_hospital(id):
-    if id not in hospitals:
-        return jsonify({"error": "Hospital not found"}), 404
+    def change(hospital):
+        hospital["verified"] = not hospital["verified"]
 
-    hospitals[id]["verified"] = not hospitals[id]["verified"]
-    return jsonify(hospitals[id])
+    hospital = hospitals.update(id, change)
+    if not hospital:
+        return jsonify({"error": "Hospital not found"}), 404
+    return jsonify(hospital)
 
 
 @app.route("/api/hospitals/<int:id>", methods=["DELETE"])
 def delete_hospital(id):
-    if id not in hospitals:
+    if not hospitals.delete(id):
         return jsonify({"error": "Hospital not found"}), 404
 
-    del hospitals[id]
     return jsonify({"message": "Deleted"})
 
 
 # -------- INVENTORY --------
+def validate_inventory_data(data):
+    """Check the optional bloodGroup, units and expiry fields of an inventory payload."""
+    if "bloodGroup" in data and data["bloodGroup"] not in get_all_valid_blood_groups():
+        return jsonify({
+            "error": f"Invalid blood group! Valid groups: {', '.join(get_all_valid_blood_groups())}"
+        }), 400
+    if "units" in data:
+        try:
+            int(data["units"])
+        except (TypeError, ValueError):
+            return jsonify({"error": "units must be an integer"}), 400
+    if "expiry" in data:
+        try:
+            date.fromisoformat(data["expiry"])
+        except (TypeError, ValueError):
+            return jsonify({"error": "expiry must be a YYYY-MM-DD date"}), 400
+    return None
+
+
 @app.route("/api/inventory", methods=["GET"])
 def get_inventory():
-    return jsonify(inventory)
+    """List inventory. Filters: bloodGroup, hospitalId. Pagination: ?limit=&after=."""
+    return list_page(inventory, {"bloodGroup": str, "hospitalId": int})
 
 
 @app.route("/api/inventory", methods=["POST"])
 def add_inventory():
-    global inventory_id
     data = request.json
 
-    record = {
-        "id": inventory_id,
-        "hospitalId": data["hospitalId"],
-        "hospitalName": data["hospitalName"],
-        "bloodGroup": data["bloodGroup"],
-        "units": int(data["units"]),
-        "expiry": data["expiry"],
-        "updatedAt": datetime.utcnow().isoformat()
-    }
-
-    inventory.append(record)
-    inventory_id += 1
+    error = validate_inventory_data(data)
+    if error:
+        return error
+
+    with inventory_lock:
+        record = InventoryItem.from_dict({
+            "id": inventory.allocate_id(),
+            "hospitalId": data["hospitalId"],
+            "hospitalName": data["hospitalName"],
+            "bloodGroup": data["bloodGroup"],
+            "units": int(data["units"]),
+            "expiry": data["expiry"],
+            "updatedAt": datetime.utcnow()
+        })
+
+        inventory.insert(record)
+        inventory_totals.add(record)
+        expiry_index.add(record)
     return jsonify(record), 201
 
 
 @app.route("/api/inventory/<int:id>", methods=["PATCH"])
 def update_inventory(id):
-    for item in inventory:
-        if item["id"] == id:
-            data = request.json
-            item["hospitalId"] = data.get("hospitalId", item["hospitalId"])
-            item["hospitalName"] = data.get("hospitalName", item["hospitalName"])
-            item["bloodGroup"] = data.get("bloodGroup", item["bloodGroup"])
-            item["units"] = int(data.get("units", item["units"]))
-            item["expiry"] = data.get("expiry", item["expiry"])
-            item["updatedAt"] = datetime.utcnow().isoformat()
-            return jsonify(item)
-
-    return jsonify({"error": "Inventory not found"}), 404
+    with inventory_lock:
+        item = inventory.get(id)
+        if not item:
+            return jsonify({"error": "Inventory not found"}), 404
+
+        data = request.json
+        error = validate_inventory_data(data)
+        if error:
+            return error
+
+        item["hospitalId"] = data.get("hospitalId", item["hospitalId"])
+        item["hospitalName"] = data.get("hospitalName", item["hospitalName"])
+        item["bloodGroup"] = data.get("bloodGroup", item["bloodGroup"])
+        item["units"] = int(data.get("units", item["units"]))
+        item["expiry"] = data.get("expiry", item["expiry"])
+        item.updated_at = datetime.utcnow()
+        inventory.reindex(id)
+        inventory_totals.update(item)
+        expiry_index.update(item)
+    return jsonify(item)
 
 
 @app.route("/api/inventory/<int:id>", methods=["DELETE"])
 def delete_inventory(id):
-    global inventory
-    inventory = [i for i in inventory if i["id"] != id]
+    with inventory_lock:
+        item = inventory.delete(id)
+        if item:
+            inventory_totals.remove(item)
+            expiry_index.remove(item)
     return jsonify({"message": "Deleted"})
 
 
+@app.route("/api/inventory/reserve", methods=["POST"])
+def reserve_inventory():
+    """Reserve units of a blood group, first-expiring-first-out.
+
+    Body: {"bloodGroup": "O-", "units": 3, "hospitalId": 1 (optional)}.
+    The soonest-expiring usable batches are drawn down (emptied batches are
+    deleted). Nothing is reserved if fewer units are available (409).
+    """
+    data = request.json or {}
+    blood_group = data.get("bloodGroup")
+    if blood_group not in get_all_valid_blood_groups():
+        return jsonify({
+            "error": f"Invalid blood group! Valid groups: {', '.join(get_all_valid_blood_groups())}"
+        }), 400
+    try:
+        units = int(data.get("units"))
+    except (TypeError, ValueError):
+        units = 0
+    if units < 1:
+        return jsonify({"error": "units must be a positive integer"}), 400
+
+    with inventory_lock:
+        plan, available = expiry_index.allocate(
+            get_blood_group_code(blood_group), units, data.get("hospitalId")
+        )
+        if plan is None:
+            return jsonify({"error": "Not enough units available", "available": available}), 409
+
+        reserved = []
+        now = datetime.utcnow()
+        for item, take in plan:
+            item.units -= take
+            item.updated_at = now
+            reserved.append({
+                "inventoryId": item.id,
+                "hospitalId": item.hospital_id,
+                "hospitalName": item.hospital_name,
+                "units": take,
+                "expiry": item["expiry"]
+            })
+            if item.units:
+                inventory.reindex(item.id)
+                inventory_totals.update(item)
+            else:
+                inventory.delete(item.id)
+                inventory_totals.remove(item)
+                expiry_index.remove(item)
+
+    return jsonify({"bloodGroup": blood_group, "units": units, "batches": reserved})
+
+
+@app.route("/api/inventory/summary", methods=["GET"])
+def get_inventory_summary():
+    """Units held per hospital and per city by blood group, without scanning batches.
+
+    Optional filters: hospitalId, city.
+    """
+    raw_hospital_id = request.args.get("hospitalId")
+    try:
+        hospital_id = int(raw_hospital_id) if raw_hospital_id else None
+    except ValueError:
+        return jsonify({"error": "Invalid hospitalId filter"}), 400
+
+    return jsonify(inventory_totals.summary(hospital_id, request.args.get("city") or None))
+
+
 # -------- REQUESTS --------
 @app.route("/api/requests", methods=["GET"])
 def get_requests():
-    """Get all blood requests with compatible donor information."""
-    # Enrich requests with compatible donor matching
-    requests_with_matches = []
-    for req in blood_requests:
-        req_copy = req.copy()
+    """Get blood requests with compatible donor information.
+
+    Filters: status, urgency, bloodGroup, hospitalId, city.
+    Pagination: ?limit=&after=. Optional ?matchLimit= returns only the best
+    `matchLimit` matched donors per request.
+    """
+    match_limit, error = get_limit_arg("matchLimit")
+    if error:
+        return error
+
+    def with_matches(req):
+        # Converted at the edge; includes the shared compatibilityInfo payload
+        req_copy = req.to_dict()
         
-        # Add blood group compatibility info
         if req_copy.get("bloodGroup"):
-            req_copy["compatibilityInfo"] = get_compatible_blood_groups(req_copy["bloodGroup"])
-            
-            # Find matching donors
-            matched_donors = match_donors_to_request(req_copy, donors)
+            # Open requests are served from the match cache; closed or
+            # fulfilled requests no longer need donors
+            with matching_lock:
+                if req["id"] in match_cache:
+                    matched_donors = match_cache.get(req["id"], match_limit)
+                else:
+                    matched_donors = []
             req_copy["matchedDonors"] = matched_donors
             req_copy["matchedDonorsCount"] = len(matched_donors)
         
-        requests_with_matches.append(req_copy)
-    
-    return jsonify(requests_with_matches)
+        return req_copy
 
-@app.route("/api/requests", methods=["POST"])
-def add_request():
-    global request_id
-    data = request.json
+    return list_page(blood_requests, {
+        "status": str,
+        "urgency": str,
+        "bloodGroup": str,
+        "hospitalId": int,
+        "city": str
+    }, transform=with_matches)
+
+def build_blood_request(data):
+    """
+    Validate request data and build a new (not yet stored) blood request.
 
+    Returns a (req, error_response) pair; req is None when validation fails.
+    The request has no id yet: callers allocate one once validation passed.
+    """
     hospital = hospitals.get(data["hospitalId"])
 
     if not hospital:
-        return jsonify({"error": "Hospital not found"}), 400
+        return None, (jsonify({"error": "Hospital not found"}), 400)
     
     blood_group = data["bloodGroup"]
     
     # Validate blood group using AI engine
     valid_blood_groups = get_all_valid_blood_groups()
     if blood_group not in valid_blood_groups:
-        return jsonify({
+        return None, (jsonify({
             "error": f"Invalid blood group! Valid groups: {', '.join(valid_blood_groups)}"
-        }), 400
-
-    req = {
-        "id": request_id,
+        }), 400)
+
+    # Requests are located at the given coordinates, else at their hospital
+    coordinates, error = parse_coordinates(data)
+    if error:
+        return None, error
+    latitude, longitude = coordinates or get_coordinates(hospital) or (None, None)
+
+    # Donors blocked out on this day are not matched; defaults to today
+    created_at = datetime.utcnow()
+    try:
+        required_date = date.fromisoformat(data["requiredDate"]) if data.get("requiredDate") else created_at.date()
+    except (TypeError, ValueError):
+        return None, (jsonify({"error": "requiredDate must be a YYYY-MM-DD date"}), 400)
+
+    req = BloodRequest.from_dict({
+        "id": None,
         "hospitalId": hospital["id"],
         "hospital": hospital["name"],
         "city": hospital["city"],
+        "latitude": latitude,
+        "longitude": longitude,
         "phone": data.get("phone", ""),
         "bloodGroup": blood_group,
         "units": int(data["units"]),
+        "allocatedUnits": 0,
         "urgency": data["urgency"],
         "status": "OPEN",
-        "createdAt": datetime.utcnow().isoformat(),
-        "compatibilityInfo": get_compatible_blood_groups(blood_group)
-    }
-    
-    # Find matching donors immediately
-    matched_donors = match_donors_to_request(req, donors)
-    req["matchedDonors"] = matched_donors
-    req["matchedDonorsCount"] = len(matched_donors)
+        "requiredDate": required_date,
+        "createdAt": created_at
+    })
+    return req, None
 
-    blood_requests.append(req)
-    request_id += 1
-    return jsonify(req), 201
+
+def match_new_request(req, limit, radius_km):
+    """
+    Matched donors for a newly created (and tracked) request.
+
+    Located requests get the nearest compatible donors first (optionally
+    within radius_km); others get the cached compatibility ranking.
+    """
+    coordinates = get_coordinates(req)
+    if coordinates is None:
+        return match_cache.get(req["id"], limit)
+    return donor_index.match_nearby(req, *coordinates, radius_km=radius_km, limit=limit)
+
+
+@app.route("/api/requests", methods=["POST"])
+def add_request():
+    limit, error = get_limit_arg()
+    if error:
+        return error
+    radius_km, error = get_radius_arg()
+    if error:
+        return error
+
+    req, error = build_blood_request(request.json)
+    if error:
+        return error
+    req.id = blood_requests.allocate_id()
+
+    # Find matching donors immediately (only compatible available buckets are visited)
+    with matching_lock:
+        match_cache.track(req["id"], req)
+        matched_donors = match_new_request(req, limit, radius_km)
+
+    blood_requests.insert(req)
+    return jsonify({
+        **req.to_dict(),
+        "matchedDonors": matched_donors,
+        "matchedDonorsCount": len(matched_donors)
+    }), 201
+
+
+@app.route("/api/requests/batch", methods=["POST"])
+def add_requests_batch():
+    """Create many blood requests at once (e.g. during mass-casualty events).
+
+    Body: {"requests": [...]} with the same fields as POST /api/requests.
+    All requests are validated before any is stored. The batch is matched in
+    one vectorized match_many() pass over the available donors it can use,
+    with the distances of located requests computed in the same pass.
+    Optional ?limit= caps matched donors per request, and ?radius= bounds the
+    distance for requests with a location.
+    """
+    limit, error = get_limit_arg()
+    if error:
+        return error
+    radius_km, error = get_radius_arg()
+    if error:
+        return error
+
+    data = request.json
+    items = data.get("requests") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "requests must be a non-empty list"}), 400
+
+    new_requests = []
+    for position, item in enumerate(items):
+        req, error = build_blood_request(item)
+        if error:
+            response, status = error
+            return jsonify({**response.get_json(), "index": position}), status
+        new_requests.append(req)
+
+    for req in new_requests:
+        req.id = blood_requests.allocate_id()
+    with matching_lock:
+        donors_list = donor_index.compatible_donors(*{req["bloodGroup"] for req in new_requests})
+        all_matches = match_many(new_requests, donors_list, limit, radius_km)
+        for req, matched_donors in zip(new_requests, all_matches):
+            # Unlocated results are the compatibility ranking the cache keeps
+            if get_coordinates(req) is None:
+                match_cache.track(req["id"], req, matched_donors, limit)
+            else:
+                match_cache.track(req["id"], req)
+
+    created = []
+    for req, matched_donors in zip(new_requests, all_matches):
+        blood_requests.insert(req)
+        created.append({
+            **req.to_dict(),
+            "matchedDonors": matched_donors,
+            "matchedDonorsCount": len(matched_donors)
+        })
+
+    return jsonify(created), 201
 
 
 
 @app.route("/api/requests/<int:id>", methods=["PATCH"])
 def update_request(id):
-    for req in blood_requests:
-        if req["id"] == id:
-            req["status"] = request.json.get("status", req["status"])
-            return jsonify(req)
+    req = blood_requests.get(id)
+    if not req:
+        return jsonify({"error": "Request not found"}), 404
+
+    with matching_lock:
+        req.status = request.json.get("status", req.status)
+        blood_requests.reindex(id)
+        if req.status == "OPEN":
+            if req["id"] not in match_cache:
+                match_cache.track(req["id"], req)
+        else:
+            match_cache.discard(req["id"])
+    return jsonify(req)
+
+
+# -------- FULFILLMENT --------
+@app.route("/api/fulfillment/plan", methods=["POST"])
+def plan_request_fulfillment():
+    """Allocate stored inventory to open blood requests across hospitals.
+
+    Body (optional): {"requestIds": [...], "hospitalId": 1} restricts the plan
+    to some requests and to one hospital's stock; by default every OPEN
+    request is planned against all usable stock. Critical requests are served
+    first, universal and rare groups are kept for the requests that need
+    them, and soonest-expiring batches are used first.
+
+    The plan is a dry run unless ?apply=true: then the batches are drawn down
+    and fully covered requests become FULFILLED. With ?partial=false a
+    request gets all its units or none.
+    """
+    flags = {}
+    for name, default in (("apply", False), ("partial", True)):
+        try:
+            flags[name] = parse_bool(request.args[name]) if request.args.get(name) else default
+        except ValueError:
+            return jsonify({"error": f"{name} must be true or false"}), 400
+
+    data = request.get_json(silent=True) or {}
+    request_ids = data.get("requestIds")
+    if request_ids is not None and not isinstance(request_ids, list):
+        return jsonify({"error": "requestIds must be a list"}), 400
+    hospital_id = data.get("hospitalId")
+
+    # Request statuses only change under matching_lock, so the requests
+    # planned stay open until the plan is applied
+    with inventory_lock, matching_lock:
+        if request_ids is None:
+            open_requests = blood_requests.query({"status": "OPEN"})[0]
+        else:
+            open_requests = []
+            for rid in request_ids:
+                req = blood_requests.get(rid)
+                if not req:
+                    return jsonify({"error": f"Request {rid} not found"}), 404
+                if req.status != "OPEN":
+                    return jsonify({"error": f"Request {rid} is not open"}), 400
+                open_requests.append(req)
+
+        batches = [
+            item for item in inventory
+            if hospital_id is None or item.hospital_id == hospital_id
+        ]
+        # Earlier partial plans already covered some units of a request
+        plans = plan_fulfillment([
+            {"bloodGroup": req["bloodGroup"], "units": req.units - req.allocated_units, "urgency": req.urgency}
+            for req in open_requests
+        ], batches, allow_partial=flags["partial"])
+
+        results = []
+        now = datetime.utcnow()
+        for req, (allocated, allocations) in zip(open_requests, plans):
+            results.append({
+                "requestId": req.id,
+                "bloodGroup": req["bloodGroup"],
+                "urgency": req.urgency,
+                "units": req.units,
+                "previouslyAllocatedUnits": req.allocated_units,
+                "allocatedUnits": allocated,
+                "shortfall": req.units - req.allocated_units - allocated,
+                "batches": [
+                    {
+                        "inventoryId": item.id,
+                        "hospitalId": item.hospital_id,
+                        "hospitalName": item.hospital_name,
+                        "bloodGroup": item["bloodGroup"],
+                        "units": take,
+                        "expiry": item["expiry"]
+                    }
+                    for item, take in allocations
+                ]
+            })
+            if not flags["apply"] or not allocated:
+                continue
+
+            for item, take in allocations:
+                item.units -= take
+                item.updated_at = now
+                if item.units:
+                    inventory.reindex(item.id)
+                    inventory_totals.update(item)
+                else:
+                    inventory.delete(item.id)
+                    inventory_totals.remove(item)
+                    expiry_index.remove(item)
+            # Partially covered requests stay open for the units still missing
+            req.allocated_units += allocated
+            if req.allocated_units >= req.units:
+                req.status = "FULFILLED"
+                match_cache.discard(req.id)
+            blood_requests.reindex(req.id)
 
-    return jsonify({"error": "Request not found"}), 404
+    return jsonify({
+        "applied": flags["apply"],
+        "requests": results,
+        "allocatedUnits": sum(result["allocatedUnits"] for result in results),
+        "shortfall": sum(result["shortfall"] for result in results)
+    })
 
 
 # -------- STATS --------
+def stats_breakdown(field, keys=()):
+    """Donor and open request counts per value of a field, from the live store counters."""
+    breakdown = {}
+
+    def counts_for(value):
+        return breakdown.setdefault(value, {"donors": 0, "availableDonors": 0, "activeRequests": 0})
+
+    for key in keys:
+        counts_for(key)
+    for (value, available), count in donors.tally(field, "available").items():
+        if value:
+            counts = counts_for(value)
+            counts["donors"] += count
+            if available:
+                counts["availableDonors"] += count
+    for (status, value), count in blood_requests.tally("status", field).items():
+        if value and status == "OPEN":
+            counts_for(value)["activeRequests"] += count
+    return breakdown
+
+
 @app.route("/api/stats")
 def stats():
+    """Dashboard totals, read from counters kept up to date on every write."""
     return jsonify({
         "totalDonors": len(donors),
-        "availableDonors": len([d for d in donors if d["available"]]),
-        "activeRequests": len([r for r in blood_requests if r["status"] == "OPEN"])
+        "availableDonors": donors.count("available", True),
+        "activeRequests": blood_requests.count("status", "OPEN"),
+        "byBloodGroup": stats_breakdown("bloodGroup", get_all_valid_blood_groups()),
+        "byCity": stats_breakdown("city")
+    })
+
+
+# -------- METRICS --------
+@app.route("/api/metrics")
+def metrics():
+    with inventory_lock:
+        inventory_expiry = dict(expiry_stats)
+    return jsonify({
+        "passwordHashing": password_hasher.stats(),
+        "inventoryExpiry": inventory_expiry,
+        "storage": storage.stats() if storage is not None else None
     })
 
 
@@ -10,18 +10,28 @@ from flask_jwt_extended import (
     jwt_required, get_jwt, get_jwt_identity
 )
 from werkzeug.security import generate_password_hash, check_password_hash
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from decimal import Decimal
 import boto3
+import itertools
+import os
+import queue
 import uuid
-import threading
+from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 
+from marshalling import from_attribute_values, to_attribute_value, to_attribute_values
+from notifications import NotificationDispatcher, URGENT, NORMAL, LOW
+
 # AI Engine
 from ai_engine import (
+    COMPATIBILITY_MATRIX,
     get_compatible_blood_groups,
     get_all_valid_blood_groups,
     match_donors_to_request,
+    match_top_donors,
+    match_many,
     get_donation_stats
 )
 
@@ -31,16 +41,57 @@ from ai_engine import (
 
 AWS_REGION = "us-east-1"
 SNS_TOPIC_ARN = "arn:aws:sns:us-east-1:890742572638:aws_capstone_topic:05efcb7f-c78e-444d-ad83-d472769c8c73"
-
-dynamodb = boto3.resource("dynamodb", region_name=AWS_REGION)
+# Set to point at a local DynamoDB stand-in (e.g. http://localhost:8000)
+DYNAMODB_ENDPOINT_URL = os.environ.get("DYNAMODB_ENDPOINT_URL") or None
+
+dynamodb = boto3.resource("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT_URL)
+# Plain low-level client for the hot reads and writes, which use typed
+# attribute values (see marshalling.py) instead of the resource API's
+# Decimals. Not dynamodb.meta.client: boto3 registers its own marshalling
+# on the resource's client, so values would be converted twice.
+ddb_client = boto3.client("dynamodb", region_name=AWS_REGION, endpoint_url=DYNAMODB_ENDPOINT_URL)
 sns = boto3.client("sns", region_name=AWS_REGION)
 
+# Bounded queue and fixed worker pool for SNS publishes
+notifier = NotificationDispatcher(
+    sns, SNS_TOPIC_ARN,
+    workers=int(os.environ.get("SNS_WORKERS", 2)),
+    max_queue=int(os.environ.get("SNS_MAX_QUEUE", 1000))
+)
+
 users_table = dynamodb.Table("BloodBank_Users")
 donors_table = dynamodb.Table("BloodBank_Donors")
 hospitals_table = dynamodb.Table("BloodBank_Hospitals")
 inventory_table = dynamodb.Table("BloodBank_Inventory")
 requests_table = dynamodb.Table("BloodBank_Requests")
 donation_history_table = dynamodb.Table("BloodBank_DonationHistory")
+stats_table = dynamodb.Table("BloodBank_Stats")
+
+# Key of the single item holding the dashboard counters
+STATS_KEY = {"id": "counters"}
+# Set on the counters item by rebuild_counters(); an item without it was
+# created by ADDs alone and does not count the records written before
+COUNTERS_BUILT = "builtAt"
+# Counter ADDed by every bump_counters(), so a rebuild can tell whether the
+# item changed while it was scanning
+COUNTERS_VERSION = "version"
+# Scans tried by rebuild_counters() before giving up under constant writes
+COUNTERS_REBUILD_ATTEMPTS = 5
+
+# Sparse donors GSI: only available donors carry MATCH_KEY (their blood
+# group), so a Query per compatible group reads exactly the matchable donors
+MATCH_INDEX = "availableBloodGroup-index"
+MATCH_KEY = "availableBloodGroup"
+
+# Requests GSI (status, id) serving the ?status= listing with a Query
+STATUS_INDEX = "status-index"
+
+# Runs the per-blood-group match queries in parallel
+query_pool = ThreadPoolExecutor(max_workers=len(COMPATIBILITY_MATRIX), thread_name_prefix="ddb-query")
+
+# Full-table reads are split into this many parallel scan segments
+SCAN_SEGMENTS = int(os.environ.get("DYNAMODB_SCAN_SEGMENTS", 4))
+scan_pool = ThreadPoolExecutor(max_workers=SCAN_SEGMENTS, thread_name_prefix="ddb-scan")
 
 # ============================================================================
 # APP SETUP
@@ -57,36 +108,380 @@ CORS(app)
 # ============================================================================
 
 def to_ddb(obj):
-    if isinstance(obj, float):
-        return Decimal(str(obj))
-    if isinstance(obj, dict):
+    obj_type = type(obj)
+    if obj_type is float:
+        return Decimal(repr(obj))
+    if obj_type is dict:
         return {k: to_ddb(v) for k, v in obj.items()}
-    if isinstance(obj, list):
+    if obj_type is list:
         return [to_ddb(v) for v in obj]
     return obj
 
 def from_ddb(obj):
-    if isinstance(obj, Decimal):
-        return int(obj) if obj % 1 == 0 else float(obj)
-    if isinstance(obj, dict):
+    obj_type = type(obj)
+    if obj_type is Decimal:
+        integer = int(obj)
+        return integer if integer == obj else float(obj)
+    if obj_type is dict:
         return {k: from_ddb(v) for k, v in obj.items()}
-    if isinstance(obj, list):
+    if obj_type is list:
         return [from_ddb(v) for v in obj]
     return obj
 
-def sns_async(subject, message):
-    def task():
-        try:
-            sns.publish(TopicArn=SNS_TOPIC_ARN, Subject=subject, Message=message)
-        except Exception as e:
-            print("SNS ERROR:", e)
-    threading.Thread(target=task, daemon=True).start()
+def is_condition_failure(error):
+    return error.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException"
+
+def sns_async(subject, message, priority=NORMAL):
+    """Queue an SNS notification; LOW ones are dropped first under load."""
+    notifier.notify(subject, message, priority)
 
 def json_body():
     if not request.is_json:
         return None
     return request.get_json()
 
+def get_limit_arg():
+    """Parse the optional ?limit= as a (limit, error_response) pair."""
+    raw_limit = request.args.get("limit")
+    if raw_limit is None or raw_limit == "":
+        return None, None
+    try:
+        limit = int(raw_limit)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return None, (jsonify({"error": "limit must be a positive integer"}), 400)
+    return limit, None
+
+def parse_bool(value):
+    lowered = value.lower()
+    if lowered in ("true", "1", "yes"):
+        return True
+    if lowered in ("false", "0", "no"):
+        return False
+    raise ValueError(value)
+
+def donor_item(donor):
+    """DynamoDB item for a donor, with MATCH_KEY set only while it is available."""
+    item = {name: value for name, value in donor.items() if name != MATCH_KEY}
+    if donor.get("available") and donor.get("bloodGroup"):
+        item[MATCH_KEY] = donor["bloodGroup"]
+    return to_ddb(item)
+
+def query_available_donors(blood_group):
+    """Available donors of one blood group (low-level items), from the sparse match index."""
+    kwargs = {
+        "TableName": donors_table.name,
+        "IndexName": MATCH_INDEX,
+        "KeyConditionExpression": "#match = :bloodGroup",
+        "ExpressionAttributeNames": {"#match": MATCH_KEY},
+        "ExpressionAttributeValues": {":bloodGroup": {"S": blood_group}}
+    }
+    donors = []
+    while True:
+        res = ddb_client.query(**kwargs)
+        donors.extend(res.get("Items", []))
+        if not res.get("LastEvaluatedKey"):
+            break
+        kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+    return donors
+
+def compatible_donors(*recipient_groups):
+    """
+    Available donors able to give to any of the recipient blood groups.
+
+    One Query per compatible donor group, run in parallel and merged, instead
+    of a full table scan.
+    """
+    donor_groups = sorted({
+        donor_group
+        for recipient_group in recipient_groups
+        for donor_group in COMPATIBILITY_MATRIX.get(recipient_group, ())
+    })
+    donors = []
+    for items in query_pool.map(query_available_donors, donor_groups):
+        for item in items:
+            item.pop(MATCH_KEY, None)
+            donors.append(from_attribute_values(item))
+    return donors
+
+def donor_counters(donor, sign=1):
+    """Counter deltas for adding (sign=1) or removing (sign=-1) a donor."""
+    available = sign if donor.get("available") else 0
+    deltas = {"totalDonors": sign, "availableDonors": available}
+    for field in ("bloodGroup", "city"):
+        if donor.get(field):
+            deltas[f"donors:{field}:{donor[field]}"] = sign
+            deltas[f"availableDonors:{field}:{donor[field]}"] = available
+    return deltas
+
+def request_counters(req, sign=1):
+    """Counter deltas for opening (sign=1) or closing (sign=-1) a request."""
+    deltas = {"activeRequests": sign}
+    for field in ("bloodGroup", "city"):
+        if req.get(field):
+            deltas[f"activeRequests:{field}:{req[field]}"] = sign
+    return deltas
+
+def bump_counters(*deltas):
+    """Atomically add counter deltas to the stats item (one UpdateItem ADD)."""
+    totals = {}
+    for delta in deltas:
+        for name, value in delta.items():
+            totals[name] = totals.get(name, 0) + value
+    totals = {name: value for name, value in totals.items() if value}
+    if not totals:
+        return
+    totals[COUNTERS_VERSION] = 1
+    names = {f"#c{i}": name for i, name in enumerate(totals)}
+    values = {f":c{i}": value for i, value in enumerate(totals.values())}
+    stats_table.update_item(
+        Key=STATS_KEY,
+        UpdateExpression="ADD " + ", ".join(f"#c{i} :c{i}" for i in range(len(totals))),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values
+    )
+
+def rebuild_counters():
+    """
+    Recount the stats item from full table scans (first run or repair).
+
+    The recount only replaces the item if no bump_counters() changed it
+    during the scans (its version is unchanged); otherwise it scans again.
+    Run it from create_dynamodb_tables.py, not from the request path.
+    """
+    for _ in range(COUNTERS_REBUILD_ATTEMPTS):
+        current = stats_table.get_item(Key=STATS_KEY, ConsistentRead=True).get("Item")
+        version = current.get(COUNTERS_VERSION, 0) if current else None
+        counters = {
+            "id": STATS_KEY["id"],
+            COUNTERS_BUILT: datetime.utcnow().isoformat(),
+            # Also moved on, so two concurrent rebuilds cannot both win
+            COUNTERS_VERSION: (version or 0) + 1,
+            "totalDonors": 0,
+            "availableDonors": 0,
+            "activeRequests": 0
+        }
+        # Counted as the scan segments stream in, reading only the counted fields
+        donors = parallel_scan(donors_table, projection=("available", "bloodGroup", "city"))
+        open_requests = parallel_scan(requests_table, {"status": "OPEN"}, projection=("bloodGroup", "city"))
+        deltas = itertools.chain(
+            (donor_counters(from_attribute_values(d)) for d in donors),
+            (request_counters(from_attribute_values(r)) for r in open_requests)
+        )
+        for delta in deltas:
+            for name, value in delta.items():
+                counters[name] = counters.get(name, 0) + value
+
+        if current is None:
+            condition = {"ConditionExpression": "attribute_not_exists(id)"}
+        elif COUNTERS_VERSION in current:
+            condition = {
+                "ConditionExpression": "#v = :v",
+                "ExpressionAttributeNames": {"#v": COUNTERS_VERSION},
+                "ExpressionAttributeValues": {":v": version}
+            }
+        else:
+            condition = {
+                "ConditionExpression": "attribute_not_exists(#v)",
+                "ExpressionAttributeNames": {"#v": COUNTERS_VERSION}
+            }
+        try:
+            stats_table.put_item(Item=counters, **condition)
+            return counters
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+    raise RuntimeError("Stats counters kept changing during the rebuild; try again")
+
+def ensure_counters(force=False):
+    """
+    Seed the stats item from the tables unless a rebuild already built it.
+
+    Args:
+        force (bool): Recount even if the item was already built
+
+    Returns:
+        bool: True if the counters were rebuilt
+    """
+    counters = stats_table.get_item(Key=STATS_KEY, ConsistentRead=True).get("Item")
+    if force or not counters or COUNTERS_BUILT not in counters:
+        rebuild_counters()
+        return True
+    return False
+
+def scan_arguments(table, filters=None, projection=None):
+    """Low-level Scan arguments for equality filters and an optional attribute projection."""
+    kwargs = {"TableName": table.name}
+    names = {}
+    if filters:
+        clauses = []
+        values = {}
+        for position, (field, value) in enumerate(filters.items()):
+            names[f"#f{position}"] = field
+            values[f":f{position}"] = to_attribute_value(value)
+            clauses.append(f"#f{position} = :f{position}")
+        kwargs["FilterExpression"] = " AND ".join(clauses)
+        kwargs["ExpressionAttributeValues"] = values
+    if projection:
+        names.update({f"#p{position}": field for position, field in enumerate(projection)})
+        kwargs["ProjectionExpression"] = ", ".join(f"#p{position}" for position in range(len(projection)))
+    if names:
+        kwargs["ExpressionAttributeNames"] = names
+    return kwargs
+
+def parallel_scan(table, filters=None, segments=None, projection=None):
+    """
+    Yield every item of a table matching equality filters, as low-level items.
+
+    The table is read as `segments` parallel scan segments on scan_pool, each
+    followed to its last page, and items are yielded page by page as the
+    segments return them (in no particular order). With a projection only
+    those attributes are read.
+    """
+    segments = segments or SCAN_SEGMENTS
+    pages = queue.Queue()
+
+    def scan_segment(segment):
+        kwargs = {**scan_arguments(table, filters, projection), "Segment": segment, "TotalSegments": segments}
+        try:
+            while True:
+                res = ddb_client.scan(**kwargs)
+                pages.put(res.get("Items", []))
+                if not res.get("LastEvaluatedKey"):
+                    break
+                kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+        except Exception as e:
+            pages.put(e)
+        finally:
+            pages.put(None)
+
+    for segment in range(segments):
+        scan_pool.submit(scan_segment, segment)
+
+    running = segments
+    while running:
+        page = pages.get()
+        if page is None:
+            running -= 1
+        elif isinstance(page, Exception):
+            raise page
+        else:
+            yield from page
+
+def read_pages(operation, kwargs, limit=None, start_key=None):
+    """
+    Run a low-level Scan or Query page after page.
+
+    With a limit, stops once `limit` matching items are collected
+    (DynamoDB's Limit counts evaluated items, so short pages are continued
+    until enough items match). Returns (low-level items, LastEvaluatedKey).
+    """
+    items = []
+    while True:
+        if start_key:
+            kwargs["ExclusiveStartKey"] = start_key
+        if limit is not None:
+            kwargs["Limit"] = limit - len(items)
+        res = operation(**kwargs)
+        items.extend(res.get("Items", []))
+        start_key = res.get("LastEvaluatedKey")
+        if not start_key or (limit is not None and len(items) >= limit):
+            return items, start_key
+
+def scan_page(table, filters=None, limit=None, after=None):
+    """
+    Scan a table with equality filters, following pagination.
+
+    With a limit, stops once `limit` matching items are collected and returns
+    the id to resume from. Without a limit or a cursor the whole table is
+    read with parallel_scan().
+
+    Returns (low-level items, next_cursor).
+    """
+    if limit is None and after is None:
+        return list(parallel_scan(table, filters)), None
+
+    start_key = {"id": to_attribute_value(after)} if after else None
+    items, start_key = read_pages(ddb_client.scan, scan_arguments(table, filters), limit, start_key)
+    return items, (from_attribute_values(start_key)["id"] if start_key else None)
+
+def index_page(table, index, filters=None, limit=None, after=None):
+    """
+    Read a page of a GSI keyed (hash attribute, id), following pagination.
+
+    `index` is (index name, hash attribute, hash value, source attribute):
+    with a hash value the index is Queried for it, without one the whole
+    (sparse) index is scanned. The source attribute holds the value the hash
+    attribute mirrors, so the id cursor can be turned back into an index
+    position. Remaining equality filters are applied as a FilterExpression.
+
+    Returns (low-level items, next_cursor) like scan_page().
+    """
+    index_name, hash_attribute, hash_value, source = index
+    kwargs = {**scan_arguments(table, filters), "IndexName": index_name}
+    operation = ddb_client.scan
+    if hash_value is not None:
+        kwargs.setdefault("ExpressionAttributeNames", {})["#key"] = hash_attribute
+        kwargs.setdefault("ExpressionAttributeValues", {})[":key"] = to_attribute_value(hash_value)
+        kwargs["KeyConditionExpression"] = "#key = :key"
+        operation = ddb_client.query
+
+    start_key = None
+    if after:
+        start_key = {"id": to_attribute_value(after)}
+        if hash_value is None:
+            # The position is (hash value, id); read the cursor item's value
+            cursor_item = ddb_client.get_item(
+                TableName=table.name, Key=start_key,
+                ProjectionExpression="#source", ExpressionAttributeNames={"#source": source}
+            ).get("Item")
+            if not cursor_item or source not in cursor_item:
+                return [], None
+            start_key[hash_attribute] = cursor_item[source]
+        else:
+            start_key[hash_attribute] = to_attribute_value(hash_value)
+
+    items, start_key = read_pages(operation, kwargs, limit, start_key)
+    return items, (from_attribute_values(start_key)["id"] if start_key else None)
+
+def list_page(table, filter_args, transform=None, index_for=None):
+    """
+    Serve a list endpoint with ?limit=&after= pagination and equality filters.
+
+    Without limit/after the response is the plain array, as before;
+    otherwise it is {"items": [...], "nextCursor": id}. `index_for(filters)`
+    may return (index, remaining filters) to read a GSI (see index_page())
+    instead of scanning the table.
+    """
+    limit, error = get_limit_arg()
+    if error:
+        return error
+    after = request.args.get("after") or None
+
+    filters = {}
+    for name, convert in filter_args.items():
+        raw_value = request.args.get(name)
+        if raw_value is None or raw_value == "":
+            continue
+        try:
+            filters[name] = convert(raw_value)
+        except ValueError:
+            return jsonify({"error": f"Invalid {name} filter"}), 400
+
+    index = index_for(filters) if index_for else None
+    if index:
+        items, next_cursor = index_page(table, index[0], index[1], limit, after)
+    else:
+        items, next_cursor = scan_page(table, filters, limit, after)
+    items = [from_attribute_values(item) for item in items]
+    if transform:
+        items = [transform(item) for item in items]
+
+    if limit is None and after is None:
+        return jsonify(items)
+    return jsonify({"items": items, "nextCursor": next_cursor})
+
 # ============================================================================
 # AUTH
 # ============================================================================
@@ -105,9 +500,6 @@ def signup():
     if not all([email, password, name]):
         return jsonify({"error": "Missing fields"}), 400
 
-    if users_table.get_item(Key={"email": email}).get("Item"):
-        return jsonify({"error": "User exists"}), 409
-
     user_id = str(uuid.uuid4())
 
     user = to_ddb({
@@ -122,10 +514,17 @@ def signup():
         "createdAt": datetime.utcnow().isoformat()
     })
 
-    users_table.put_item(Item=user)
+    # The existence check is part of the write, so two signups for the same
+    # email cannot both succeed
+    try:
+        users_table.put_item(Item=user, ConditionExpression=Attr("email").not_exists())
+    except ClientError as e:
+        if not is_condition_failure(e):
+            raise
+        return jsonify({"error": "User exists"}), 409
 
     if role == "donor":
-        donors_table.put_item(Item=to_ddb({
+        donor = {
             "id": str(uuid.uuid4()),
             "userId": user_id,
             "email": email,
@@ -134,8 +533,11 @@ def signup():
             "available": False,
             "verified": False,
             "donationCount": 0,
+            "version": 0,
             "createdAt": datetime.utcnow().isoformat()
-        }))
+        }
+        donors_table.put_item(Item=donor_item(donor))
+        bump_counters(donor_counters(donor))
 
     token = create_access_token(identity=user_id, additional_claims={"role": role})
 
@@ -161,7 +563,7 @@ def login():
     user = from_ddb(user)
     token = create_access_token(identity=user["id"], additional_claims={"role": user["role"]})
 
-    sns_async("Login", f"{user['name']} logged in")
+    sns_async("Login", f"{user['name']} logged in", LOW)
 
     return jsonify({"token": token, "role": user["role"]})
 
@@ -171,26 +573,96 @@ def login():
 
 @app.route("/api/donors", methods=["GET"])
 def get_donors():
-    donors = donors_table.scan().get("Items", [])
-    donors = from_ddb(donors)
-
-    for d in donors:
+    def with_info(d):
+        d.pop(MATCH_KEY, None)
         if d.get("bloodGroup"):
             d["compatibilityInfo"] = get_donation_stats(d["bloodGroup"])
-
-    return jsonify(donors)
+        return d
+
+    def available_index(filters):
+        # Only available donors are in the sparse match index
+        if filters.get("available") is not True:
+            return None
+        remaining = {name: value for name, value in filters.items() if name not in ("available", "bloodGroup")}
+        return (MATCH_INDEX, MATCH_KEY, filters.get("bloodGroup"), "bloodGroup"), remaining
+
+    return list_page(
+        donors_table, {"bloodGroup": str, "city": str, "available": parse_bool}, with_info, available_index
+    )
+
+def availability_update(available, with_match_key):
+    """UpdateItem arguments setting a donor's availability and bumping its version."""
+    if not available:
+        expression = "SET #available = :available REMOVE #match ADD #version :one"
+    elif with_match_key:
+        expression = "SET #available = :available, #match = #bloodGroup ADD #version :one"
+    else:
+        expression = "SET #available = :available ADD #version :one"
+    names = {"#available": "available", "#version": "version"}
+    if not available or with_match_key:
+        names["#match"] = MATCH_KEY
+    if available and with_match_key:
+        names["#bloodGroup"] = "bloodGroup"
+    return {
+        "UpdateExpression": expression,
+        "ExpressionAttributeNames": names,
+        "ExpressionAttributeValues": {":available": available, ":one": 1}
+    }
+
+# Conditional toggles retried before giving up on a heavily contended donor
+TOGGLE_ATTEMPTS = 5
 
 @app.route("/api/donors/<id>/toggle", methods=["PATCH"])
 def toggle_donor(id):
-    res = donors_table.get_item(Key={"id": id})
-    if "Item" not in res:
-        return jsonify({"error": "Not found"}), 404
-
-    donor = from_ddb(res["Item"])
-    donor["available"] = not donor.get("available", False)
-
-    donors_table.put_item(Item=to_ddb(donor))
-    return jsonify(donor)
+    """
+    Flip a donor's availability without reading it first.
+
+    The first UpdateItem assumes the donor is unavailable (with an indexable
+    blood group). If that condition fails, DynamoDB returns the current item
+    and the matching update is retried, conditioned on the item's version,
+    so concurrent toggles never overwrite each other.
+    """
+    update = availability_update(True, True)
+    condition = (
+        Attr("id").exists()
+        & (Attr("available").not_exists() | Attr("available").eq(False))
+        & Attr("bloodGroup").attribute_type("S")
+        & Attr("bloodGroup").size().gt(0)
+    )
+    for _ in range(TOGGLE_ATTEMPTS):
+        try:
+            res = donors_table.update_item(
+                Key={"id": id},
+                ConditionExpression=condition,
+                ReturnValues="ALL_NEW",
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+                **update
+            )
+        except ClientError as e:
+            if not is_condition_failure(e):
+                raise
+            current = e.response.get("Item")
+            if not current:
+                return jsonify({"error": "Not found"}), 404
+            current = from_attribute_values(current)
+            blood_group = current.get("bloodGroup")
+            update = availability_update(
+                not current.get("available", False),
+                isinstance(blood_group, str) and blood_group != ""
+            )
+            if "version" in current:
+                condition = Attr("version").eq(current["version"])
+            else:
+                condition = Attr("id").exists() & Attr("version").not_exists()
+            continue
+
+        donor = from_ddb(res["Attributes"])
+        donor.pop(MATCH_KEY, None)
+        previous = {**donor, "available": not donor["available"]}
+        bump_counters(donor_counters(previous, -1), donor_counters(donor))
+        return jsonify(donor)
+
+    return jsonify({"error": "Donor is being updated, please retry"}), 409
 
 # ============================================================================
 # HOSPITALS
@@ -214,7 +686,7 @@ def add_hospital():
 
 @app.route("/api/hospitals", methods=["GET"])
 def hospitals():
-    return jsonify(from_ddb(hospitals_table.scan().get("Items", [])))
+    return list_page(hospitals_table, {"city": str, "verified": parse_bool})
 
 # ============================================================================
 # REQUESTS
@@ -227,29 +699,96 @@ def create_request():
 
     if blood_group not in get_all_valid_blood_groups():
         return jsonify({"error": "Invalid blood group"}), 400
+    limit, error = get_limit_arg()
+    if error:
+        return error
 
-    donors = from_ddb(donors_table.scan().get("Items", []))
-    matched = match_donors_to_request(data, donors)
+    donors = compatible_donors(blood_group)
+    if limit is None:
+        matched = match_donors_to_request(data, donors)
+    else:
+        matched = match_top_donors(data, donors, limit)
 
-    req = to_ddb({
+    req = {
         "id": str(uuid.uuid4()),
         "hospital": data["hospital"],
+        "hospitalId": data.get("hospitalId", ""),
+        "city": data.get("city", ""),
         "bloodGroup": blood_group,
         "units": data["units"],
         "urgency": data["urgency"],
         "status": "OPEN",
         "matchedDonors": matched,
         "createdAt": datetime.utcnow().isoformat()
-    })
+    }
+
+    # Written as typed attribute values, and answered from the same dict,
+    # instead of converting matchedDonors to Decimals and back
+    ddb_client.put_item(TableName=requests_table.name, Item=to_attribute_values(req))
+    bump_counters(request_counters(req))
 
-    requests_table.put_item(Item=req)
+    sns_async("URGENT BLOOD REQUEST", f"{blood_group} | {data['urgency']}", URGENT)
+    return jsonify(req), 201
 
-    sns_async("URGENT BLOOD REQUEST", f"{blood_group} | {data['urgency']}")
-    return jsonify(from_ddb(req)), 201
+@app.route("/api/requests/batch", methods=["POST"])
+def create_requests_batch():
+    data = json_body()
+    items = data.get("requests") if data else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "requests must be a non-empty list"}), 400
+
+    valid_groups = get_all_valid_blood_groups()
+    for position, item in enumerate(items):
+        if item.get("bloodGroup") not in valid_groups:
+            return jsonify({"error": "Invalid blood group", "index": position}), 400
+    limit, error = get_limit_arg()
+    if error:
+        return error
+
+    # One index query per donor group any request can use, and one
+    # vectorized scoring pass for the whole batch
+    donors = compatible_donors(*{item["bloodGroup"] for item in items})
+    all_matches = match_many(items, donors, limit=limit)
+
+    created = []
+    with requests_table.batch_writer() as batch:
+        for item, matched in zip(items, all_matches):
+            req = {
+                "id": str(uuid.uuid4()),
+                "hospital": item["hospital"],
+                "hospitalId": item.get("hospitalId", ""),
+                "city": item.get("city", ""),
+                "bloodGroup": item["bloodGroup"],
+                "units": item["units"],
+                "urgency": item["urgency"],
+                "status": "OPEN",
+                "matchedDonors": matched,
+                "createdAt": datetime.utcnow().isoformat()
+            }
+            batch.put_item(Item=to_ddb(req))
+            created.append(req)
+    bump_counters(*(request_counters(req) for req in created))
+
+    sns_async("URGENT BLOOD REQUEST", f"{len(created)} requests | " + ", ".join(
+        f"{r['bloodGroup']} {r['urgency']}" for r in created
+    ), URGENT)
+    return jsonify(created), 201
 
 @app.route("/api/requests", methods=["GET"])
 def get_requests():
-    return jsonify(from_ddb(requests_table.scan().get("Items", [])))
+    def status_index(filters):
+        if "status" not in filters:
+            return None
+        remaining = {name: value for name, value in filters.items() if name != "status"}
+        return (STATUS_INDEX, "status", filters["status"], "status"), remaining
+
+    return list_page(requests_table, {
+        "status": str,
+        "urgency": str,
+        "bloodGroup": str,
+        "hospitalId": str,
+        "city": str
+    }, index_for=status_index)
 
 # ============================================================================
 # STATS
@@ -257,15 +796,35 @@ def get_requests():
 
 @app.route("/api/stats")
 def stats():
-    donors = from_ddb(donors_table.scan().get("Items", []))
-    requests = from_ddb(requests_table.scan().get("Items", []))
+    # One GetItem on the counters item, seeded by create_dynamodb_tables.py
+    counters = from_ddb(stats_table.get_item(Key=STATS_KEY).get("Item")) or {}
+
+    breakdowns = {"bloodGroup": {}, "city": {}}
+    for bg in get_all_valid_blood_groups():
+        breakdowns["bloodGroup"][bg] = {"donors": 0, "availableDonors": 0, "activeRequests": 0}
+    for name, value in counters.items():
+        counter, _, rest = name.partition(":")
+        field, _, key = rest.partition(":")
+        if field in breakdowns and key:
+            counts = breakdowns[field].setdefault(key, {"donors": 0, "availableDonors": 0, "activeRequests": 0})
+            counts[counter] = value
 
     return jsonify({
-        "totalDonors": len(donors),
-        "availableDonors": len([d for d in donors if d.get("available")]),
-        "activeRequests": len([r for r in requests if r.get("status") == "OPEN"])
+        "totalDonors": counters.get("totalDonors", 0),
+        "availableDonors": counters.get("availableDonors", 0),
+        "activeRequests": counters.get("activeRequests", 0),
+        "byBloodGroup": breakdowns["bloodGroup"],
+        "byCity": breakdowns["city"]
     })
 
+# ============================================================================
+# METRICS
+# ============================================================================
+
+@app.route("/api/metrics")
+def metrics():
+    return jsonify({"notifications": notifier.stats()})
+
 # ============================================================================
 # HEALTH
 # ============================================================================
@@ -0,0 +1,600 @@
+"""
+Pluggable durable storage for the Blood Bank Application.
+
+server.py serves every request from its in-memory RecordStores (users,
+donors, hospitals, inventory, blood requests) and the donation history.
+A storage backend gives that state a durable home: it loads the stores on
+startup and then receives every insert, reindex and delete through the
+stores' journal hook, plus donation history changes. The journal runs under
+the store's lock, so it only queues the encoded write: a background thread
+applies the queue in batches (group commit), and every write returns a
+ticket that wait() blocks on until it is durable. The route code is the
+same whichever backend is configured with STORAGE_BACKEND:
+
+- memory: nothing is stored (the default)
+- wal: append-only log and snapshots in DATA_DIR (see persistence.py)
+- sqlite: one SQLite database in DATA_DIR, in WAL mode, with a table per
+  store and indexed columns for the common lookups (email, bloodGroup +
+  available, status, hospitalId)
+- dynamodb: BloodBankStore_* tables created by
+  `create_dynamodb_tables.py --storage` (needs boto3); server_aws.py's
+  BloodBank_* tables use another schema and are not touched
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from records import Record
+
+
+class WriteQueue:
+    """
+    Writes applied in order by a background thread, in batches.
+
+    append() only queues a write; the thread takes everything queued so far
+    and passes it to `apply` at once, so a burst of writes shares one
+    transaction (or round of requests) and callers never wait on the
+    database unless they call wait().
+
+    Args:
+        apply (callable): Applies a list of queued writes, in order
+        name (str): Name of the writer thread
+    """
+
+    def __init__(self, apply, name):
+        self._apply = apply
+        self._name = name
+        self._condition = threading.Condition()
+        self._queue = []
+        self._sequence = 0
+        self._applied_sequence = 0
+        self._stopped = False
+        self._thread = None
+        self.batches = 0
+
+    def start(self):
+        """Start the writer thread."""
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def append(self, write):
+        """
+        Queue a write.
+
+        Returns:
+            int: Ticket of the write (see wait())
+        """
+        with self._condition:
+            self._sequence += 1
+            self._queue.append(write)
+            self._condition.notify_all()
+            return self._sequence
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._queue or self._stopped)
+                if not self._queue:
+                    return
+                batch, self._queue = self._queue, []
+                sequence = self._sequence
+            try:
+                self._apply(batch)
+            except Exception:
+                logging.getLogger(__name__).exception("Storage write failed")
+            with self._condition:
+                self._applied_sequence = sequence
+                self.batches += 1
+                self._condition.notify_all()
+
+    def wait(self, ticket, timeout=None):
+        """
+        Block until a queued write has been applied.
+
+        Args:
+            ticket (int): Ticket returned by append()
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: True if the write was applied
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._applied_sequence >= ticket, timeout)
+
+    def close(self):
+        """Apply the queued writes and stop the writer thread."""
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            with self._condition:
+                self._stopped = True
+                self._condition.notify_all()
+            thread.join()
+
+
+class Storage(ABC):
+    """
+    Base class of the durable storage backends.
+
+    Subclasses implement recover(), put(), delete(), log_history() and
+    stats(), and may override save_largest(), wait() and close();
+    install_journals() routes the store writes to put() and delete().
+    Writes return a ticket for wait(), and subclasses pass it to _track()
+    so wait_for_writes() knows the last write of each thread.
+
+    Args:
+        stores (dict): Name -> (RecordStore, record class, or None for
+            plain dict records)
+        history (dict): Donation history, key -> list of entries
+    """
+
+    def __init__(self, stores, history):
+        self.stores = stores
+        self.history = history
+        # store name -> largest primary id ever written, so id counters can
+        # resume after deleted records too
+        self._largest = {name: 0 for name in stores}
+        # Ticket of each thread's last write
+        self._local = threading.local()
+
+    @staticmethod
+    def encode(record):
+        """Stored (JSON) form of a record."""
+        return record.to_dict(derived=False) if isinstance(record, Record) else dict(record)
+
+    @staticmethod
+    def decode(data, record_class):
+        """Record rebuilt from its stored form."""
+        return record_class.from_dict(data) if record_class is not None else data
+
+    def load(self, name, rows):
+        """Replace the contents of a store with stored records."""
+        store, record_class = self.stores[name]
+        store.clear()
+        for data in rows:
+            record = self.decode(data, record_class)
+            store.insert(record)
+            self._largest[name] = max(self._largest[name], record[store.primary_key])
+
+    def install_journals(self):
+        """Send every later store write to put() and delete()."""
+        for name, (store, _) in self.stores.items():
+            store.journal = self._journal_for(name)
+
+    def _journal_for(self, name):
+        largest = self._largest
+
+        def journal(key, record):
+            if record is None:
+                self.delete(name, key)
+                return
+            if key > largest[name]:
+                largest[name] = key
+                self.save_largest(name, key)
+            self.put(name, key, self.encode(record))
+        return journal
+
+    @abstractmethod
+    def recover(self):
+        """
+        Load the stored state into the stores (or store the current seed
+        state on first use) and start journaling.
+
+        Returns:
+            dict: Store name -> largest primary id ever written
+        """
+
+    @abstractmethod
+    def put(self, name, key, data):
+        """Store a record (insert or replace)."""
+
+    @abstractmethod
+    def delete(self, name, key):
+        """Delete a stored record."""
+
+    def save_largest(self, name, key):
+        """Remember a new largest primary id of a store."""
+
+    @abstractmethod
+    def log_history(self, key):
+        """Store the changed donation history list of a key."""
+
+    @abstractmethod
+    def stats(self):
+        """Get backend metrics for /api/metrics."""
+
+    def _track(self, ticket):
+        self._local.ticket = ticket
+        return ticket
+
+    def wait(self, ticket, timeout=None):
+        """
+        Block until a write is durable.
+
+        Args:
+            ticket (int): Ticket returned by a write
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: True if the write is durable
+        """
+        return True
+
+    def wait_for_writes(self, timeout=None):
+        """
+        Block until every write made by the calling thread is durable.
+
+        Args:
+            timeout (float): Maximum seconds to wait
+
+        Returns:
+            bool: True if the writes are durable (or there were none)
+        """
+        ticket = getattr(self._local, "ticket", None)
+        if ticket is None:
+            return True
+        self._local.ticket = None
+        return self.wait(ticket, timeout)
+
+    def close(self):
+        """Flush pending writes and release the backend."""
+
+
+# Store name -> column groups indexed in SQLite (one index per group)
+SQLITE_INDEXES = {
+    "users": (("email",),),
+    "donors": (("email",), ("bloodGroup", "available")),
+    "inventory": (("hospitalId",),),
+    "blood_requests": (("status",), ("hospitalId",)),
+}
+
+
+class SQLiteStorage(Storage):
+    """
+    Stores in one SQLite database in WAL mode.
+
+    Each store is a table of (id, data JSON) plus the columns of
+    SQLITE_INDEXES, indexed, so the database can be queried by those fields
+    without reading every row. Writes are queued as cached prepared statements and a
+    WriteQueue thread runs each batch in one transaction on a single
+    connection; with synchronous=NORMAL in WAL mode commits do not wait
+    for an fsync.
+
+    Args:
+        path (str): Database file
+        stores (dict): See Storage
+        history (dict): See Storage
+    """
+
+    def __init__(self, path, stores, history):
+        super().__init__(stores, history)
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False, cached_statements=256
+        )
+        # Guards the connection
+        self._lock = threading.Lock()
+        self._queue = WriteQueue(self._apply, "sqlite-writer")
+        self.writes = 0
+
+        self._columns = {name: self._indexed_columns(name) for name in stores}
+        self._put_sql = {}
+        self._delete_sql = {}
+        for name, columns in self._columns.items():
+            names = ", ".join(["id", "data"] + [f'"{column}"' for column in columns])
+            placeholders = ", ".join("?" * (len(columns) + 2))
+            self._put_sql[name] = f'INSERT OR REPLACE INTO "{name}" ({names}) VALUES ({placeholders})'
+            self._delete_sql[name] = f'DELETE FROM "{name}" WHERE id = ?'
+
+    @staticmethod
+    def _indexed_columns(name):
+        columns = []
+        for group in SQLITE_INDEXES.get(name, ()):
+            for column in group:
+                if column not in columns:
+                    columns.append(column)
+        return columns
+
+    def _create_schema(self, cursor):
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        for name, columns in self._columns.items():
+            column_defs = "".join(f', "{column}"' for column in columns)
+            cursor.execute(f'CREATE TABLE IF NOT EXISTS "{name}" (id INTEGER PRIMARY KEY, data TEXT NOT NULL{column_defs})')
+            # Tables created without some indexed column get it filled from the JSON
+            existing = {row[1] for row in cursor.execute(f'PRAGMA table_info("{name}")')}
+            for column in columns:
+                if column not in existing:
+                    cursor.execute(f'ALTER TABLE "{name}" ADD COLUMN "{column}"')
+                    cursor.execute(f'UPDATE "{name}" SET "{column}" = json_extract(data, ?)', (f"$.{column}",))
+            for group in SQLITE_INDEXES.get(name, ()):
+                index_name = f"{name}_{'_'.join(group)}"
+                indexed = ", ".join(f'"{column}"' for column in group)
+                cursor.execute(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{name}" ({indexed})')
+        cursor.execute("CREATE TABLE IF NOT EXISTS donation_history (key TEXT PRIMARY KEY, entries TEXT NOT NULL)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS largest_ids (store TEXT PRIMARY KEY, id INTEGER NOT NULL)")
+
+    def _row(self, name, key, data):
+        return (key, json.dumps(data, separators=(",", ":"))) + tuple(data.get(column) for column in self._columns[name])
+
+    def recover(self):
+        with self._lock:
+            cursor = self._connection.cursor()
+            self._create_schema(cursor)
+            initialized = cursor.execute("SELECT COUNT(*) FROM largest_ids").fetchone()[0]
+            if initialized:
+                for name in self.stores:
+                    rows = cursor.execute(f'SELECT data FROM "{name}" ORDER BY id')
+                    self.load(name, (json.loads(data) for data, in rows))
+                for name, largest in cursor.execute("SELECT store, id FROM largest_ids"):
+                    if name in self._largest:
+                        self._largest[name] = max(self._largest[name], largest)
+                self.history.clear()
+                for key, entries in cursor.execute("SELECT key, entries FROM donation_history"):
+                    self.history[key] = json.loads(entries)
+            else:
+                # First start: store the seed state in one transaction
+                cursor.execute("BEGIN")
+                for name, (store, _) in self.stores.items():
+                    cursor.executemany(self._put_sql[name], (
+                        self._row(name, record[store.primary_key], self.encode(record)) for record in store
+                    ))
+                    for record in store:
+                        self._largest[name] = max(self._largest[name], record[store.primary_key])
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO largest_ids (store, id) VALUES (?, ?)", self._largest.items()
+                )
+                cursor.executemany(
+                    "INSERT OR REPLACE INTO donation_history (key, entries) VALUES (?, ?)",
+                    ((key, json.dumps(entries)) for key, entries in self.history.items())
+                )
+                cursor.execute("COMMIT")
+        self._queue.start()
+        self.install_journals()
+        return dict(self._largest)
+
+    def _apply(self, batch):
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN")
+            try:
+                for sql, parameters in batch:
+                    cursor.execute(sql, parameters)
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+            self.writes += len(batch)
+
+    def _execute(self, sql, parameters):
+        return self._track(self._queue.append((sql, parameters)))
+
+    def put(self, name, key, data):
+        return self._execute(self._put_sql[name], self._row(name, key, data))
+
+    def delete(self, name, key):
+        return self._execute(self._delete_sql[name], (key,))
+
+    def save_largest(self, name, key):
+        return self._execute("INSERT OR REPLACE INTO largest_ids (store, id) VALUES (?, ?)", (name, key))
+
+    def log_history(self, key):
+        entries = json.dumps(self.history.get(key, []))
+        return self._execute("INSERT OR REPLACE INTO donation_history (key, entries) VALUES (?, ?)", (key, entries))
+
+    def wait(self, ticket, timeout=None):
+        return self._queue.wait(ticket, timeout)
+
+    def stats(self):
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "writes": self.writes,
+            "batches": self._queue.batches,
+            "queuedWrites": len(self._queue)
+        }
+
+    def close(self):
+        self._queue.close()
+        with self._lock:
+            self._connection.close()
+
+
+# Store name -> DynamoDB table, keyed by the numeric id. server_aws.py keeps
+# its own BloodBank_* tables (string ids, counters), so the two never share items
+DYNAMODB_TABLES = {
+    "users": "BloodBankStore_Users",
+    "donors": "BloodBankStore_Donors",
+    "hospitals": "BloodBankStore_Hospitals",
+    "inventory": "BloodBankStore_Inventory",
+    "blood_requests": "BloodBankStore_Requests",
+}
+# Donation history lists, keyed by "key" (the donor email)
+DYNAMODB_HISTORY_TABLE = "BloodBankStore_DonationHistory"
+# Bookkeeping items, keyed by a string "id"
+DYNAMODB_META_TABLE = "BloodBankStore_Meta"
+# Item of the meta table holding the largest id written per store
+DYNAMODB_LARGEST_IDS_KEY = {"id": "largestIds"}
+
+
+def _to_dynamodb(value):
+    if isinstance(value, float):
+        return Decimal(str(value))
+    if isinstance(value, dict):
+        return {k: _to_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_dynamodb(v) for v in value]
+    return value
+
+
+def _from_dynamodb(value):
+    if isinstance(value, Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    if isinstance(value, dict):
+        return {k: _from_dynamodb(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_from_dynamodb(v) for v in value]
+    return value
+
+
+class DynamoDBStorage(Storage):
+    """
+    Stores in the DYNAMODB_TABLES created by create_dynamodb_tables.py --storage.
+
+    Each record is one item keyed by its id. State is loaded with one
+    paginated scan per table on startup; the server remains the single
+    writer of these items. Items are converted when a write is queued and
+    a WriteQueue thread sends them to DynamoDB.
+
+    Args:
+        region (str): AWS region
+        stores (dict): See Storage
+        history (dict): See Storage
+    """
+
+    def __init__(self, region, stores, history):
+        super().__init__(stores, history)
+        import boto3
+        from botocore.exceptions import ClientError
+        self._client_error = ClientError
+        dynamodb = boto3.resource("dynamodb", region_name=region)
+        self._tables = {name: dynamodb.Table(DYNAMODB_TABLES[name]) for name in stores}
+        self._history_table = dynamodb.Table(DYNAMODB_HISTORY_TABLE)
+        self._meta_table = dynamodb.Table(DYNAMODB_META_TABLE)
+        self._queue = WriteQueue(self._apply, "dynamodb-writer")
+        self.writes = 0
+
+    @staticmethod
+    def _scan(table):
+        kwargs = {}
+        while True:
+            res = table.scan(**kwargs)
+            yield from _from_dynamodb(res.get("Items", []))
+            if "LastEvaluatedKey" not in res:
+                return
+            kwargs["ExclusiveStartKey"] = res["LastEvaluatedKey"]
+
+    def recover(self):
+        largest = self._meta_table.get_item(Key=DYNAMODB_LARGEST_IDS_KEY).get("Item")
+        if largest is not None:
+            for name, table in self._tables.items():
+                self.load(name, self._scan(table))
+                self._largest[name] = max(self._largest[name], _from_dynamodb(largest.get(name, 0)))
+            self.history.clear()
+            for item in self._scan(self._history_table):
+                self.history[item["key"]] = item.get("entries", [])
+        else:
+            # First start: store the seed state
+            for name, (store, _) in self.stores.items():
+                with self._tables[name].batch_writer() as batch:
+                    for record in store:
+                        batch.put_item(Item=_to_dynamodb(self.encode(record)))
+                        self._largest[name] = max(self._largest[name], record[store.primary_key])
+            for key in self.history:
+                self.log_history(key)
+            self._meta_table.put_item(Item={**DYNAMODB_LARGEST_IDS_KEY, **self._largest})
+        self._queue.start()
+        self.install_journals()
+        return dict(self._largest)
+
+    def _apply(self, batch):
+        # Each write is its own request; one failing does not drop the rest
+        for write, *arguments in batch:
+            try:
+                write(*arguments)
+            except Exception:
+                logging.getLogger(__name__).exception("DynamoDB write failed")
+            self.writes += 1
+
+    def put(self, name, key, data):
+        return self._track(self._queue.append((self._put, name, _to_dynamodb(data))))
+
+    def _put(self, name, item):
+        self._tables[name].put_item(Item=item)
+
+    def delete(self, name, key):
+        return self._track(self._queue.append((self._delete, name, key)))
+
+    def _delete(self, name, key):
+        self._tables[name].delete_item(Key={"id": key})
+
+    def save_largest(self, name, key):
+        return self._track(self._queue.append((self._save_largest, name, key)))
+
+    def _save_largest(self, name, key):
+        try:
+            self._meta_table.update_item(
+                Key=DYNAMODB_LARGEST_IDS_KEY,
+                UpdateExpression="SET #s = :id",
+                ConditionExpression="attribute_not_exists(#s) OR #s < :id",
+                ExpressionAttributeNames={"#s": name},
+                ExpressionAttributeValues={":id": key}
+            )
+        except self._client_error as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+    def log_history(self, key):
+        item = _to_dynamodb({"key": key, "entries": self.history.get(key, [])})
+        return self._track(self._queue.append((self._put_history, item)))
+
+    def _put_history(self, item):
+        self._history_table.put_item(Item=item)
+
+    def wait(self, ticket, timeout=None):
+        return self._queue.wait(ticket, timeout)
+
+    def stats(self):
+        return {
+            "backend": "dynamodb",
+            "writes": self.writes,
+            "batches": self._queue.batches,
+            "queuedWrites": len(self._queue)
+        }
+
+    def close(self):
+        self._queue.close()
+
+
+def open_storage(config, stores, history):
+    """
+    Create the storage backend selected by the app config.
+
+    Args:
+        config (dict): STORAGE_BACKEND, DATA_DIR, WAL_COMMIT_SECONDS,
+            WAL_SNAPSHOT_EVERY and AWS_REGION settings
+        stores (dict): See Storage
+        history (dict): See Storage
+
+    Returns:
+        Storage: The backend (not yet recovered), or None for "memory"
+
+    Raises:
+        ValueError: If STORAGE_BACKEND is unknown
+    """
+    backend = config["STORAGE_BACKEND"]
+    if backend == "memory":
+        return None
+    if backend == "wal":
+        from persistence import Persistence
+        return Persistence(
+            config["DATA_DIR"], stores, history,
+            commit_interval=config["WAL_COMMIT_SECONDS"],
+            snapshot_every=config["WAL_SNAPSHOT_EVERY"]
+        )
+    if backend == "sqlite":
+        return SQLiteStorage(os.path.join(config["DATA_DIR"], "bloodbank.sqlite3"), stores, history)
+    if backend == "dynamodb":
+        return DynamoDBStorage(config["AWS_REGION"], stores, history)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r} (memory, wal, sqlite or dynamodb)")
@@ -0,0 +1,419 @@
+"""
+Indexed in-memory record store for the Blood Bank Application.
+
+Each collection in server.py (users, donors, hospitals, inventory, blood
+requests) is a RecordStore: records are kept by primary id, with optional
+unique secondary indexes (e.g. user email, donor userId) and filter indexes
+(e.g. donor bloodGroup, request status). Point lookups, duplicate checks
+and filtered, cursor-paginated listings are served from these indexes
+instead of list scans.
+
+Filter indexes can also keep live counters of value combinations (e.g.
+donors per (bloodGroup, available)), so dashboard totals are read in O(1)
+instead of being recounted from the records.
+
+Unique fields are treated as immutable once a record is inserted. Other
+fields may change, but the caller must call reindex() after changing a
+stored record: it refreshes the filter indexes and passes the change to the
+store's journal (see storage.py), if any.
+
+Stores are safe to share between request threads: each store has its own
+lock, held by writes (update() also holds it across a read-modify-write of
+one record) but only briefly by queries, which walk a snapshot of the index
+outside it. Ids come from allocate_id() rather than from counting records.
+"""
+
+import functools
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+
+class DuplicateKeyError(ValueError):
+    """Raised when inserting a record whose primary or unique key is taken."""
+
+    def __init__(self, field, value):
+        super().__init__(f"Duplicate {field}: {value!r}")
+        self.field = field
+        self.value = value
+
+
+def _sorted_insert(keys, key):
+    if not keys or keys[-1] < key:
+        keys.append(key)
+    else:
+        insort(keys, key)
+
+
+def _sorted_remove(keys, key):
+    position = bisect_left(keys, key)
+    if position < len(keys) and keys[position] == key:
+        del keys[position]
+
+
+# Ids copied per lock hold by a paged query (doubled while a sparse filter
+# keeps pages short, up to QUERY_WINDOW_MAX)
+QUERY_WINDOW = 64
+QUERY_WINDOW_MAX = 4096
+
+
+def _locked(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class RecordStore:
+    """
+    Records keyed by a primary id with unique and filter indexes.
+
+    Iterating the store yields records in insertion order, so it can be used
+    wherever the previous plain lists were iterated. Iteration walks a
+    snapshot of the records taken when it starts, so it never sees (or
+    fails on) concurrent inserts and deletes.
+
+    Unique indexes are sparse: records whose indexed value is missing or
+    empty are stored but not indexed, so e.g. donors without an email do
+    not conflict with each other.
+
+    Filter indexes keep, for every value of a field, the sorted list of
+    primary ids having that value, so query() can seek to a cursor with a
+    binary search and walk only the records matching its most selective
+    filter.
+
+    Counted field combinations (tuples of filter indexed fields) keep the
+    number of records per combination of values, updated with the filter
+    indexes on every insert, delete and reindex.
+    """
+
+    def __init__(self, records=(), primary_key="id", unique=(), indexed=(), counted=(), first_id=1):
+        self.primary_key = primary_key
+        self._lock = threading.RLock()
+        # next id returned by allocate_id(); kept above every inserted id
+        self._next_id = first_id
+        # primary id -> record
+        self._records = {}
+        # sorted primary ids
+        self._keys = []
+        # field -> {value -> primary id}
+        self._indexes = {field: {} for field in unique}
+        # field -> {value -> sorted primary ids}
+        self._postings = {field: {} for field in indexed}
+        # primary id -> {field -> value currently indexed}
+        self._indexed_values = {}
+        # callable(key, record) told about every insert, reindex (the record)
+        # and delete (None), e.g. to write it to a log. It runs under the
+        # store lock, so it should only queue the write
+        self.journal = None
+        # counted fields -> {tuple of values -> number of records}
+        self._counters = {}
+        for fields in counted:
+            fields = tuple(fields)
+            for field in fields:
+                if field not in self._postings:
+                    raise ValueError(f"{field} is not an indexed field")
+            self._counters[fields] = {}
+        for record in records:
+            self.insert(record)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(list(self._records.values()))
+
+    @_locked
+    def allocate_id(self):
+        """
+        Allocate a new primary id, atomically.
+
+        Ids are never handed out twice, even after the record holding the
+        largest id is deleted.
+
+        Returns:
+            int: An id above every id allocated or inserted so far
+        """
+        key = self._next_id
+        self._next_id += 1
+        return key
+
+    @_locked
+    def reserve_ids(self, through):
+        """
+        Make allocate_id() return only ids above a value.
+
+        Args:
+            through (int): Largest id already used (e.g. by deleted records)
+        """
+        self._next_id = max(self._next_id, through + 1)
+
+    @_locked
+    def insert(self, record):
+        """
+        Insert a new record.
+
+        Args:
+            record (dict): Record with a primary key value
+
+        Returns:
+            dict: The inserted record
+
+        Raises:
+            DuplicateKeyError: If the primary key or a unique field is taken
+        """
+        key = record[self.primary_key]
+        if key in self._records:
+            raise DuplicateKeyError(self.primary_key, key)
+
+        for field, index in self._indexes.items():
+            value = record.get(field)
+            if value and value in index:
+                raise DuplicateKeyError(field, value)
+
+        self._records[key] = record
+        if isinstance(key, int) and key >= self._next_id:
+            self._next_id = key + 1
+        _sorted_insert(self._keys, key)
+        for field, index in self._indexes.items():
+            value = record.get(field)
+            if value:
+                index[value] = key
+        self._index_filters(key, record)
+        if self.journal is not None:
+            self.journal(key, record)
+        return record
+
+    def get(self, key):
+        """
+        Get a record by primary id.
+
+        Args:
+            key: Primary id
+
+        Returns:
+            dict: The record, or None if not found
+        """
+        return self._records.get(key)
+
+    def find(self, field, value):
+        """
+        Get a record by a unique secondary field.
+
+        Args:
+            field (str): Name of a unique indexed field
+            value: Value to look up
+
+        Returns:
+            dict: The record, or None if not found
+        """
+        key = self._indexes[field].get(value)
+        if key is None:
+            return None
+        return self._records.get(key)
+
+    @_locked
+    def delete(self, key):
+        """
+        Delete a record by primary id.
+
+        Args:
+            key: Primary id
+
+        Returns:
+            dict: The deleted record, or None if not found
+        """
+        record = self._records.pop(key, None)
+        if record is not None:
+            _sorted_remove(self._keys, key)
+            for field, index in self._indexes.items():
+                value = record.get(field)
+                if value and index.get(value) == key:
+                    del index[value]
+            self._unindex_filters(key)
+            if self.journal is not None:
+                self.journal(key, None)
+        return record
+
+    @_locked
+    def reindex(self, key):
+        """
+        Refresh the filter indexes and journal of a record after its fields changed.
+
+        Args:
+            key: Primary id of a stored record
+        """
+        record = self._records.get(key)
+        if record is None:
+            return
+        values = self._indexed_values.get(key)
+        if values is not None and any(record.get(field) != value for field, value in values.items()):
+            self._unindex_filters(key)
+            self._index_filters(key, record)
+        if self.journal is not None:
+            self.journal(key, record)
+
+    @_locked
+    def update(self, key, change):
+        """
+        Change a stored record in place under the store lock, then reindex it.
+
+        Concurrent updates of a record run one after the other, so a
+        read-modify-write (e.g. flipping a flag) never loses another's change.
+
+        Args:
+            key: Primary id of a stored record
+            change (callable): Called with the record; changes it in place
+
+        Returns:
+            The changed record, or None if there is no such record
+        """
+        record = self._records.get(key)
+        if record is None:
+            return None
+        change(record)
+        self.reindex(key)
+        return record
+
+    @_locked
+    def clear(self):
+        """Remove every record without journaling the deletions."""
+        self._records.clear()
+        self._keys.clear()
+        for index in self._indexes.values():
+            index.clear()
+        for postings in self._postings.values():
+            postings.clear()
+        self._indexed_values.clear()
+        for counts in self._counters.values():
+            counts.clear()
+
+    def _index_filters(self, key, record):
+        if not self._postings:
+            return
+        values = {}
+        for field, postings in self._postings.items():
+            value = record.get(field)
+            values[field] = value
+            _sorted_insert(postings.setdefault(value, []), key)
+        self._indexed_values[key] = values
+        for fields, counts in self._counters.items():
+            combination = tuple(values[field] for field in fields)
+            counts[combination] = counts.get(combination, 0) + 1
+
+    def _unindex_filters(self, key):
+        values = self._indexed_values.pop(key, None)
+        if values is None:
+            return
+        for field, value in values.items():
+            postings = self._postings[field]
+            keys = postings.get(value)
+            if keys is not None:
+                _sorted_remove(keys, key)
+                if not keys:
+                    del postings[value]
+        for fields, counts in self._counters.items():
+            combination = tuple(values[field] for field in fields)
+            counts[combination] -= 1
+            if not counts[combination]:
+                del counts[combination]
+
+    def count(self, field, value):
+        """
+        Count records whose filter field has a value.
+
+        Args:
+            field (str): Name of a filter indexed field
+            value: Value to count
+
+        Returns:
+            int: Number of matching records
+        """
+        return len(self._postings[field].get(value, ()))
+
+    @_locked
+    def tally(self, *fields):
+        """
+        Get the live record counts per combination of values of counted fields.
+
+        Args:
+            *fields (str): A field combination passed as `counted`
+
+        Returns:
+            dict: Tuple of values (in `fields` order) -> number of records,
+            for every combination held by at least one record
+        """
+        return dict(self._counters[fields])
+
+    def query(self, filters=None, after=None, limit=None):
+        """
+        List records matching all filters, in primary id order.
+
+        The smallest posting list among the filters drives the walk, and
+        each record reached is checked against the indexed values of all
+        filters. The lock is only held to copy the next window of driving
+        ids, so a page costs time proportional to the ids it walks (not to
+        the whole list) and listings do not block writers; records deleted
+        or changed during the walk are checked as they are when reached.
+
+        Args:
+            filters (dict): Filter field -> required value
+            after: Only return records with a primary id greater than this
+            limit (int): Maximum number of records, or None for all
+
+        Returns:
+            tuple: (records, next_cursor) where next_cursor is the id to pass
+            as `after` for the next page, or None if no further record
+            matches
+
+        Raises:
+            ValueError: If a filter field is not indexed
+        """
+        filters = filters or {}
+        for field in filters:
+            if field not in self._postings:
+                raise ValueError(f"{field} is not an indexed field")
+
+        driver = None
+        if filters:
+            with self._lock:
+                driver = min(filters, key=lambda field: len(self._postings[field].get(filters[field], ())))
+        # The driver is checked too, in case the record changed since
+        checks = list(filters.items())
+
+        # One match past the limit tells whether there is a next page
+        records = []
+        keys = []
+        window = max(QUERY_WINDOW, 2 * (limit + 1)) if limit is not None else None
+        last_key = after
+        while True:
+            with self._lock:
+                candidates = self._postings[driver].get(filters[driver], ()) if driver else self._keys
+                start = bisect_right(candidates, last_key) if last_key is not None else 0
+                chunk = candidates[start:start + window] if window else candidates[start:]
+            for key in chunk:
+                record = self._records.get(key)
+                if record is None:
+                    continue
+                if checks:
+                    # Replaced (never changed in place) by reindex(), so consistent
+                    values = self._indexed_values.get(key)
+                    if values is None or any(values[field] != value for field, value in checks):
+                        continue
+                if limit is not None and len(records) == limit:
+                    return records, keys[-1]
+                records.append(record)
+                keys.append(key)
+            if not window or len(chunk) < window:
+                return records, None
+            last_key = chunk[-1]
+            window = min(window * 2, QUERY_WINDOW_MAX)
+
+    def all(self):
+        """
+        Get all records in insertion order.
+
+        Returns:
+            list: List of the stored records (not copies)
+        """
+        return list(self._records.values())
@@ -8,8 +8,19 @@ from ai_engine import (
     is_compatible,
     get_all_valid_blood_groups,
     match_donors_to_request,
-    get_donation_stats
+    get_donation_stats,
+    get_compatibility_score,
+    COMPATIBILITY_MATRIX,
+    VALID_BLOOD_GROUPS,
+    DonorIndex,
+    MatchCache,
+    match_many,
+    haversine_km,
+    UnavailableDates,
+    EligibilityScheduler,
+    plan_fulfillment
 )
+from datetime import date, datetime, timedelta
 
 print("=" * 70)
 print("Testing AI Engine Blood Compatibility Module")
@@ -64,6 +75,181 @@ print(f"   Matched donors: {len(matched)}")
 for donor in matched:
     print(f"     - {donor['name']} ({donor['bloodGroup']}) - Score: {donor['compatibility_score']}")
 
+# Test 6: Compiled compatibility tables agree with the matrix
+print("\n6. Compiled Compatibility Tables:")
+mismatches = 0
+for recipient in VALID_BLOOD_GROUPS:
+    for donor in VALID_BLOOD_GROUPS:
+        expected = donor in COMPATIBILITY_MATRIX[recipient]
+        if is_compatible(donor, recipient) != expected:
+            mismatches += 1
+        if (get_compatibility_score(donor, recipient) > 0) != expected:
+            mismatches += 1
+status = "✓" if mismatches == 0 else "✗"
+print(f"   {status} 64 donor/recipient pairs checked, {mismatches} mismatches")
+print(f"   Invalid group compatible: {is_compatible('X+', 'A+')}")
+
+# Test 7: Donor index and match cache
+print("\n7. Donor Index and Match Cache:")
+index = DonorIndex(sample_donors)
+cache = MatchCache(index)
+cache.track(1, sample_request)
+cached = cache.get(1)
+same = cached == match_donors_to_request(sample_request, sample_donors)
+print(f"   {'✓' if same else '✗'} Indexed matches equal full scan: {len(cached)} donors")
+sample_donors[2]["available"] = True  # Bob (B+) cannot donate to A+
+index.update(sample_donors[2])
+# A cached list is returned as is until the request is rematched
+kept = cache.get(1) is cached
+print(f"   {'✓' if kept else '✗'} Incompatible donor change keeps cache")
+sample_donors[1]["available"] = False  # Jane (A+)
+index.update(sample_donors[1])
+rematched = cache.get(1)
+invalidated = rematched is not cached and "Jane" not in [d["name"] for d in rematched]
+print(f"   {'✓' if invalidated else '✗'} Compatible donor change invalidates cache")
+assert same and kept and invalidated
+print(f"   Matched after change: {len(rematched)} donors")
+
+# Test 8: Batch matching
+print("\n8. Batch Matching:")
+batch = [{"bloodGroup": "A+"}, {"bloodGroup": "O-"}, {"bloodGroup": "AB+"}]
+batch_matches = match_many(batch, sample_donors)
+same = all(
+    matches == match_donors_to_request(req, sample_donors)
+    for req, matches in zip(batch, batch_matches)
+)
+print(f"   {'✓' if same else '✗'} Batch results equal per-request matching")
+for req, matches in zip(batch, batch_matches):
+    print(f"     - {req['bloodGroup']}: {[d['name'] for d in matches]}")
+
+# Test 9: Proximity matching
+print("\n9. Proximity Matching:")
+located_donors = [
+    {"name": "Near", "bloodGroup": "O-", "available": True, "latitude": 12.98, "longitude": 77.60},
+    {"name": "Far", "bloodGroup": "A+", "available": True, "latitude": 28.61, "longitude": 77.21},
+    {"name": "Mid", "bloodGroup": "A-", "available": True, "latitude": 13.50, "longitude": 77.00},
+    {"name": "Unlocated", "bloodGroup": "A+", "available": True}
+]
+located_index = DonorIndex(located_donors)
+nearby = located_index.match_nearby({"bloodGroup": "A+"}, 12.97, 77.59)
+print(f"   Nearest first: {[(d['name'], d['distance_km']) for d in nearby]}")
+within = located_index.match_nearby({"bloodGroup": "A+"}, 12.97, 77.59, radius_km=100)
+print(f"   Within 100 km: {[d['name'] for d in within]}")
+located_batch = [{"bloodGroup": "A+", "latitude": 12.97, "longitude": 77.59}, {"bloodGroup": "A+"}]
+for radius_km, expected in ((None, nearby), (100, within)):
+    batch_matches = match_many(located_batch, located_index.compatible_donors("A+"), radius_km=radius_km)
+    assert batch_matches[0] == expected and batch_matches[1] == located_index.match({"bloodGroup": "A+"})
+print("   ✓ Batch matching ranks located requests like match_nearby")
+print(f"   Bangalore-Delhi: {haversine_km(12.97, 77.59, 28.61, 77.21):.0f} km")
+
+# Test 10: Unavailable dates
+print("\n10. Unavailable Dates:")
+blocked = UnavailableDates([
+    {"date": "2026-12-01", "endDate": "2026-12-05", "reason": "Travel", "id": 1},
+    {"date": "2026-12-06", "reason": "Exam", "id": 2},
+    {"date": "2026-12-24", "reason": "Holiday", "id": 3}
+])
+print(f"   Merged periods: {[(str(start), str(end)) for start, end in blocked.intervals()]}")
+print(f"   Blocked on 2026-12-03: {blocked.blocks('2026-12-03')}, on 2026-12-10: {blocked.blocks('2026-12-10')}")
+busy_donors = [
+    {"name": "Busy", "bloodGroup": "O-", "available": True, "unavailableDates": list(blocked)},
+    {"name": "Free", "bloodGroup": "A+", "available": True}
+]
+on_trip = match_donors_to_request({"bloodGroup": "A+", "requiredDate": "2026-12-03"}, busy_donors)
+after_trip = match_donors_to_request({"bloodGroup": "A+", "requiredDate": "2026-12-10"}, busy_donors)
+print(f"   Matched on 2026-12-03: {[d['name'] for d in on_trip]}")
+print(f"   Matched on 2026-12-10: {[d['name'] for d in after_trip]}")
+
+# Test 11: Donation eligibility
+print("\n11. Donation Eligibility:")
+clock_now = datetime(2026, 1, 1)
+eligibility_donors = [
+    {"name": "Gave Platelets", "bloodGroup": "O-", "available": True},
+    {"name": "Gave Whole Blood", "bloodGroup": "O+", "available": True},
+    {"name": "Never Gave", "bloodGroup": "A+", "available": True}
+]
+eligibility_index = DonorIndex(eligibility_donors)
+scheduler = EligibilityScheduler(eligibility_index, clock=lambda: clock_now)
+scheduler.record_donation(eligibility_donors[0], clock_now, "platelets")
+scheduler.record_donation(eligibility_donors[1], clock_now, "whole_blood")
+print(f"   Matched right after donating: {[d['name'] for d in eligibility_index.match({'bloodGroup': 'A+'})]}")
+print(f"   Eligible within 10 days: {[d['name'] for _, d in scheduler.upcoming(10)]}")
+assert not scheduler.has_due()
+clock_now += timedelta(days=8)
+assert scheduler.has_due()
+print(f"   Released after 8 days: {[d['name'] for d in scheduler.release_due()]}")
+assert not scheduler.has_due()
+print(f"   Matched after 8 days: {[d['name'] for d in eligibility_index.match({'bloodGroup': 'A+'})]}")
+
+print("\n12. Inventory Fulfillment:")
+plan_today = date(2026, 1, 1)
+plan_batches = [
+    {"bloodGroup": "O-", "units": 2, "expiry": "2026-01-20"},
+    {"bloodGroup": "A+", "units": 2, "expiry": "2026-01-05"},
+    {"bloodGroup": "O+", "units": 3, "expiry": "2026-01-10"},
+    {"bloodGroup": "A+", "units": 5, "expiry": "2025-12-30"}
+]
+plan_requests = [
+    {"bloodGroup": "A+", "units": 4, "urgency": "LOW"},
+    {"bloodGroup": "O-", "units": 2, "urgency": "CRITICAL"},
+    {"bloodGroup": "O+", "units": 2, "urgency": "HIGH"}
+]
+
+
+def check_plan(requests, batches, allow_partial=True):
+    plans = plan_fulfillment(requests, batches, plan_today, allow_partial=allow_partial)
+    for plan_request, (allocated, allocations) in zip(requests, plans):
+        used = [f"{units} {batch['bloodGroup']}" for batch, units in allocations]
+        print(f"   {plan_request['urgency']:8} {plan_request['bloodGroup']}: {allocated}/{plan_request['units']} units from {used}")
+        assert allocated == sum(units for _, units in allocations) <= plan_request["units"]
+        assert all(is_compatible(batch["bloodGroup"], plan_request["bloodGroup"]) for batch, _ in allocations)
+        assert all(batch["expiry"] >= plan_today.isoformat() for batch, _ in allocations)
+    for batch in batches:
+        assert sum(units for _, allocations in plans for used, units in allocations if used is batch) <= batch["units"]
+    return [(allocated, sorted((batch["bloodGroup"], units) for batch, units in allocations))
+            for allocated, allocations in plans]
+
+
+# The expired A+ batch is never used, so the LOW request is one unit short
+assert check_plan(plan_requests, plan_batches) == [
+    (3, [("A+", 2), ("O+", 1)]), (2, [("O-", 2)]), (2, [("O+", 2)])
+]
+print("   All or nothing:")
+assert check_plan(plan_requests, plan_batches, allow_partial=False) == [
+    (0, []), (2, [("O-", 2)]), (2, [("O+", 2)])
+]
+
+# AB+ takes the A+ units first; the repair pass moves it onto B+ for the A+ request
+swap_batches = [
+    {"bloodGroup": "A+", "units": 2, "expiry": "2026-01-10"},
+    {"bloodGroup": "B+", "units": 2, "expiry": "2026-01-10"}
+]
+swap_requests = [
+    {"bloodGroup": "AB+", "units": 2, "urgency": "CRITICAL"},
+    {"bloodGroup": "A+", "units": 2, "urgency": "LOW"}
+]
+print("   Repair pass:")
+for allow_partial in (True, False):
+    assert check_plan(swap_requests, swap_batches, allow_partial) == [
+        (2, [("B+", 2)]), (2, [("A+", 2)])
+    ]
+# A move that cannot cover the request in full is undone in strict mode
+short_requests = swap_requests[:1] + [{"bloodGroup": "A+", "units": 3, "urgency": "LOW"}]
+assert check_plan(short_requests, swap_batches, allow_partial=False) == [(2, [("A+", 2)]), (0, [])]
+
+print("\n13. Batch Match Cache with Required Dates:")
+dated_index = DonorIndex([
+    {"name": "Away", "bloodGroup": "A+", "available": True,
+     "unavailableDates": [{"date": "2030-01-01", "reason": "Travel", "id": 1}]}
+])
+dated_cache = MatchCache(dated_index)
+dated_cache.track(1, {"bloodGroup": "A+", "requiredDate": "2030-01-01"})
+dated_cache.track(2, {"bloodGroup": "A+", "requiredDate": "2030-01-02"})
+dated_matches = [[d["name"] for d in matches] for matches in dated_cache.get_many([1, 2])]
+same = dated_matches == [[], ["Away"]]
+print(f"   {'✓' if same else '✗'} Same group, different days matched separately: {dated_matches}")
+assert same
+
 print("\n" + "=" * 70)
 print("All tests completed successfully!")
 print("=" * 70)
@@ -0,0 +1,62 @@
+"""
+Test script for the SNS notification dispatcher
+"""
+
+import threading
+import time
+
+from notifications import NotificationDispatcher, URGENT, NORMAL
+
+
+class ThrottledSNS:
+    """Stand-in SNS client that throttles the first publishes of "Throttled" messages."""
+
+    def __init__(self, throttled_attempts):
+        self.throttled_attempts = throttled_attempts
+        self.published = {}
+        self.attempted = threading.Event()
+        self.lock = threading.Lock()
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        failed = []
+        with self.lock:
+            for entry in PublishBatchRequestEntries:
+                if entry["Subject"] == "Throttled" and self.throttled_attempts:
+                    self.throttled_attempts -= 1
+                    failed.append({"Id": entry["Id"], "Code": "Throttling", "SenderFault": False})
+                    self.attempted.set()
+                else:
+                    self.published[entry["Subject"]] = time.monotonic()
+        return {"Failed": failed}
+
+
+print("=" * 70)
+print("Testing SNS Notification Dispatcher")
+print("=" * 70)
+
+# Test 1: A retrying batch does not block a new publish
+print("\n1. Retry Backoff Does Not Block Workers:")
+sns = ThrottledSNS(throttled_attempts=1)
+dispatcher = NotificationDispatcher(sns, "arn:test", workers=1, base_delay=1.0)
+dispatcher.notify("Throttled", "retried with backoff", NORMAL)
+assert sns.attempted.wait(5)
+sent_at = time.monotonic()
+dispatcher.notify("Urgent", "new blood request", URGENT)
+deadline = time.monotonic() + 5
+while "Urgent" not in sns.published and time.monotonic() < deadline:
+    time.sleep(0.005)
+urgent_latency = sns.published["Urgent"] - sent_at
+print(f"   Urgent published {urgent_latency * 1000:.0f} ms after queueing, while a retry waits")
+assert urgent_latency < 0.25
+
+# Test 2: Shutdown still publishes the delayed retries
+print("\n2. Shutdown Publishes Delayed Retries:")
+dispatcher.shutdown()
+stats = dispatcher.stats()
+print(f"   Published {stats['published']}, retried {stats['retried']}, failed {stats['failed']}")
+assert "Throttled" in sns.published and stats["published"] == 2 and stats["retried"] == 1
+assert stats["delayedRetries"] == 0
+
+print("\n" + "=" * 70)
+print("All tests completed successfully!")
+print("=" * 70)
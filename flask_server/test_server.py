@@ -0,0 +1,164 @@
+"""
+Test script for the local development server (in-memory storage)
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+# No background sweeper thread; the test runs sweeps itself
+os.environ["INVENTORY_SWEEP_SECONDS"] = "0"
+os.environ.pop("DATA_DIR", None)
+os.environ.pop("STORAGE_BACKEND", None)
+# A cheap hash keeps the seeded and test signups fast
+os.environ["PASSWORD_HASH_METHOD"] = "pbkdf2:sha256:1000"
+
+import server
+from inventory import ExpirySweeper
+
+client = server.app.test_client()
+
+
+def ok(response, status=200):
+    assert response.status_code == status, response.get_data(as_text=True)
+    return response.get_json()
+
+
+print("=" * 70)
+print("Testing Local Server")
+print("=" * 70)
+
+# Test 1: Paging through blood requests
+print("\n1. Request Pagination:")
+for index in range(7):
+    ok(client.post("/api/requests", json={
+        "hospitalId": 1, "bloodGroup": "A+" if index % 2 else "O-",
+        "units": 1, "urgency": "HIGH" if index < 4 else "LOW"
+    }), 201)
+everything = ok(client.get("/api/requests"))
+assert isinstance(everything, list)
+expected = [req["id"] for req in everything if req["urgency"] == "HIGH" and req["status"] == "OPEN"]
+assert len(expected) >= 4
+
+paged, after = [], None
+while True:
+    page = ok(client.get("/api/requests?urgency=HIGH&status=OPEN&limit=2" + (f"&after={after}" if after else "")))
+    assert len(page["items"]) <= 2 and all(req["urgency"] == "HIGH" for req in page["items"])
+    paged.extend(req["id"] for req in page["items"])
+    after = page["nextCursor"]
+    if after is None:
+        break
+assert paged == expected
+page = ok(client.get(f"/api/requests?after={everything[-2]['id']}"))
+assert [req["id"] for req in page["items"]] == [everything[-1]["id"]] and page["nextCursor"] is None
+for query in ("limit=0", "limit=two", "after=last", "hospitalId=first"):
+    assert client.get(f"/api/requests?{query}").status_code == 400, query
+print(f"   Open HIGH requests in pages of 2: {paged}")
+
+# Test 2: Sweeping expired inventory
+print("\n2. Expiry Sweeps:")
+# The seeded batches expire on 2025-03-10 (B-, 10 units) and 2025-04-02 (O+, 18 units)
+fresh = ok(client.post("/api/inventory", json={
+    "hospitalId": 1, "hospitalName": "Apollo Hospital", "bloodGroup": "O+", "units": 5,
+    "expiry": (date.today() + timedelta(days=30)).isoformat()
+}), 201)
+retired = server.retire_expired_inventory(date(2025, 3, 20))
+assert [item.id for item in retired] == [1]
+summary = ok(client.get("/api/inventory/summary?hospitalId=1"))
+assert summary["totals"]["B-"] == 0 and summary["totals"]["O+"] == 23
+retired = server.retire_expired_inventory()
+assert [item.id for item in retired] == [2] and server.retire_expired_inventory() == []
+assert [item["id"] for item in ok(client.get("/api/inventory"))] == [fresh["id"]]
+assert ok(client.get("/api/inventory/summary"))["totalUnits"] == 5
+expiry = ok(client.get("/api/metrics"))["inventoryExpiry"]
+assert expiry["retiredBatches"] == 2 and expiry["retiredUnits"] == 28 and expiry["lastSweep"]
+
+# The background sweeper keeps sweeping after a failed sweep, until stopped
+sweeps = []
+swept_twice = threading.Event()
+
+
+def flaky_sweep():
+    sweeps.append(len(sweeps))
+    if len(sweeps) == 1:
+        raise RuntimeError("first sweep fails")
+    if len(sweeps) == 2:
+        swept_twice.set()
+
+
+sweeper = ExpirySweeper(flaky_sweep, 0.01)
+logging.getLogger("inventory").disabled = True
+sweeper.start()
+sweeper.start()
+assert swept_twice.wait(5)
+sweeper.stop()
+swept = len(sweeps)
+time.sleep(0.05)
+assert len(sweeps) == swept
+print(f"   Retired batches: {expiry['retiredBatches']}, units: {expiry['retiredUnits']}")
+
+# Test 3: Inventory totals follow every inventory write
+print("\n3. Inventory Aggregates:")
+
+
+def recount():
+    totals = {}
+    for item in ok(client.get("/api/inventory")):
+        key = (item["hospitalId"], item["bloodGroup"])
+        totals[key] = totals.get(key, 0) + item["units"]
+    return {key: units for key, units in totals.items() if units}
+
+
+def summed():
+    totals = {}
+    for hospital in ok(client.get("/api/inventory/summary"))["byHospital"]:
+        for blood_group, units in hospital["units"].items():
+            if units:
+                totals[(hospital["hospitalId"], blood_group)] = units
+    return totals
+
+
+later = (date.today() + timedelta(days=60)).isoformat()
+batch = {"hospitalId": 2, "hospitalName": "Fortis Care", "bloodGroup": "A-", "units": 4, "expiry": later}
+moved = ok(client.post("/api/inventory", json=batch), 201)
+ok(client.post("/api/inventory", json={**batch, "bloodGroup": "O+", "units": 6}), 201)
+assert summed() == recount() == {(1, "O+"): 5, (2, "A-"): 4, (2, "O+"): 6}
+# Moving a batch to another hospital and blood group
+ok(client.patch(f"/api/inventory/{moved['id']}", json={**batch, "hospitalId": 1, "hospitalName": "Apollo Hospital",
+                                                        "bloodGroup": "B+", "units": 3}))
+assert summed() == recount() == {(1, "O+"): 5, (1, "B+"): 3, (2, "O+"): 6}
+# Reserving drains the first-expiring O+ batch (hospital 1) and part of the next
+reserved = ok(client.post("/api/inventory/reserve", json={"bloodGroup": "O+", "units": 7}))
+assert [(drawn["hospitalId"], drawn["units"]) for drawn in reserved["batches"]] == [(1, 5), (2, 2)]
+assert summed() == recount() == {(1, "B+"): 3, (2, "O+"): 4}
+ok(client.delete(f"/api/inventory/{moved['id']}"))
+summary = ok(client.get("/api/inventory/summary?city=Delhi"))
+assert summed() == recount() == {(2, "O+"): 4} and summary["totalUnits"] == 4
+print(f"   Units per (hospital, blood group): {summed()}")
+
+# Test 4: Password hashing on the worker pool
+print("\n4. Password Hashing:")
+ok(client.post("/api/auth/signup", json={
+    "name": "Pia", "email": "pia@example.com", "password": "s3cret", "bloodGroup": "AB-"
+}), 201)
+assert ok(client.post("/api/auth/login", json={"email": "pia@example.com", "password": "s3cret"}))["token"]
+assert client.post("/api/auth/login", json={"email": "pia@example.com", "password": "wrong"}).status_code == 401
+assert client.post("/api/auth/login", json={"email": "nobody@example.com", "password": "x"}).status_code == 401
+# A full hashing queue answers 503 instead of queueing without limit
+max_pending = server.password_hasher.max_pending
+server.password_hasher.max_pending = 0
+try:
+    response = client.post("/api/auth/login", json={"email": "pia@example.com", "password": "s3cret"})
+    assert response.status_code == 503
+finally:
+    server.password_hasher.max_pending = max_pending
+hashing = ok(client.get("/api/metrics"))["passwordHashing"]
+assert hashing["method"] == "pbkdf2:sha256:1000" and hashing["rejected"] == 1 and hashing["queueDepth"] == 0
+server.password_hasher.shutdown()
+print(f"   Hashes completed: {hashing['completed']}, rejected: {hashing['rejected']}")
+
+print("\n" + "=" * 70)
+print("All tests completed successfully!")
+print("=" * 70)
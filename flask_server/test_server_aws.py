@@ -0,0 +1,187 @@
+"""
+Test script for the AWS server against moto's in-memory DynamoDB and SNS
+
+Needs boto3 and moto (pip install -r requirements_aws.txt moto).
+"""
+
+import copy
+import logging
+import os
+
+from moto import mock_aws
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+# The clients must be created while the mock is active
+mock = mock_aws()
+mock.start()
+
+import create_dynamodb_tables
+
+# The server writes uuid string ids
+for table_config in create_dynamodb_tables.TABLES:
+    table_config = copy.deepcopy(table_config)
+    for attribute in table_config["AttributeDefinitions"]:
+        if attribute["AttributeName"] == "id":
+            attribute["AttributeType"] = "S"
+    create_dynamodb_tables.dynamodb.create_table(**table_config)
+
+# Donors written before the server first starts
+create_dynamodb_tables.dynamodb.put_item(TableName="BloodBank_Donors", Item={
+    "id": {"S": "seed-1"}, "name": {"S": "Seed"}, "email": {"S": "seed@example.com"},
+    "bloodGroup": {"S": "AB+"}, "available": {"BOOL": False}
+})
+
+# The deployment step counts them into the stats counters
+create_dynamodb_tables.seed_stats_counters()
+import server_aws
+
+# SNS_TOPIC_ARN does not exist in moto; failed publishes are expected here
+logging.getLogger("notifications").setLevel(logging.CRITICAL)
+
+client = server_aws.app.test_client()
+
+
+def signup(email, blood_group):
+    response = client.post("/api/auth/signup", json={
+        "email": email, "password": "secret", "name": email.split("@")[0], "bloodGroup": blood_group
+    })
+    assert response.status_code == 201, response.get_data()
+
+
+def donor_id(email):
+    response = client.get("/api/donors")
+    assert response.status_code == 200, response.get_data()
+    return next(donor["id"] for donor in response.get_json() if donor["email"] == email)
+
+
+print("=" * 70)
+print("Testing AWS Server (moto)")
+print("=" * 70)
+
+# Test 1: Listing donors and creating a request
+print("\n1. Donors and Requests:")
+signup("ana@example.com", "O+")
+donors = client.get("/api/donors").get_json()
+assert sorted(donor["bloodGroup"] for donor in donors) == ["AB+", "O+"]
+ana = next(donor for donor in donors if donor["email"] == "ana@example.com")
+assert ana["donationCount"] == 0 and "compatibilityInfo" in ana
+page = client.get("/api/donors?limit=1").get_json()
+assert len(page["items"]) == 1 and page["nextCursor"] == page["items"][0]["id"]
+print(f"   Donors: {[donor['name'] for donor in donors]}")
+
+client.patch(f"/api/donors/{donor_id('ana@example.com')}/toggle")
+response = client.post("/api/requests", json={
+    "bloodGroup": "A+", "hospital": "City Hospital", "units": 2, "urgency": "HIGH"
+})
+assert response.status_code == 201, response.get_data()
+created = response.get_json()
+assert created["units"] == 2 and [d["name"] for d in created["matchedDonors"]] == ["ana"]
+stored = client.get("/api/requests").get_json()
+assert [req["id"] for req in stored] == [created["id"]] and stored[0]["units"] == 2
+print(f"   Request {created['bloodGroup']} matched: {[d['name'] for d in created['matchedDonors']]}")
+
+# The best match only, with ?limit=
+signup("abe@example.com", "A+")
+client.patch(f"/api/donors/{donor_id('abe@example.com')}/toggle")
+top = client.post("/api/requests?limit=1", json={
+    "bloodGroup": "A+", "hospital": "City Hospital", "units": 1, "urgency": "LOW"
+}).get_json()["matchedDonors"]
+assert [d["name"] for d in top] == ["abe"] and top[0]["exact_match"]
+assert client.post("/api/requests?limit=0", json={
+    "bloodGroup": "A+", "hospital": "City Hospital", "units": 1, "urgency": "LOW"
+}).status_code == 400
+print(f"   Best match with ?limit=1: {[d['name'] for d in top]}")
+
+# Test 2: Toggling availability on and off
+print("\n2. Donor Availability Toggle:")
+signup("ben@example.com", "B-")
+ben = donor_id("ben@example.com")
+states = []
+for _ in range(3):
+    response = client.patch(f"/api/donors/{ben}/toggle")
+    assert response.status_code == 200, response.get_data()
+    states.append(response.get_json()["available"])
+assert states == [True, False, True]
+response = client.patch(f"/api/donors/{ben}/toggle")
+assert response.status_code == 200 and response.get_json()["available"] is False
+matched = client.post("/api/requests", json={
+    "bloodGroup": "B-", "hospital": "City Hospital", "units": 1, "urgency": "LOW"
+}).get_json()["matchedDonors"]
+assert matched == []
+assert client.patch("/api/donors/missing/toggle").status_code == 404
+print(f"   Availability after each toggle: {states + [False]}")
+
+# Test 3: Stats counters include records written before the seeding step
+print("\n3. Stats Counters:")
+stats = client.get("/api/stats").get_json()
+donor_count = len(client.get("/api/donors").get_json())
+assert stats["totalDonors"] == donor_count == 4 and stats["availableDonors"] == 2
+assert stats["activeRequests"] == 3 and stats["byBloodGroup"]["AB+"]["donors"] == 1
+assert not server_aws.ensure_counters()
+# A counters item created by ADDs alone (before the marker existed) is recounted
+server_aws.stats_table.put_item(Item={"id": "counters", "totalDonors": 1})
+assert server_aws.ensure_counters()
+signup("cai@example.com", "A-")
+stats = client.get("/api/stats").get_json()
+assert stats["totalDonors"] == len(client.get("/api/donors").get_json()) == 5
+# A donor added during the recount makes it scan again instead of losing the ADD
+parallel_scan = server_aws.parallel_scan
+scans = []
+
+def racing_scan(table, *args, **kwargs):
+    yield from parallel_scan(table, *args, **kwargs)
+    if table is server_aws.donors_table and not scans:
+        # After the donors were counted, before the counters are written
+        scans.append(table)
+        signup("dee@example.com", "B+")
+
+server_aws.parallel_scan = racing_scan
+server_aws.rebuild_counters()
+server_aws.parallel_scan = parallel_scan
+stats = client.get("/api/stats").get_json()
+assert scans and stats["totalDonors"] == len(client.get("/api/donors").get_json()) == 6
+print(f"   Donors: {stats['totalDonors']}, available: {stats['availableDonors']}, "
+      f"active requests: {stats['activeRequests']}")
+
+# Test 4: Filtered listings read the availableBloodGroup and status indexes
+print("\n4. Indexed Listings:")
+queries = []
+scan_page = server_aws.scan_page
+server_aws.scan_page = lambda *args, **kwargs: queries.append("scan") or scan_page(*args, **kwargs)
+available = client.get("/api/donors?available=true").get_json()
+assert sorted(donor["email"] for donor in available) == ["abe@example.com", "ana@example.com"]
+assert all(donor["available"] for donor in available)
+assert [d["email"] for d in client.get("/api/donors?available=true&bloodGroup=A%2B").get_json()] == ["abe@example.com"]
+assert client.get("/api/donors?available=true&bloodGroup=O%2B&city=Nowhere").get_json() == []
+paged, after = [], None
+while True:
+    page = client.get("/api/donors?available=true&limit=1" + (f"&after={after}" if after else "")).get_json()
+    paged.extend(donor["id"] for donor in page["items"])
+    after = page["nextCursor"]
+    if not after:
+        break
+assert paged == [donor["id"] for donor in available]
+
+server_aws.requests_table.update_item(
+    Key={"id": created["id"]}, UpdateExpression="SET #s = :s",
+    ExpressionAttributeNames={"#s": "status"}, ExpressionAttributeValues={":s": "FULFILLED"}
+)
+open_requests = client.get("/api/requests?status=OPEN").get_json()
+assert len(open_requests) == 2 and created["id"] not in [req["id"] for req in open_requests]
+assert [req["id"] for req in client.get("/api/requests?status=FULFILLED").get_json()] == [created["id"]]
+assert len(client.get("/api/requests?status=OPEN&urgency=LOW").get_json()) == 2
+page = client.get("/api/requests?status=OPEN&limit=1").get_json()
+rest = client.get(f"/api/requests?status=OPEN&after={page['nextCursor']}").get_json()
+assert [req["id"] for req in page["items"] + rest["items"]] == [req["id"] for req in open_requests]
+assert queries == []
+server_aws.scan_page = scan_page
+print(f"   Available donors: {len(available)}, open requests: {len(open_requests)}")
+
+mock.stop()
+
+print("\n" + "=" * 70)
+print("All tests completed successfully!")
+print("=" * 70)
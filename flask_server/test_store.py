@@ -0,0 +1,188 @@
+"""
+Test script for the indexed in-memory record store
+"""
+
+import threading
+
+import store
+from store import RecordStore, DuplicateKeyError
+
+
+def make_donors():
+    return RecordStore(
+        [
+            {"id": 1, "email": "ana@example.com", "bloodGroup": "O+", "available": True},
+            {"id": 2, "email": "ben@example.com", "bloodGroup": "A+", "available": False},
+            {"id": 3, "email": "", "bloodGroup": "O+", "available": False},
+            {"id": 4, "email": "", "bloodGroup": "O+", "available": True},
+        ],
+        unique=("email",),
+        indexed=("bloodGroup", "available"),
+    )
+
+
+print("=" * 70)
+print("Testing Record Store")
+print("=" * 70)
+
+# Test 1: Unique indexes
+print("\n1. Unique Indexes:")
+donors = make_donors()
+assert donors.get(2)["email"] == "ben@example.com" and donors.get(9) is None
+assert donors.find("email", "ana@example.com")["id"] == 1
+assert donors.find("email", "nobody@example.com") is None
+# Empty values are not indexed, so donors 3 and 4 do not conflict
+assert donors.find("email", "") is None
+for duplicate, field in [({"id": 2, "email": "new@example.com"}, "id"),
+                         ({"id": 5, "email": "ana@example.com"}, "email")]:
+    try:
+        donors.insert(duplicate)
+        raise AssertionError(f"duplicate {field} accepted")
+    except DuplicateKeyError as e:
+        assert e.field == field
+assert len(donors) == 4
+donors.delete(1)
+assert donors.find("email", "ana@example.com") is None
+donors.insert({"id": 5, "email": "ana@example.com", "bloodGroup": "B+", "available": True})
+assert donors.find("email", "ana@example.com")["id"] == 5
+assert donors.allocate_id() == 6
+print(f"   Lookups by email: {[d['id'] for d in donors if d['email']]}")
+
+# Test 2: Filter indexes follow reindexed changes
+print("\n2. Filter Indexes:")
+donors = make_donors()
+records, _ = donors.query({"bloodGroup": "O+", "available": True})
+assert [d["id"] for d in records] == [1, 4]
+assert donors.count("bloodGroup", "O+") == 3 and donors.count("bloodGroup", "AB-") == 0
+donors.update(3, lambda donor: donor.update(available=True))
+donors.get(1)["bloodGroup"] = "B-"
+donors.reindex(1)
+records, _ = donors.query({"bloodGroup": "O+", "available": True})
+assert [d["id"] for d in records] == [3, 4]
+assert [d["id"] for d in donors.query({"bloodGroup": "B-"})[0]] == [1]
+donors.delete(4)
+assert [d["id"] for d in donors.query({"available": True})[0]] == [1, 3]
+try:
+    donors.query({"email": "ben@example.com"})
+    raise AssertionError("query on a field without a filter index accepted")
+except ValueError:
+    pass
+print(f"   Available O+ donors after the changes: {[d['id'] for d in records]}")
+
+# Test 3: Cursor pagination
+print("\n3. Query Pagination:")
+donors = RecordStore(
+    [{"id": key, "bloodGroup": "O+" if key % 3 else "A-"} for key in range(1, 31)],
+    indexed=("bloodGroup",),
+)
+for filters in ({}, {"bloodGroup": "O+"}, {"bloodGroup": "A-"}):
+    expected = [d["id"] for d in donors.query(filters)[0]]
+    paged, after = [], None
+    while True:
+        records, after = donors.query(filters, after=after, limit=4)
+        assert len(records) <= 4
+        paged.extend(d["id"] for d in records)
+        if after is None:
+            break
+        assert after == records[-1]["id"]
+    assert paged == expected
+# A page ending on the last match has no next cursor
+records, after = donors.query({"bloodGroup": "A-"}, limit=10)
+assert len(records) == 10 and after is None
+assert donors.query({"bloodGroup": "AB+"}) == ([], None)
+print(f"   O+ donors: {donors.count('bloodGroup', 'O+')}, A- donors: {donors.count('bloodGroup', 'A-')}")
+
+# Test 4: Live counters of value combinations
+print("\n4. Counters:")
+donors = RecordStore(
+    [{"id": 1, "bloodGroup": "O+", "available": True},
+     {"id": 2, "bloodGroup": "O+", "available": False},
+     {"id": 3, "bloodGroup": "A+", "available": True}],
+    indexed=("bloodGroup", "available"),
+    counted=[("bloodGroup", "available"), ("available",)],
+)
+
+
+def recount(*fields):
+    counts = {}
+    for donor in donors:
+        combination = tuple(donor.get(field) for field in fields)
+        counts[combination] = counts.get(combination, 0) + 1
+    return counts
+
+
+assert donors.tally("available") == {(True,): 2, (False,): 1}
+donors.insert({"id": 4, "bloodGroup": "B-", "available": True})
+donors.update(2, lambda donor: donor.update(available=True))
+donors.update(3, lambda donor: donor.update(bloodGroup="AB+"))
+donors.delete(1)
+# Reindexing an unchanged record does not count it twice
+donors.reindex(4)
+for fields in [("bloodGroup", "available"), ("available",)]:
+    assert donors.tally(*fields) == recount(*fields), fields
+assert donors.tally("available") == {(True,): 3}
+assert ("O+", False) not in donors.tally("bloodGroup", "available")
+counts = donors.tally("bloodGroup", "available")
+donors.clear()
+assert donors.tally("available") == {}
+try:
+    RecordStore(counted=[("city",)])
+    raise AssertionError("counter on a field without a filter index accepted")
+except ValueError:
+    pass
+print(f"   Counts per (bloodGroup, available): {counts}")
+
+# Test 5: Queries walk bounded windows of ids while writers keep going
+print("\n5. Query Windows:")
+windows = store.QUERY_WINDOW, store.QUERY_WINDOW_MAX
+store.QUERY_WINDOW, store.QUERY_WINDOW_MAX = 2, 8
+requests = RecordStore(
+    [{"id": key, "status": "OPEN" if key % 10 == 0 else "CLOSED"} for key in range(1, 101)],
+    indexed=("status",),
+)
+# Sparse matches are found across many windows, and pages still end at the limit
+assert [r["id"] for r in requests.query({"status": "OPEN"})[0]] == list(range(10, 101, 10))
+records, after = requests.query({"status": "CLOSED"}, limit=5)
+assert [r["id"] for r in records] == [1, 2, 3, 4, 5] and after == 5
+# A record changed behind the cursor is checked as it is when reached
+requests.update(9, lambda req: req.update(status="OPEN"))
+records, after = requests.query({"status": "CLOSED"}, after=after)
+assert 9 not in [r["id"] for r in records] and after is None
+
+# Records inserted and deleted during a paged walk
+stop = threading.Event()
+walks = []
+
+
+def churn():
+    key = 1000
+    while not stop.is_set():
+        requests.insert({"id": key, "status": "OPEN"})
+        requests.delete(key)
+        key += 1
+
+
+writer = threading.Thread(target=churn)
+writer.start()
+try:
+    for _ in range(20):
+        paged, after = [], None
+        while True:
+            records, after = requests.query({"status": "OPEN"}, after=after, limit=3)
+            paged.extend(r["id"] for r in records)
+            if after is None:
+                break
+        walks.append(paged)
+finally:
+    stop.set()
+    writer.join()
+    store.QUERY_WINDOW, store.QUERY_WINDOW_MAX = windows
+expected = [9] + list(range(10, 101, 10))
+for paged in walks:
+    # Every stored match exactly once, in id order, plus churned ones still present
+    assert paged == sorted(set(paged)) and [key for key in paged if key < 1000] == expected
+print(f"   Paged walks during concurrent writes: {len(walks)}")
+
+print("\n" + "=" * 70)
+print("All tests completed successfully!")
+print("=" * 70)